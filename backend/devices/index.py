@@ -1,96 +1,681 @@
 """API для управления устройствами"""
+import base64
+import csv
+import functools
+import hashlib
+import importlib
+import io
 import json
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from array import array
 from datetime import datetime
 
-def get_db_connection():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+FUNCTION_NAME = 'devices'
 
-def handler(event: dict, context) -> dict:
+# >>> shared/framework.py (источник - scripts/shared/framework.py)
+class LazyModule:
+    """Модуль, импортируемый при первом обращении к атрибуту
+
+    Подмодули (psycopg2.extras, psycopg2.pool) подгружаются так же, поэтому
+    preflight и ответы из кэша не платят за импорт драйвера базы и HTTP-клиента.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        try:
+            return getattr(self._module, attr)
+        except AttributeError:
+            return importlib.import_module(f'{self._name}.{attr}')
+
+psycopg2 = LazyModule('psycopg2')
+
+def json_response(status, payload, headers=None):
+    """JSON-ответ функции с CORS-заголовком; headers дополняют стандартные"""
+    response_headers = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+    if headers:
+        response_headers.update(headers)
+    return {'statusCode': status, 'headers': response_headers, 'body': json.dumps(payload), 'isBase64Encoded': False}
+
+def read_json_body(event):
+    return json.loads(event.get('body') or '{}')
+
+def get_header(headers, name):
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+def route_request(event, routes, allow_headers='Content-Type'):
+    """Мини-роутер: preflight, выбор маршрута по (метод, action), 404/405 и ошибки в 500
+
+    routes - {(метод, action или None): функция(event)}. OPTIONS отвечает сразу,
+    не трогая базу и не импортируя драйвер.
+    """
     method = event.get('httpMethod', 'GET')
-    
+    methods = list(dict.fromkeys(route_method for route_method, _ in routes))
     if method == 'OPTIONS':
         return {
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type'
+                'Access-Control-Allow-Methods': ', '.join(methods + ['OPTIONS']),
+                'Access-Control-Allow-Headers': allow_headers
             },
-            'body': ''
+            'body': '',
+            'isBase64Encoded': False
         }
-    
+    if method not in methods:
+        return json_response(405, {'error': 'Method not allowed'})
+    action = (event.get('queryStringParameters') or {}).get('action')
+    route = routes.get((method, action)) or routes.get((method, None))
+    if route is None:
+        return json_response(404, {'error': 'Endpoint not found'})
     try:
-        if method == 'GET':
-            return get_devices()
-        elif method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            return create_device(body)
-        elif method == 'PUT':
-            body = json.loads(event.get('body', '{}'))
-            device_id = body.get('id')
-            return update_device(device_id, body)
-        elif method == 'DELETE':
-            query_params = event.get('queryStringParameters', {})
-            device_id = query_params.get('id')
-            return delete_device(device_id)
-        else:
-            return {
-                'statusCode': 405,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Method not allowed'})
-            }
+        return route(event)
     except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': str(e)})
-        }
+        return json_response(500, {'error': str(e)})
+
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0.05'))
+
+# Трассировка запроса: участки, число SQL-запросов и строк; вне выборки почти бесплатна
+_trace = threading.local()
+_traced_cursor_classes = {}
+_traced_connection = None
+
+@contextmanager
+def span(name):
+    """Добавляет длительность участка к текущей трассировке, если запрос попал в выборку"""
+    spans = getattr(_trace, 'spans', None)
+    if spans is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        spans[name] = spans.get(name, 0.0) + (time.perf_counter() - started) * 1000
+
+def _traced_cursor_class(base):
+    cursor_class = _traced_cursor_classes.get(base)
+    if cursor_class is None:
+        def execute(self, query, vars=None):
+            if getattr(_trace, 'spans', None) is None:
+                return base.execute(self, query, vars)
+            with span('query'):
+                result = base.execute(self, query, vars)
+            _trace.queries += 1
+            _trace.rows += max(self.rowcount, 0)
+            return result
+        cursor_class = type('Traced' + base.__name__, (base,), {'execute': execute})
+        _traced_cursor_classes[base] = cursor_class
+    return cursor_class
+
+def traced_connection_class():
+    """Класс соединения, курсоры которого отчитываются в трассировку; создаётся при первом подключении"""
+    global _traced_connection
+    if _traced_connection is None:
+        class TracedConnection(psycopg2.extensions.connection):
+            def cursor(self, *args, **kwargs):
+                base = kwargs.pop('cursor_factory', None) or self.cursor_factory or psycopg2.extensions.cursor
+                return super().cursor(*args, cursor_factory=_traced_cursor_class(base), **kwargs)
+
+            def commit(self):
+                with span('commit'):
+                    return super().commit()
+        _traced_connection = TracedConnection
+    return _traced_connection
+
+def traced(handler):
+    """Оборачивает handler: сэмплированные запросы получают Server-Timing и строку лога с метриками пула"""
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        headers = event.get('headers') or {}
+        forced = any(key.lower() == 'x-trace' for key in headers)
+        if not forced and random.random() >= TRACE_SAMPLE_RATE:
+            return handler(event, context)
+        _trace.spans = {}
+        _trace.queries = 0
+        _trace.rows = 0
+        started = time.perf_counter()
+        try:
+            response = handler(event, context)
+        finally:
+            total = (time.perf_counter() - started) * 1000
+            spans = _trace.spans
+            _trace.spans = None
+        timings = [f'{name};dur={duration:.2f}' for name, duration in spans.items()]
+        timings.append(f'db;desc="{_trace.queries} queries, {_trace.rows} rows"')
+        timings.append(f'total;dur={total:.2f}')
+        response_headers = response.setdefault('headers', {})
+        response_headers['Server-Timing'] = ', '.join(timings)
+        response_headers['Access-Control-Expose-Headers'] = ', '.join(
+            filter(None, [response_headers.get('Access-Control-Expose-Headers'), 'Server-Timing'])
+        )
+        print(json.dumps({
+            'function': FUNCTION_NAME,
+            'method': event.get('httpMethod'),
+            'action': (event.get('queryStringParameters') or {}).get('action'),
+            'status': response.get('statusCode'),
+            'total_ms': round(total, 2),
+            'spans': {name: round(duration, 2) for name, duration in spans.items()},
+            'queries': _trace.queries,
+            'rows': _trace.rows,
+            'pool': get_pool_stats()
+        }))
+        return response
+    return wrapper
+
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_MAX_AGE = float(os.environ.get('DB_POOL_MAX_AGE', '300'))
+DB_POOL_CHECK_AFTER = float(os.environ.get('DB_POOL_CHECK_AFTER', '30'))
+DB_POOL_WAIT_TIMEOUT = float(os.environ.get('DB_POOL_WAIT_TIMEOUT', '5'))
+
+# Пул живёт на уровне модуля и переживает тёплые вызовы функции
+_pool_cond = threading.Condition()
+_pool_idle = []
+_pool_meta = {}
+_pool_stats = {'size': 0, 'hits': 0, 'misses': 0, 'replaced': 0, 'waits': 0, 'wait_ms': 0.0}
+
+def get_db_connection():
+    """Выдаёт соединение из пула; ожидание и подключение попадают в трассировку как db_connect"""
+    with span('db_connect'):
+        return _checkout_connection()
+
+def _checkout_connection():
+    """Выдаёт соединение из пула процесса, заменяя устаревшие и разорванные"""
+    started = time.monotonic()
+    while True:
+        conn = _checkout_idle_connection(started)
+        if conn is None:
+            break
+        if _is_connection_usable(conn):
+            return conn
+        _discard_connection(conn)
+        _pool_stats['replaced'] += 1
+    try:
+        conn = psycopg2.connect(os.environ['DATABASE_URL'], connection_factory=traced_connection_class())
+    except Exception:
+        with _pool_cond:
+            _pool_stats['size'] -= 1
+            _pool_cond.notify()
+        raise
+    now = time.monotonic()
+    _pool_meta[conn] = {'created': now, 'used': now}
+    return conn
+
+def _checkout_idle_connection(started):
+    with _pool_cond:
+        while True:
+            if _pool_idle:
+                _pool_stats['hits'] += 1
+                _pool_stats['wait_ms'] += (time.monotonic() - started) * 1000
+                return _pool_idle.pop()
+            if _pool_stats['size'] < DB_POOL_MAX_SIZE:
+                _pool_stats['size'] += 1
+                _pool_stats['misses'] += 1
+                _pool_stats['wait_ms'] += (time.monotonic() - started) * 1000
+                return None
+            remaining = DB_POOL_WAIT_TIMEOUT - (time.monotonic() - started)
+            if remaining <= 0:
+                raise psycopg2.pool.PoolError('Connection pool exhausted')
+            _pool_stats['waits'] += 1
+            _pool_cond.wait(remaining)
+
+def _is_connection_usable(conn):
+    if conn.closed:
+        return False
+    meta = _pool_meta.get(conn)
+    now = time.monotonic()
+    if not meta or now - meta['created'] > DB_POOL_MAX_AGE:
+        return False
+    if now - meta['used'] > DB_POOL_CHECK_AFTER:
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+        except psycopg2.Error:
+            return False
+    return True
+
+def _discard_connection(conn):
+    _pool_meta.pop(conn, None)
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+    with _pool_cond:
+        _pool_stats['size'] -= 1
+        _pool_cond.notify()
+
+def release_db_connection(conn):
+    """Возвращает соединение в пул после отката незавершённой транзакции"""
+    try:
+        conn.rollback()
+    except psycopg2.Error:
+        pass
+    if conn.closed:
+        _discard_connection(conn)
+        return
+    _pool_meta[conn]['used'] = time.monotonic()
+    with _pool_cond:
+        _pool_idle.append(conn)
+        _pool_cond.notify()
+
+def get_pool_stats():
+    """Метрики пула: попадания, промахи, замены и суммарное ожидание"""
+    with _pool_cond:
+        stats = dict(_pool_stats)
+        stats['idle'] = len(_pool_idle)
+    stats['max_size'] = DB_POOL_MAX_SIZE
+    return stats
+# <<< shared/framework.py
+
+@traced
+def handler(event: dict, context) -> dict:
+    return route_request(event, {
+        ('GET', None): lambda event: get_devices(event.get('queryStringParameters') or {}, event.get('headers') or {}),
+        ('POST', None): lambda event: create_device(read_json_body(event)),
+        ('PUT', None): lambda event: update_device(read_json_body(event)),
+        ('DELETE', None): lambda event: delete_device((event.get('queryStringParameters') or {}).get('id')),
+        ('POST', 'import'): import_devices,
+        ('GET', 'export'): export_devices,
+        ('GET', 'code_sets'): lambda event: search_code_sets(event.get('queryStringParameters') or {}),
+        ('PUT', 'code_sets'): lambda event: save_code_set(read_json_body(event))
+    }, allow_headers='Content-Type, If-None-Match')
+
+# >>> shared/codec.py (источник - scripts/shared/codec.py)
+IR_PROTOCOLS = ('NEC', 'NECX', 'SAMSUNG', 'SONY', 'RC5', 'RC6', 'PANASONIC', 'JVC', 'LG', 'SHARP')
+PRONTO_UNIT_US = 0.241246
+MAX_TIMINGS = 512
+
+def encode_ir_code(ir_code):
+    """Нормализует ИК-код в компактную посылку для блока
+
+    Поддерживаются "ПРОТОКОЛ:0xЗНАЧЕНИЕ[:биты]" (NEC раскладывается на адрес и
+    команду), Pronto Hex, "raw:частота:мкс,мкс,..." и короткие hex-коды, которые
+    передаются как есть. Тайминги упаковываются в uint16 и base64.
+    Нераспознанный формат - ValueError.
+    """
+    code = ir_code.strip() if isinstance(ir_code, str) else ''
+    if not code:
+        raise ValueError('IR code must be a non-empty string')
+    words = code.split()
+    if len(words) > 4 and all(len(word) == 4 for word in words):
+        return _encode_pronto(words)
+    if code.lower().startswith('raw:'):
+        return _encode_raw(code)
+    if ':' in code:
+        return _encode_protocol(code)
+    if len(code) <= 16 and all(char in '0123456789abcdefABCDEF' for char in code):
+        return {'code': code.upper()}
+    raise ValueError(f'Unrecognised IR code format: {code[:32]}')
+
+def _encode_protocol(code):
+    parts = code.split(':')
+    protocol = parts[0].upper()
+    if protocol not in IR_PROTOCOLS or len(parts) > 3:
+        raise ValueError(f'Unsupported IR protocol: {parts[0]}')
+    try:
+        value = int(parts[1], 16)
+        bits = int(parts[2]) if len(parts) == 3 else None
+    except ValueError:
+        raise ValueError(f'Invalid {protocol} code value: {parts[1]}')
+    if protocol == 'NEC' and bits in (None, 32):
+        if not 0 <= value <= 0xFFFFFFFF:
+            raise ValueError('NEC code must fit in 32 bits')
+        address, address_inv, command, command_inv = value.to_bytes(4, 'big')
+        if command ^ command_inv != 0xFF:
+            raise ValueError('NEC command byte fails its inverse check')
+        if address ^ address_inv != 0xFF:
+            # Расширенный NEC: 16-битный адрес без инверсии
+            address = (address << 8) | address_inv
+        return {'p': 'NEC', 'a': address, 'c': command}
+    payload = {'p': protocol, 'v': value}
+    if bits:
+        payload['b'] = bits
+    return payload
+
+def _encode_pronto(words):
+    try:
+        values = [int(word, 16) for word in words]
+    except ValueError:
+        raise ValueError('Pronto code must consist of 4-digit hex words')
+    kind, frequency_word, once_pairs, repeat_pairs = values[:4]
+    if kind != 0 or not frequency_word:
+        raise ValueError('Only learned (0000) Pronto codes are supported')
+    if len(values) != 4 + 2 * (once_pairs + repeat_pairs):
+        raise ValueError('Pronto code length does not match its burst pair counts')
+    period_us = frequency_word * PRONTO_UNIT_US
+    timings = [round(value * period_us) for value in values[4:]]
+    return _pack_timings(round(1000000 / period_us), timings, 2 * once_pairs)
+
+def _encode_raw(code):
+    parts = code.split(':')
+    try:
+        frequency = int(parts[1])
+        timings = [int(value) for value in parts[2].split(',')]
+    except (IndexError, ValueError):
+        raise ValueError('Raw code must look like raw:38000:9000,4500,...')
+    return _pack_timings(frequency, timings, len(timings))
+
+def _pack_timings(frequency, timings, repeat_from):
+    if not 10000 <= frequency <= 500000:
+        raise ValueError(f'Carrier frequency out of range: {frequency}')
+    if not timings or len(timings) % 2 or len(timings) > MAX_TIMINGS:
+        raise ValueError('Timings must be a non-empty even list of mark/space durations')
+    if any(value <= 0 for value in timings) or any(mark > 0xFFFF for mark in timings[::2]):
+        raise ValueError('Marks must be between 1 and 65535 us')
+    # Паузы длиннее 65 мс для блока неотличимы от тишины, обрезаем их до uint16
+    packed_timings = array('H', [min(value, 0xFFFF) for value in timings])
+    if sys.byteorder == 'big':
+        packed_timings.byteswap()
+    packed = base64.b64encode(packed_timings.tobytes()).decode()
+    payload = {'p': 'RAW', 'f': frequency, 't': packed}
+    if repeat_from < len(timings):
+        payload['r'] = repeat_from
+    return payload
+# <<< shared/codec.py
+
+def build_ir_payloads(ir_codes):
+    """Предкодирует посылки для всех кнопок; нераспознанные коды уходят блоку как есть"""
+    payloads = {}
+    for button, ir_code in (ir_codes or {}).items():
+        try:
+            payloads[button] = encode_ir_code(ir_code)
+        except ValueError:
+            payloads[button] = {'code': ir_code}
+    return payloads
 
-def get_devices():
+DEVICE_FIELDS = (
+    'id', 'name', 'model', 'type', 'brand', 'ir_codes', 'status',
+    'room', 'bridge_id', 'fallback_bridge_id', 'code_set_id', 'ir_overrides', 'created_at', 'updated_at'
+)
+# ir_codes - набор из библиотеки с собственными кодами устройства поверх, ir_overrides - только собственные
+DEVICE_FIELD_SQL = {
+    'ir_codes': "coalesce(cs.codes, '{}'::jsonb) || coalesce(d.ir_codes, '{}'::jsonb)",
+    'ir_overrides': "coalesce(d.ir_codes, '{}'::jsonb)"
+}
+DEVICE_RETURNING = '''
+    id, name, model, type, brand, status, room, bridge_id, fallback_bridge_id, code_set_id, created_at, updated_at,
+    coalesce((SELECT cs.codes FROM t_p77920312_universal_remote_app.ir_code_sets cs WHERE cs.id = code_set_id),
+             '{}'::jsonb) || ir_codes AS ir_codes,
+    ir_codes AS ir_overrides
+'''
+DEVICE_MAX_PAGE_SIZE = 500
+# Колонки, которые PUT меняет, только если ключ есть в теле: частичное тело не стирает остальное
+DEVICE_UPDATE_COLUMNS = ('name', 'model', 'type', 'brand', 'status', 'room', 'bridge_id', 'fallback_bridge_id')
+
+def device_columns(fields):
+    """Список выборки для devices d LEFT JOIN ir_code_sets cs"""
+    return ', '.join(f"{DEVICE_FIELD_SQL.get(field, 'd.' + field)} AS {field}" for field in fields)
+
+def parse_device_fields(value):
+    """Разбирает fields=id,name,... ; без параметра отдаются все поля"""
+    if not value:
+        return DEVICE_FIELDS
+    fields = tuple(dict.fromkeys(field.strip() for field in value.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in DEVICE_FIELDS]
+    if unknown or not fields:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+def encode_device_cursor(created_at, device_id):
+    raw = f'{created_at.isoformat()}|{device_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_device_cursor(cursor):
+    try:
+        created_at, device_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), int(device_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Invalid cursor')
+
+def json_page_query(query, columns, limit):
+    """Оборачивает выборку так, что JSON-массив страницы собирает сам PostgreSQL
+
+    query отдаёт колонки columns, а также cursor_created_at и cursor_id, в порядке
+    (created_at, id) по убыванию; строк в ней может быть на одну больше limit.
+    Результат запроса: текст массива (временные метки уже в ISO 8601), число
+    строк выборки и курсор последней строки страницы. Параметры: limit трижды,
+    затем параметры query.
+    """
+    pairs = ', '.join(f"'{column}', {column}" for column in columns)
+    page_filter = 'FILTER (WHERE rn <= %s)'
+    last_row = '''
+               (array_agg(cursor_created_at ORDER BY rn))[%s] AS last_created_at,
+               (array_agg(cursor_id ORDER BY rn))[%s] AS last_id'''
+    if limit is None:
+        page_filter = ''
+        last_row = 'NULL AS last_created_at, NULL AS last_id'
+    return f'''
+        SELECT coalesce(json_agg(json_build_object({pairs}) ORDER BY rn) {page_filter}, '[]')::text AS rows_json,
+               count(*) AS total, {last_row}
+        FROM (
+            SELECT page.*, row_number() OVER (ORDER BY cursor_created_at DESC, cursor_id DESC) AS rn
+            FROM ({query}) page
+        ) numbered
+    '''
+
+def get_devices(params, headers):
+    """Список устройств с проекцией полей, keyset-пагинацией и ETag
+
+    ETag строится из числа строк и max(updated_at), поэтому неизменившийся
+    список отвечает 304 без выборки и сериализации самих устройств.
+    """
+    try:
+        fields = parse_device_fields(params.get('fields'))
+        limit = int(params['limit']) if params.get('limit') else None
+        cursor = decode_device_cursor(params['cursor']) if params.get('cursor') else None
+    except ValueError as e:
+        return json_response(400, {'error': str(e)})
+    if limit is not None and not 1 <= limit <= DEVICE_MAX_PAGE_SIZE:
+        return json_response(400, {'error': f'limit must be between 1 and {DEVICE_MAX_PAGE_SIZE}'})
+    
     conn = get_db_connection()
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
             cur.execute("""
-                SELECT id, name, model, type, brand, ir_codes, status, 
-                       created_at, updated_at
+                SELECT count(*) AS total, max(updated_at) AS last_updated
                 FROM t_p77920312_universal_remote_app.devices
-                ORDER BY created_at DESC
             """)
-            devices = cur.fetchall()
+            version = cur.fetchone()
+            variant = f"{version['total']}|{version['last_updated']}|{','.join(fields)}|{limit}|{params.get('cursor')}"
+            etag = '"' + hashlib.md5(variant.encode()).hexdigest() + '"'
+            cache_headers = {
+                'ETag': etag,
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Expose-Headers': 'ETag, X-Next-Cursor'
+            }
             
-            for device in devices:
-                if device['created_at']:
-                    device['created_at'] = device['created_at'].isoformat()
-                if device['updated_at']:
-                    device['updated_at'] = device['updated_at'].isoformat()
+            if get_header(headers, 'if-none-match') == etag:
+                return {'statusCode': 304, 'headers': cache_headers, 'body': ''}
             
+            where = ''
+            query_params = [limit] * 3 if limit is not None else []
+            if cursor:
+                where = 'WHERE (d.created_at, d.id) < (%s, %s)'
+                query_params.extend(cursor)
+            page = ''
+            if limit is not None:
+                page = 'LIMIT %s'
+                query_params.append(limit + 1)
+            # Массив собирает PostgreSQL: строки не разбираются в Python и не кодируются заново
+            cur.execute(json_page_query(f"""
+                SELECT {device_columns(fields)}, d.created_at AS cursor_created_at, d.id AS cursor_id
+                FROM t_p77920312_universal_remote_app.devices d
+                LEFT JOIN t_p77920312_universal_remote_app.ir_code_sets cs ON cs.id = d.code_set_id
+                {where}
+                ORDER BY d.created_at DESC, d.id DESC
+                {page}
+            """, fields, limit), query_params)
+            result = cur.fetchone()
+            
+            if limit is not None and result['total'] > limit and result['last_created_at']:
+                cache_headers['X-Next-Cursor'] = encode_device_cursor(result['last_created_at'], result['last_id'])
+            
+            cache_headers['Content-Type'] = 'application/json'
             return {
                 'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps(devices)
+                'headers': cache_headers,
+                'body': result['rows_json']
             }
     finally:
-        conn.close()
+        release_db_connection(conn)
 
-def create_device(data):
+CODE_SET_SEARCH_LIMIT = 20
+
+def upsert_code_set(cur, codes):
+    """id набора с таким содержимым, создавая его при первой встрече
+
+    Хэш считается от канонического текста jsonb в самой базе, поэтому не
+    зависит от порядка ключей в запросе и совпадает с переносом из V0008.
+    """
+    codes_json = json.dumps(codes)
+    cur.execute("""
+        WITH inserted AS (
+            INSERT INTO t_p77920312_universal_remote_app.ir_code_sets (content_hash, codes, payloads)
+            VALUES (md5(%s::jsonb::text), %s::jsonb, %s::jsonb)
+            ON CONFLICT (content_hash) DO NOTHING
+            RETURNING id
+        )
+        SELECT id FROM inserted
+        UNION ALL
+        SELECT id FROM t_p77920312_universal_remote_app.ir_code_sets WHERE content_hash = md5(%s::jsonb::text)
+        LIMIT 1
+    """, (codes_json, codes_json, json.dumps(build_ir_payloads(codes)), codes_json))
+    row = cur.fetchone()
+    return row['id'] if isinstance(row, dict) else row[0]
+
+def parse_code_set_id(value):
+    """code_set_id из тела запроса: целое или None, иначе ValueError"""
+    if value is None or (isinstance(value, int) and not isinstance(value, bool)):
+        return value
+    raise ValueError('code_set_id must be an integer')
+
+def resolve_code_set(cur, data):
+    """(code_set_id, собственные коды) для записи устройства; неверный набор или коды - ValueError
+
+    С явным code_set_id собственными остаются только коды, которые отличаются
+    от набора. Без него ir_codes целиком становятся набором: одинаковые наборы
+    хранятся один раз.
+    """
+    ir_codes = data.get('ir_codes') or {}
+    if not isinstance(ir_codes, dict):
+        raise ValueError('ir_codes must be an object')
+    code_set_id = parse_code_set_id(data.get('code_set_id'))
+    if code_set_id is not None:
+        cur.execute("""
+            SELECT codes FROM t_p77920312_universal_remote_app.ir_code_sets WHERE id = %s
+        """, (code_set_id,))
+        row = cur.fetchone()
+        if not row:
+            raise ValueError(f'Code set {code_set_id} not found')
+        set_codes = row['codes'] if isinstance(row, dict) else row[0]
+        return code_set_id, {button: code for button, code in ir_codes.items() if set_codes.get(button) != code}
+    if not ir_codes:
+        return None, {}
+    return upsert_code_set(cur, ir_codes), {}
+
+def search_code_sets(params):
+    """Подбор кодов по бренду и модели: начало строки или нечёткое совпадение по триграммам"""
+    query = (params.get('q') or '').strip().lower()
+    if not query:
+        return json_response(400, {'error': 'q is required'})
+    prefix = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    type_filter = ''
+    query_params = [query, query, prefix, prefix]
+    if params.get('type'):
+        type_filter = 'AND m.type = %s'
+        query_params.append(params['type'])
+    query_params.append(CODE_SET_SEARCH_LIMIT)
+    
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            # Условия OR покрываются тремя индексами V0008 через BitmapOr
+            cur.execute(f"""
+                SELECT coalesce(json_agg(json_build_object(
+                    'code_set_id', m.code_set_id, 'brand', m.brand, 'model', m.model, 'type', m.type,
+                    'ir_codes', s.codes
+                ) ORDER BY m.rank DESC, m.brand, m.model), '[]')::text
+                FROM (
+                    SELECT m.*, similarity(lower(m.brand || ' ' || m.model), %s) AS rank
+                    FROM t_p77920312_universal_remote_app.ir_code_models m
+                    WHERE (lower(m.brand || ' ' || m.model) %% %s
+                           OR lower(m.model) LIKE %s OR lower(m.brand) LIKE %s)
+                      {type_filter}
+                    ORDER BY rank DESC, m.brand, m.model
+                    LIMIT %s
+                ) m
+                JOIN t_p77920312_universal_remote_app.ir_code_sets s ON s.id = m.code_set_id
+            """, query_params)
+            code_sets_json = cur.fetchone()[0]
+    finally:
+        release_db_connection(conn)
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': f'{{"code_sets": {code_sets_json}}}'
+    }
+
+def save_code_set(data):
+    """Добавляет или переназначает модель в библиотеке; набор кодов дедуплицируется по содержимому"""
+    brand = (data.get('brand') or '').strip()
+    model = (data.get('model') or '').strip()
+    ir_codes = data.get('ir_codes')
+    if not brand or not model or not isinstance(ir_codes, dict) or not ir_codes:
+        return json_response(400, {'error': 'brand, model and non-empty ir_codes are required'})
+    
     conn = get_db_connection()
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        with conn.cursor() as cur:
+            code_set_id = upsert_code_set(cur, ir_codes)
             cur.execute("""
+                INSERT INTO t_p77920312_universal_remote_app.ir_code_models (brand, model, type, code_set_id)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (brand, model)
+                DO UPDATE SET type = EXCLUDED.type, code_set_id = EXCLUDED.code_set_id
+            """, (brand, model, data.get('type'), code_set_id))
+            conn.commit()
+        return json_response(200, {'code_set_id': code_set_id, 'brand': brand, 'model': model})
+    finally:
+        release_db_connection(conn)
+
+def create_device(data):
+    conn = get_db_connection()
+    try:
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            try:
+                code_set_id, overrides = resolve_code_set(cur, data)
+            except ValueError as e:
+                return json_response(400, {'error': str(e)})
+            cur.execute(f"""
                 INSERT INTO t_p77920312_universal_remote_app.devices 
-                (name, model, type, brand, ir_codes, status)
-                VALUES (%s, %s, %s, %s, %s, %s)
-                RETURNING id, name, model, type, brand, ir_codes, status, created_at, updated_at
+                (name, model, type, brand, code_set_id, ir_codes, ir_payloads, status, room, bridge_id, fallback_bridge_id)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                RETURNING {DEVICE_RETURNING}
             """, (
                 data.get('name'),
                 data.get('model', ''),
                 data.get('type', 'tv'),
                 data.get('brand', ''),
-                json.dumps(data.get('ir_codes', {})),
-                data.get('status', 'offline')
+                code_set_id,
+                json.dumps(overrides),
+                json.dumps(build_ir_payloads(overrides)),
+                data.get('status', 'offline'),
+                data.get('room'),
+                data.get('bridge_id'),
+                data.get('fallback_bridge_id')
             ))
             device = cur.fetchone()
             conn.commit()
@@ -100,70 +685,56 @@ def create_device(data):
             if device['updated_at']:
                 device['updated_at'] = device['updated_at'].isoformat()
             
-            return {
-                'statusCode': 201,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps(device)
-            }
+            return json_response(201, device)
     finally:
-        conn.close()
+        release_db_connection(conn)
 
-def update_device(device_id, data):
+def update_device(data):
+    device_id = data.get('id')
     if not device_id:
-        return {
-            'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Device ID is required'})
-        }
+        return json_response(400, {'error': 'Device ID is required'})
     
     conn = get_db_connection()
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            assignments = [(column, data[column]) for column in DEVICE_UPDATE_COLUMNS if column in data]
+            # Без ir_codes набор и собственные коды устройства не трогаются
+            try:
+                if 'ir_codes' in data:
+                    code_set_id, overrides = resolve_code_set(cur, data)
+                    assignments += [
+                        ('code_set_id', code_set_id),
+                        ('ir_codes', json.dumps(overrides)),
+                        ('ir_payloads', json.dumps(build_ir_payloads(overrides)))
+                    ]
+                elif 'code_set_id' in data:
+                    assignments.append(('code_set_id', parse_code_set_id(data['code_set_id'])))
+            except ValueError as e:
+                return json_response(400, {'error': str(e)})
+            cur.execute(f"""
                 UPDATE t_p77920312_universal_remote_app.devices
-                SET name = %s, model = %s, type = %s, brand = %s, 
-                    ir_codes = %s, status = %s, updated_at = CURRENT_TIMESTAMP
+                SET {''.join(f'{column} = %s, ' for column, _ in assignments)}updated_at = CURRENT_TIMESTAMP
                 WHERE id = %s
-                RETURNING id, name, model, type, brand, ir_codes, status, created_at, updated_at
-            """, (
-                data.get('name'),
-                data.get('model', ''),
-                data.get('type', 'tv'),
-                data.get('brand', ''),
-                json.dumps(data.get('ir_codes', {})),
-                data.get('status', 'offline'),
-                device_id
-            ))
+                RETURNING {DEVICE_RETURNING}
+            """, [value for _, value in assignments] + [device_id])
             device = cur.fetchone()
             conn.commit()
             
             if not device:
-                return {
-                    'statusCode': 404,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Device not found'})
-                }
+                return json_response(404, {'error': 'Device not found'})
             
             if device['created_at']:
                 device['created_at'] = device['created_at'].isoformat()
             if device['updated_at']:
                 device['updated_at'] = device['updated_at'].isoformat()
             
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps(device)
-            }
+            return json_response(200, device)
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 def delete_device(device_id):
     if not device_id:
-        return {
-            'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Device ID is required'})
-        }
+        return json_response(400, {'error': 'Device ID is required'})
     
     conn = get_db_connection()
     try:
@@ -174,10 +745,208 @@ def delete_device(device_id):
             """, (device_id,))
             conn.commit()
             
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'message': 'Device deleted successfully'})
-            }
+            return json_response(200, {'message': 'Device deleted successfully'})
     finally:
-        conn.close()
+        release_db_connection(conn)
+
+BULK_CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE', '1000'))
+BULK_MAX_ROWS = int(os.environ.get('BULK_MAX_ROWS', '50000'))
+BULK_MAX_ERRORS = 100
+EXPORT_FETCH_SIZE = int(os.environ.get('EXPORT_FETCH_SIZE', '2000'))
+BULK_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv; charset=utf-8'}
+IMPORT_COLUMNS = (
+    'name', 'model', 'type', 'brand', 'code_set_id', 'ir_codes', 'ir_payloads', 'status',
+    'room', 'bridge_id', 'fallback_bridge_id'
+)
+# Длины колонок devices из миграций
+IMPORT_TEXT_LIMITS = (('name', 255), ('model', 255), ('type', 50), ('brand', 100), ('status', 20), ('room', 100))
+
+def bulk_format(event):
+    """ndjson или csv: из ?format=, иначе по Content-Type"""
+    fmt = (event.get('queryStringParameters') or {}).get('format')
+    if not fmt:
+        content_type = get_header(event.get('headers') or {}, 'content-type') or ''
+        fmt = 'csv' if 'csv' in content_type else 'ndjson'
+    if fmt not in BULK_FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(BULK_FORMATS)}")
+    return fmt
+
+def iter_import_rows(text, fmt):
+    """(номер строки, запись или None, ошибка разбора) по строкам тела"""
+    if fmt == 'csv':
+        reader = csv.DictReader(io.StringIO(text))
+        for row in reader:
+            yield reader.line_num, row, None
+        return
+    for line_number, line in enumerate(io.StringIO(text), 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line), None
+        except ValueError:
+            yield line_number, None, 'Invalid JSON'
+
+def validate_import_row(row, bridge_ids):
+    """Проверенные поля строки (ir_codes - словарь) или текст ошибки"""
+    if not isinstance(row, dict):
+        return None, 'Row must be an object'
+    # В CSV пустая ячейка - это отсутствие значения
+    row = {key: value for key, value in row.items() if key and value not in ('', None)}
+    if not isinstance(row.get('name'), str) or not row['name'].strip():
+        return None, 'name is required'
+    values = {
+        'name': row['name'].strip(),
+        'model': row.get('model', ''),
+        'type': row.get('type', 'tv'),
+        'brand': row.get('brand', ''),
+        'status': row.get('status', 'offline'),
+        'room': row.get('room')
+    }
+    for column, limit in IMPORT_TEXT_LIMITS:
+        value = values[column]
+        if value is not None and (not isinstance(value, str) or len(value) > limit):
+            return None, f'{column} must be a string of at most {limit} characters'
+    
+    ir_codes = row.get('ir_codes', {})
+    if isinstance(ir_codes, str):
+        try:
+            ir_codes = json.loads(ir_codes)
+        except ValueError:
+            return None, 'ir_codes must be a JSON object'
+    if not isinstance(ir_codes, dict) or not all(isinstance(code, str) for code in ir_codes.values()):
+        return None, 'ir_codes must map button names to code strings'
+    values['ir_codes'] = ir_codes
+    
+    for column in ('bridge_id', 'fallback_bridge_id'):
+        value = row.get(column)
+        if value is not None:
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                return None, f'{column} must be an integer'
+            if value not in bridge_ids:
+                return None, f'{column} {value} does not exist'
+        values[column] = value
+    return values, None
+
+def _copy_import_chunk(cur, rows):
+    buffer = io.StringIO()
+    csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC).writerows(rows)
+    buffer.seek(0)
+    # Все строки в кавычках, поэтому пустой model остаётся '', а None (тоже "") FORCE_NULL превращает в NULL
+    cur.copy_expert(f"""
+        COPY t_p77920312_universal_remote_app.devices ({', '.join(IMPORT_COLUMNS)})
+        FROM STDIN WITH (FORMAT csv, FORCE_NULL (code_set_id, room, bridge_id, fallback_bridge_id))
+    """, buffer)
+
+def import_devices(event):
+    """Массовое добавление устройств из NDJSON или CSV
+
+    Строки проверяются по одной, валидные уходят в базу через COPY пачками по
+    BULK_CHUNK_SIZE в одной транзакции. Коды устройств сводятся к наборам
+    библиотеки: каждый уникальный набор создаётся или находится один раз за
+    импорт. Ответ: число добавленных и ошибки с номерами строк (первые
+    BULK_MAX_ERRORS).
+    """
+    try:
+        fmt = bulk_format(event)
+    except ValueError as e:
+        return json_response(400, {'error': str(e)})
+    text = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        text = base64.b64decode(text).decode('utf-8')
+    
+    imported = 0
+    failed = 0
+    errors = []
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT id FROM t_p77920312_universal_remote_app.ir_bridges')
+            bridge_ids = {row[0] for row in cur.fetchall()}
+            code_sets = {}
+            chunk = []
+            for line_number, row, error in iter_import_rows(text, fmt):
+                if imported + failed >= BULK_MAX_ROWS:
+                    return json_response(413, {'error': f'At most {BULK_MAX_ROWS} rows per import'})
+                values = None
+                if error is None:
+                    values, error = validate_import_row(row, bridge_ids)
+                if error:
+                    failed += 1
+                    if len(errors) < BULK_MAX_ERRORS:
+                        errors.append({'line': line_number, 'error': error})
+                    continue
+                key = json.dumps(values['ir_codes'], sort_keys=True)
+                if values['ir_codes'] and key not in code_sets:
+                    code_sets[key] = upsert_code_set(cur, values['ir_codes'])
+                values.update(code_set_id=code_sets.get(key), ir_codes='{}', ir_payloads='{}')
+                chunk.append(tuple(values[column] for column in IMPORT_COLUMNS))
+                imported += 1
+                if len(chunk) >= BULK_CHUNK_SIZE:
+                    with span('copy'):
+                        _copy_import_chunk(cur, chunk)
+                    chunk = []
+            if chunk:
+                with span('copy'):
+                    _copy_import_chunk(cur, chunk)
+        conn.commit()
+    except csv.Error as e:
+        return json_response(400, {'error': f'Invalid CSV: {e}'})
+    finally:
+        release_db_connection(conn)
+    
+    return json_response(200, {'imported': imported, 'failed': failed, 'errors': errors})
+
+def export_devices(event):
+    """Выгрузка всех устройств в NDJSON или CSV через серверный курсор
+
+    Строки забираются из базы порциями по EXPORT_FETCH_SIZE и сразу пишутся
+    в тело; для NDJSON строку JSON собирает PostgreSQL.
+    """
+    try:
+        fmt = bulk_format(event)
+    except ValueError as e:
+        return json_response(400, {'error': str(e)})
+    
+    expressions = [DEVICE_FIELD_SQL.get(field, 'd.' + field) for field in DEVICE_FIELDS]
+    if fmt == 'ndjson':
+        pairs = ', '.join(f"'{field}', {expression}" for field, expression in zip(DEVICE_FIELDS, expressions))
+        select = f'json_build_object({pairs})::text'
+    else:
+        select = ', '.join(f'({expression})::text' if field in DEVICE_FIELD_SQL else expression
+                           for field, expression in zip(DEVICE_FIELDS, expressions))
+    
+    out = io.StringIO()
+    writer = csv.writer(out)
+    if fmt == 'csv':
+        writer.writerow(DEVICE_FIELDS)
+    conn = get_db_connection()
+    try:
+        with conn.cursor(name='devices_export') as cur:
+            cur.itersize = EXPORT_FETCH_SIZE
+            cur.execute(f"""
+                SELECT {select}
+                FROM t_p77920312_universal_remote_app.devices d
+                LEFT JOIN t_p77920312_universal_remote_app.ir_code_sets cs ON cs.id = d.code_set_id
+                ORDER BY d.id
+            """)
+            for row in cur:
+                if fmt == 'ndjson':
+                    out.write(row[0])
+                    out.write('\n')
+                else:
+                    writer.writerow([value.isoformat() if isinstance(value, datetime) else value for value in row])
+        conn.commit()
+    finally:
+        release_db_connection(conn)
+    
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': BULK_FORMATS[fmt],
+            'Content-Disposition': f'attachment; filename="devices.{fmt}"',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': out.getvalue()
+    }
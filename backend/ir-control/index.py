@@ -1,192 +1,1153 @@
+import atexit
+import base64
+import functools
+import hashlib
+import importlib
 import json
 import os
-import psycopg2
-from datetime import datetime
+import random
+import select
+import threading
+import time
+from contextlib import contextmanager
+from collections import OrderedDict, deque
+from itertools import islice
+from datetime import datetime, timedelta, timezone
 
-def handler(event: dict, context) -> dict:
-    '''API для управления ИК-устройствами и отправки команд'''
-    
+FUNCTION_NAME = 'ir-control'
+
+# >>> shared/framework.py (источник - scripts/shared/framework.py)
+class LazyModule:
+    """Модуль, импортируемый при первом обращении к атрибуту
+
+    Подмодули (psycopg2.extras, psycopg2.pool) подгружаются так же, поэтому
+    preflight и ответы из кэша не платят за импорт драйвера базы и HTTP-клиента.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        try:
+            return getattr(self._module, attr)
+        except AttributeError:
+            return importlib.import_module(f'{self._name}.{attr}')
+
+psycopg2 = LazyModule('psycopg2')
+
+def json_response(status, payload, headers=None):
+    """JSON-ответ функции с CORS-заголовком; headers дополняют стандартные"""
+    response_headers = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+    if headers:
+        response_headers.update(headers)
+    return {'statusCode': status, 'headers': response_headers, 'body': json.dumps(payload), 'isBase64Encoded': False}
+
+def read_json_body(event):
+    return json.loads(event.get('body') or '{}')
+
+def get_header(headers, name):
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+def route_request(event, routes, allow_headers='Content-Type'):
+    """Мини-роутер: preflight, выбор маршрута по (метод, action), 404/405 и ошибки в 500
+
+    routes - {(метод, action или None): функция(event)}. OPTIONS отвечает сразу,
+    не трогая базу и не импортируя драйвер.
+    """
     method = event.get('httpMethod', 'GET')
-    
+    methods = list(dict.fromkeys(route_method for route_method, _ in routes))
     if method == 'OPTIONS':
         return {
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type'
+                'Access-Control-Allow-Methods': ', '.join(methods + ['OPTIONS']),
+                'Access-Control-Allow-Headers': allow_headers
             },
             'body': '',
             'isBase64Encoded': False
         }
+    if method not in methods:
+        return json_response(405, {'error': 'Method not allowed'})
+    action = (event.get('queryStringParameters') or {}).get('action')
+    route = routes.get((method, action)) or routes.get((method, None))
+    if route is None:
+        return json_response(404, {'error': 'Endpoint not found'})
+    try:
+        return route(event)
+    except Exception as e:
+        return json_response(500, {'error': str(e)})
+
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0.05'))
+
+# Трассировка запроса: участки, число SQL-запросов и строк; вне выборки почти бесплатна
+_trace = threading.local()
+_traced_cursor_classes = {}
+_traced_connection = None
+
+@contextmanager
+def span(name):
+    """Добавляет длительность участка к текущей трассировке, если запрос попал в выборку"""
+    spans = getattr(_trace, 'spans', None)
+    if spans is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        spans[name] = spans.get(name, 0.0) + (time.perf_counter() - started) * 1000
+
+def _traced_cursor_class(base):
+    cursor_class = _traced_cursor_classes.get(base)
+    if cursor_class is None:
+        def execute(self, query, vars=None):
+            if getattr(_trace, 'spans', None) is None:
+                return base.execute(self, query, vars)
+            with span('query'):
+                result = base.execute(self, query, vars)
+            _trace.queries += 1
+            _trace.rows += max(self.rowcount, 0)
+            return result
+        cursor_class = type('Traced' + base.__name__, (base,), {'execute': execute})
+        _traced_cursor_classes[base] = cursor_class
+    return cursor_class
+
+def traced_connection_class():
+    """Класс соединения, курсоры которого отчитываются в трассировку; создаётся при первом подключении"""
+    global _traced_connection
+    if _traced_connection is None:
+        class TracedConnection(psycopg2.extensions.connection):
+            def cursor(self, *args, **kwargs):
+                base = kwargs.pop('cursor_factory', None) or self.cursor_factory or psycopg2.extensions.cursor
+                return super().cursor(*args, cursor_factory=_traced_cursor_class(base), **kwargs)
+
+            def commit(self):
+                with span('commit'):
+                    return super().commit()
+        _traced_connection = TracedConnection
+    return _traced_connection
+
+def traced(handler):
+    """Оборачивает handler: сэмплированные запросы получают Server-Timing и строку лога с метриками пула"""
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        headers = event.get('headers') or {}
+        forced = any(key.lower() == 'x-trace' for key in headers)
+        if not forced and random.random() >= TRACE_SAMPLE_RATE:
+            return handler(event, context)
+        _trace.spans = {}
+        _trace.queries = 0
+        _trace.rows = 0
+        started = time.perf_counter()
+        try:
+            response = handler(event, context)
+        finally:
+            total = (time.perf_counter() - started) * 1000
+            spans = _trace.spans
+            _trace.spans = None
+        timings = [f'{name};dur={duration:.2f}' for name, duration in spans.items()]
+        timings.append(f'db;desc="{_trace.queries} queries, {_trace.rows} rows"')
+        timings.append(f'total;dur={total:.2f}')
+        response_headers = response.setdefault('headers', {})
+        response_headers['Server-Timing'] = ', '.join(timings)
+        response_headers['Access-Control-Expose-Headers'] = ', '.join(
+            filter(None, [response_headers.get('Access-Control-Expose-Headers'), 'Server-Timing'])
+        )
+        print(json.dumps({
+            'function': FUNCTION_NAME,
+            'method': event.get('httpMethod'),
+            'action': (event.get('queryStringParameters') or {}).get('action'),
+            'status': response.get('statusCode'),
+            'total_ms': round(total, 2),
+            'spans': {name: round(duration, 2) for name, duration in spans.items()},
+            'queries': _trace.queries,
+            'rows': _trace.rows,
+            'pool': get_pool_stats()
+        }))
+        return response
+    return wrapper
+
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_MAX_AGE = float(os.environ.get('DB_POOL_MAX_AGE', '300'))
+DB_POOL_CHECK_AFTER = float(os.environ.get('DB_POOL_CHECK_AFTER', '30'))
+DB_POOL_WAIT_TIMEOUT = float(os.environ.get('DB_POOL_WAIT_TIMEOUT', '5'))
+
+# Пул живёт на уровне модуля и переживает тёплые вызовы функции
+_pool_cond = threading.Condition()
+_pool_idle = []
+_pool_meta = {}
+_pool_stats = {'size': 0, 'hits': 0, 'misses': 0, 'replaced': 0, 'waits': 0, 'wait_ms': 0.0}
+
+def get_db_connection():
+    """Выдаёт соединение из пула; ожидание и подключение попадают в трассировку как db_connect"""
+    with span('db_connect'):
+        return _checkout_connection()
+
+def _checkout_connection():
+    """Выдаёт соединение из пула процесса, заменяя устаревшие и разорванные"""
+    started = time.monotonic()
+    while True:
+        conn = _checkout_idle_connection(started)
+        if conn is None:
+            break
+        if _is_connection_usable(conn):
+            return conn
+        _discard_connection(conn)
+        _pool_stats['replaced'] += 1
+    try:
+        conn = psycopg2.connect(os.environ['DATABASE_URL'], connection_factory=traced_connection_class())
+    except Exception:
+        with _pool_cond:
+            _pool_stats['size'] -= 1
+            _pool_cond.notify()
+        raise
+    now = time.monotonic()
+    _pool_meta[conn] = {'created': now, 'used': now}
+    return conn
+
+def _checkout_idle_connection(started):
+    with _pool_cond:
+        while True:
+            if _pool_idle:
+                _pool_stats['hits'] += 1
+                _pool_stats['wait_ms'] += (time.monotonic() - started) * 1000
+                return _pool_idle.pop()
+            if _pool_stats['size'] < DB_POOL_MAX_SIZE:
+                _pool_stats['size'] += 1
+                _pool_stats['misses'] += 1
+                _pool_stats['wait_ms'] += (time.monotonic() - started) * 1000
+                return None
+            remaining = DB_POOL_WAIT_TIMEOUT - (time.monotonic() - started)
+            if remaining <= 0:
+                raise psycopg2.pool.PoolError('Connection pool exhausted')
+            _pool_stats['waits'] += 1
+            _pool_cond.wait(remaining)
+
+def _is_connection_usable(conn):
+    if conn.closed:
+        return False
+    meta = _pool_meta.get(conn)
+    now = time.monotonic()
+    if not meta or now - meta['created'] > DB_POOL_MAX_AGE:
+        return False
+    if now - meta['used'] > DB_POOL_CHECK_AFTER:
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+        except psycopg2.Error:
+            return False
+    return True
+
+def _discard_connection(conn):
+    _pool_meta.pop(conn, None)
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+    with _pool_cond:
+        _pool_stats['size'] -= 1
+        _pool_cond.notify()
+
+def release_db_connection(conn):
+    """Возвращает соединение в пул после отката незавершённой транзакции"""
+    try:
+        conn.rollback()
+    except psycopg2.Error:
+        pass
+    if conn.closed:
+        _discard_connection(conn)
+        return
+    _pool_meta[conn]['used'] = time.monotonic()
+    with _pool_cond:
+        _pool_idle.append(conn)
+        _pool_cond.notify()
+
+def get_pool_stats():
+    """Метрики пула: попадания, промахи, замены и суммарное ожидание"""
+    with _pool_cond:
+        stats = dict(_pool_stats)
+        stats['idle'] = len(_pool_idle)
+    stats['max_size'] = DB_POOL_MAX_SIZE
+    return stats
+# <<< shared/framework.py
+
+DEVICE_CACHE_TTL = float(os.environ.get('DEVICE_CACHE_TTL', '30'))
+DEVICE_CACHE_MAX_SIZE = int(os.environ.get('DEVICE_CACHE_MAX_SIZE', '256'))
+
+# Кэш ИК-кодов; сбрасывается по NOTIFY из триггера на devices
+_device_cache = OrderedDict()
+# Растёт при каждом сбросе записей устройств: чтение, начатое до сброса, не кладётся в кэш
+_device_cache_state = {'generation': 0}
+_cache_lock = threading.Lock()
+_listen_conn = None
+
+def _drain_invalidations():
+    """Забирает накопленные уведомления об изменениях и выкидывает устаревшие записи кэша"""
+    global _listen_conn
+    try:
+        if _listen_conn is None or _listen_conn.closed:
+            _listen_conn = psycopg2.connect(os.environ['DATABASE_URL'])
+            _listen_conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with _listen_conn.cursor() as cur:
+                cur.execute('LISTEN device_changes')
+            # Пока слушателя не было, изменения могли пройти незамеченными
+            clear_caches()
+        _listen_conn.poll()
+    except psycopg2.Error:
+        if _listen_conn is not None and not _listen_conn.closed:
+            _listen_conn.close()
+        _listen_conn = None
+        clear_caches()
+        return
+    with _cache_lock:
+        while _listen_conn.notifies:
+            notify = _listen_conn.notifies.pop(0)
+            _device_cache.pop(notify.payload, None)
+            _device_cache_state['generation'] += 1
+
+def clear_caches():
+    with _cache_lock:
+        _device_cache.clear()
+        _device_cache_state['generation'] += 1
+
+def get_device(conn, device_id):
+    """Возвращает имя и таблицу ИК-кодов устройства, повторные нажатия обслуживаются из кэша"""
+    _drain_invalidations()
+    key = str(device_id)
+    now = time.monotonic()
+    with _cache_lock:
+        entry = _device_cache.get(key)
+        if entry and entry[0] > now:
+            _device_cache.move_to_end(key)
+            return entry[1]
+        generation = _device_cache_state['generation']
+    with conn.cursor() as cur:
+        cur.execute('''
+            SELECT d.name, coalesce(cs.codes, '{}'::jsonb) || coalesce(d.ir_codes, '{}'::jsonb)
+            FROM devices d
+            LEFT JOIN ir_code_sets cs ON cs.id = d.code_set_id
+            WHERE d.id = %s
+        ''', (device_id,))
+        row = cur.fetchone()
+    if not row:
+        return None
+    device = {'name': row[0], 'ir_codes': row[1] or {}}
+    with _cache_lock:
+        if _device_cache_state['generation'] != generation:
+            return device
+        _device_cache[key] = (now + DEVICE_CACHE_TTL, device)
+        _device_cache.move_to_end(key)
+        while len(_device_cache) > DEVICE_CACHE_MAX_SIZE:
+            _device_cache.popitem(last=False)
+    return device
+
+FEED_BUFFER_SIZE = int(os.environ.get('FEED_BUFFER_SIZE', '5000'))
+# Сколько долгий опрос ждёт новых событий, прежде чем ответить пустым списком
+FEED_WAIT_SECONDS = float(os.environ.get('FEED_WAIT_SECONDS', '20'))
+FEED_MAX_EVENTS = 500
+# Холодный экземпляр ждёт подключения слушателя даже при wait=0
+FEED_CONNECT_TIMEOUT = float(os.environ.get('FEED_CONNECT_TIMEOUT', '2'))
+
+# Лента изменений процесса: один LISTEN change_feed на процесс, все ожидающие клиенты читают общий буфер.
+# Курсор - номер события из change_feed_seq, общий для всех экземпляров. _feed_positions хранит для курсора
+# сквозной индекс следующего события; при переподключении слушателя буфер и курсоры сбрасываются.
+# Первый курсор клиента - снимок txid_current_snapshot() из стартового пакета: лента отдаётся с первого
+# события, транзакция которого в снимок не попала
+_feed_cond = threading.Condition()
+_feed_events = deque()
+_feed_positions = OrderedDict()
+_feed_state = {'start': None, 'snapshot': None, 'evicted_xid': 0, 'appended': 0, 'thread': None}
+
+def ensure_feed_listener():
+    with _feed_cond:
+        if _feed_state['thread'] is None or not _feed_state['thread'].is_alive():
+            _feed_state['thread'] = threading.Thread(target=_feed_listener, name='change-feed', daemon=True)
+            _feed_state['thread'].start()
+
+def _feed_listener():
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(os.environ['DATABASE_URL'])
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cur:
+                cur.execute('LISTEN change_feed')
+                # Клиент, видевший последнее выданное до LISTEN событие, продолжает без сброса. Все транзакции
+                # вне снимка слушателя коммитятся после LISTEN, поэтому их события придут в буфер
+                cur.execute('''
+                    SELECT CASE WHEN is_called THEN last_value ELSE 0 END, txid_current_snapshot()::text
+                    FROM change_feed_seq
+                ''')
+                start, snapshot = cur.fetchone()
+            with _feed_cond:
+                _feed_events.clear()
+                _feed_positions.clear()
+                _feed_positions[str(start)] = 0
+                _feed_state.update(start=str(start), snapshot=parse_snapshot(snapshot), evicted_xid=0, appended=0)
+                _feed_cond.notify_all()
+            while True:
+                select.select([conn], [], [], 60)
+                conn.poll()
+                if not conn.notifies:
+                    continue
+                with _feed_cond:
+                    while conn.notifies:
+                        seq, _, payload = conn.notifies.pop(0).payload.partition(':')
+                        xid, _, payload = payload.partition(':')
+                        _feed_events.append((seq, int(xid), payload))
+                        _feed_state['appended'] += 1
+                        _feed_positions[seq] = _feed_state['appended']
+                    while len(_feed_events) > FEED_BUFFER_SIZE:
+                        _feed_state['evicted_xid'] = max(_feed_state['evicted_xid'], _feed_events.popleft()[1])
+                    base = _feed_state['appended'] - len(_feed_events)
+                    while next(iter(_feed_positions.values())) < base:
+                        _feed_positions.popitem(last=False)
+                    _feed_cond.notify_all()
+        except (psycopg2.Error, ValueError):
+            if conn is not None and not conn.closed:
+                conn.close()
+            time.sleep(1)
+
+def parse_snapshot(text):
+    """txid_current_snapshot() "xmin:xmax:xip,..." в (xmin, xmax, frozenset(xip)); иначе ValueError"""
+    xmin, xmax, xip = text.split(':')
+    return int(xmin), int(xmax), frozenset(int(xid) for xid in xip.split(',') if xid)
+
+def snapshot_sees(snapshot, xid):
+    xmin, xmax, xip = snapshot
+    return xid < xmin or (xid < xmax and xid not in xip)
+
+def feed_covers(snapshot):
+    """True, если в буфере есть все события транзакций, не попавших в снимок; вызывается под _feed_cond
+
+    Всё, что видно слушателю, должно быть видно и снимку, а вытесненные
+    события - относиться к транзакциям, завершённым до снимка.
+    """
+    listener = _feed_state['snapshot']
+    if listener is None or listener[1] > snapshot[1]:
+        return False
+    if any(snapshot_sees(listener, xid) for xid in snapshot[2]):
+        return False
+    return _feed_state['evicted_xid'] < snapshot[0]
+
+def _snapshot_position(cursor):
+    """Сквозной индекс первого события вне снимка cursor или None, если буфер снимок не покрывает
+
+    NOTIFY доставляются в порядке коммитов, поэтому события транзакций из
+    снимка идут в буфере раньше всех остальных.
+    """
+    try:
+        snapshot = parse_snapshot(cursor)
+    except ValueError:
+        return None
+    if not feed_covers(snapshot):
+        return None
+    base = _feed_state['appended'] - len(_feed_events)
+    for offset, (seq, xid, payload) in enumerate(_feed_events):
+        if not snapshot_sees(snapshot, xid):
+            return base + offset
+    return _feed_state['appended']
+
+def read_feed(cursor, timeout):
+    """События после курсора: (новый курсор, сброс, [(номер, текст JSON)])
+
+    Без курсора сразу отдаётся текущая позиция. Курсор-снимок из стартового
+    пакета продолжает ленту с первого изменения, которого в пакете нет.
+    Курсор, которого нет среди позиций буфера (вытеснен или выдан до
+    подключения слушателя), означает сброс: клиенту нужно перечитать данные
+    целиком. Если новых событий нет, ждёт их до timeout секунд.
+    """
+    ensure_feed_listener()
+    started = time.monotonic()
+    deadline = started + timeout
+    with _feed_cond:
+        while _feed_state['start'] is None:
+            remaining = started + max(timeout, FEED_CONNECT_TIMEOUT) - time.monotonic()
+            if remaining <= 0:
+                return None, True, []
+            _feed_cond.wait(remaining)
+        while True:
+            appended = _feed_state['appended']
+            base = appended - len(_feed_events)
+            last = _feed_events[-1][0] if _feed_events else _feed_state['start']
+            if cursor is None:
+                return last, False, []
+            position = _snapshot_position(cursor) if ':' in cursor else _feed_positions.get(cursor)
+            if position is None or position < base:
+                return last, True, []
+            if position < appended:
+                events = [
+                    (seq, payload)
+                    for seq, xid, payload in islice(_feed_events, position - base, position - base + FEED_MAX_EVENTS)
+                ]
+                return events[-1][0], False, events
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return cursor, False, []
+            _feed_cond.wait(remaining)
+
+HISTORY_TABLE = 'command_history'
+# >>> shared/history.py (источник - scripts/shared/history.py)
+HISTORY_MODE = os.environ.get('HISTORY_MODE', 'buffered')
+HISTORY_FLUSH_SIZE = int(os.environ.get('HISTORY_FLUSH_SIZE', '100'))
+HISTORY_FLUSH_INTERVAL = float(os.environ.get('HISTORY_FLUSH_INTERVAL', '1'))
+HISTORY_QUEUE_MAX_SIZE = int(os.environ.get('HISTORY_QUEUE_MAX_SIZE', '10000'))
+# block - нажатие ждёт освобождения места в очереди, drop - вытесняются самые старые записи
+HISTORY_BACKPRESSURE = os.environ.get('HISTORY_BACKPRESSURE', 'block')
+# Дольше этого block не ждёт: при недоступной базе записи отбрасываются, а нажатие идёт дальше
+HISTORY_BLOCK_TIMEOUT = float(os.environ.get('HISTORY_BLOCK_TIMEOUT', '2'))
+# Столько секунд неудачные пачки повторяются, потом записи отбрасываются: иначе они опоздают к агрегатам
+HISTORY_RETRY_WINDOW = float(os.environ.get('HISTORY_RETRY_WINDOW', '120'))
+
+# Буфер истории: записи копятся в памяти и уходят в БД пачками из фонового потока
+_history_cond = threading.Condition()
+_history_buffer = []
+_history_thread = None
+_history_stats = {'queued': 0, 'flushed': 0, 'dropped': 0, 'failed': 0}
+
+def record_history(rows):
+    """Ставит записи command_history в буфер, не добавляя коммит к нажатию"""
+    if HISTORY_MODE == 'sync':
+        _write_history(rows)
+        return
+    _ensure_history_writer()
+    deadline = time.monotonic() + HISTORY_BLOCK_TIMEOUT
+    with _history_cond:
+        while _history_buffer and len(_history_buffer) + len(rows) > HISTORY_QUEUE_MAX_SIZE:
+            remaining = deadline - time.monotonic()
+            if HISTORY_BACKPRESSURE == 'drop':
+                overflow = min(len(_history_buffer), len(_history_buffer) + len(rows) - HISTORY_QUEUE_MAX_SIZE)
+                del _history_buffer[:overflow]
+                _history_stats['dropped'] += overflow
+            elif remaining <= 0:
+                _history_stats['dropped'] += len(rows)
+                return
+            else:
+                _history_cond.notify_all()
+                _history_cond.wait(min(remaining, HISTORY_FLUSH_INTERVAL))
+        _history_buffer.extend(rows)
+        _history_stats['queued'] += len(rows)
+        if len(_history_buffer) >= HISTORY_FLUSH_SIZE:
+            _history_cond.notify_all()
+
+def flush_history():
+    """Синхронно сбрасывает весь буфер; вызывается и при завершении процесса"""
+    with _history_cond:
+        batch = _history_buffer[:]
+        del _history_buffer[:]
+    _flush_history_batch(batch)
+
+def _ensure_history_writer():
+    global _history_thread
+    with _history_cond:
+        if _history_thread is None or not _history_thread.is_alive():
+            _history_thread = threading.Thread(target=_history_writer, name='history-writer', daemon=True)
+            _history_thread.start()
+
+def _history_writer():
+    while True:
+        with _history_cond:
+            if len(_history_buffer) < HISTORY_FLUSH_SIZE:
+                _history_cond.wait(HISTORY_FLUSH_INTERVAL)
+            batch = _history_buffer[:]
+            del _history_buffer[:]
+        if not _flush_history_batch(batch):
+            time.sleep(HISTORY_FLUSH_INTERVAL)
+
+def _flush_history_batch(batch):
+    if not batch:
+        return True
+    try:
+        _write_history(batch)
+        _history_stats['flushed'] += len(batch)
+        return True
+    except Exception:
+        _history_stats['failed'] += len(batch)
+        # Возвращаем пачку в начало очереди, чтобы повторить при следующем сбросе
+        retry_after = datetime.now(timezone.utc) - timedelta(seconds=HISTORY_RETRY_WINDOW)
+        retry = [row for row in batch if row[3] >= retry_after]
+        with _history_cond:
+            room = max(0, HISTORY_QUEUE_MAX_SIZE - len(_history_buffer))
+            _history_buffer[:0] = retry[:room]
+            _history_stats['dropped'] += len(batch) - min(room, len(retry))
+        return False
+    finally:
+        with _history_cond:
+            _history_cond.notify_all()
+
+atexit.register(flush_history)
+
+def _write_history(rows):
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            # created_at - TIMESTAMP без зоны, в нём всегда UTC независимо от часового пояса сессии
+            psycopg2.extras.execute_values(cur, f"""
+                INSERT INTO {HISTORY_TABLE} (device_id, command, success, created_at)
+                VALUES %s
+            """, rows, template="(%s, %s, %s, %s AT TIME ZONE 'UTC')")
+        conn.commit()
+    finally:
+        release_db_connection(conn)
+# <<< shared/history.py
+
+DEVICE_FIELDS = ('id', 'name', 'model', 'type', 'brand', 'status', 'ir_codes', 'created_at', 'updated_at')
+DEVICE_DEFAULT_FIELDS = ('id', 'name', 'model', 'type', 'brand', 'status', 'ir_codes', 'created_at')
+# ir_codes в ответах - набор из библиотеки с собственными кодами устройства поверх
+DEVICE_FIELD_SQL = {'ir_codes': "coalesce(cs.codes, '{}'::jsonb) || coalesce(d.ir_codes, '{}'::jsonb)"}
+DEVICE_MAX_PAGE_SIZE = 500
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+HISTORY_COLUMNS = ('id', 'command', 'success', 'created_at', 'device_name', 'device_type')
+
+def encode_cursor(created_at, row_id):
+    raw = f'{created_at.isoformat()}|{row_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        created_at, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Invalid cursor')
+
+def parse_device_fields(value):
+    """Разбирает fields=id,name,... ; без параметра отдаётся прежний набор полей"""
+    if not value:
+        return DEVICE_DEFAULT_FIELDS
+    fields = tuple(dict.fromkeys(field.strip() for field in value.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in DEVICE_FIELDS]
+    if unknown or not fields:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+def json_page_query(query, columns, limit):
+    """Оборачивает выборку так, что JSON-массив страницы собирает сам PostgreSQL
+
+    query отдаёт колонки columns, а также cursor_created_at и cursor_id, в порядке
+    (created_at, id) по убыванию; строк в ней может быть на одну больше limit.
+    Результат запроса: текст массива (временные метки уже в ISO 8601), число
+    строк выборки и курсор последней строки страницы. Параметры: limit трижды,
+    затем параметры query.
+    """
+    pairs = ', '.join(f"'{column}', {column}" for column in columns)
+    page_filter = 'FILTER (WHERE rn <= %s)'
+    last_row = '''
+               (array_agg(cursor_created_at ORDER BY rn))[%s] AS last_created_at,
+               (array_agg(cursor_id ORDER BY rn))[%s] AS last_id'''
+    if limit is None:
+        page_filter = ''
+        last_row = 'NULL AS last_created_at, NULL AS last_id'
+    return f'''
+        SELECT coalesce(json_agg(json_build_object({pairs}) ORDER BY rn) {page_filter}, '[]')::text AS rows_json,
+               count(*) AS total, {last_row}
+        FROM (
+            SELECT page.*, row_number() OVER (ORDER BY cursor_created_at DESC, cursor_id DESC) AS rn
+            FROM ({query}) page
+        ) numbered
+    '''
+
+def build_history_query(params):
+    """Собирает keyset-запрос истории: фильтры по устройству, команде, периоду и успешности
+
+    Страница продолжается с курсора (created_at, id) последней записи, поэтому
+    выборка идёт по индексу без OFFSET и сортировки всей таблицы.
+    """
+    try:
+        limit = int(params.get('limit') or HISTORY_PAGE_SIZE)
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    if not 1 <= limit <= HISTORY_MAX_PAGE_SIZE:
+        raise ValueError(f'limit must be between 1 and {HISTORY_MAX_PAGE_SIZE}')
+    
+    conditions = []
+    query_params = []
+    if params.get('device_id'):
+        try:
+            query_params.append(int(params['device_id']))
+        except ValueError:
+            raise ValueError('device_id must be an integer')
+        conditions.append('h.device_id = %s')
+    if params.get('command'):
+        conditions.append('h.command = %s')
+        query_params.append(params['command'])
+    for name, operator in (('since', '>='), ('until', '<')):
+        if params.get(name):
+            try:
+                query_params.append(datetime.fromisoformat(params[name]))
+            except ValueError:
+                raise ValueError(f'{name} must be an ISO 8601 timestamp')
+            conditions.append(f'h.created_at {operator} %s')
+    if params.get('success') in ('true', 'false'):
+        conditions.append('h.success = %s')
+        query_params.append(params['success'] == 'true')
+    if params.get('cursor'):
+        conditions.append('(h.created_at, h.id) < (%s, %s)')
+        query_params.extend(decode_cursor(params['cursor']))
+    
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    query = f'''
+        SELECT h.id, h.command, h.success, h.created_at, d.name AS device_name, d.type AS device_type,
+               h.created_at AS cursor_created_at, h.id AS cursor_id
+        FROM command_history h
+        JOIN devices d ON h.device_id = d.id
+        {where}
+        ORDER BY h.created_at DESC, h.id DESC
+        LIMIT %s
+    '''
+    query_params.append(limit + 1)
+    return query, query_params, limit
+
+HISTORY_RETENTION_MONTHS = int(os.environ.get('HISTORY_RETENTION_MONTHS', '6'))
+HOURLY_STATS_RETENTION_DAYS = int(os.environ.get('HOURLY_STATS_RETENTION_DAYS', '90'))
+# Час попадает в агрегаты только после того, как буферы истории гарантированно сброшены:
+# запись ждёт места в очереди, интервала сброса и повторов неудачных пачек
+ROLLUP_LAG_MINUTES = int(os.environ.get('ROLLUP_LAG_MINUTES', '5'))
+ROLLUP_LAG_SECONDS = max(ROLLUP_LAG_MINUTES * 60, HISTORY_BLOCK_TIMEOUT + HISTORY_FLUSH_INTERVAL + HISTORY_RETRY_WINDOW)
+# Время истории и агрегатов - UTC, как его пишут буферы истории
+UTC_NOW_SQL = "(now() AT TIME ZONE 'UTC')"
+STATS_MAX_LIMIT = 100
+
+def maintain_history(cur):
+    """Дописывает почасовые и дневные агрегаты, готовит будущие секции и удаляет устаревшие"""
+    cur.execute('SELECT ensure_command_history_partitions(2)')
+    partitions_created = cur.fetchone()[0]
+    
+    # Блокировка строки watermark не даёт двум запускам посчитать один час дважды
+    cur.execute("SELECT rolled_until FROM command_stats_watermark WHERE name = 'hourly' FOR UPDATE")
+    rolled_until = cur.fetchone()[0]
+    cur.execute(f"SELECT date_trunc('hour', {UTC_NOW_SQL} - make_interval(secs => %s))", (ROLLUP_LAG_SECONDS,))
+    target = cur.fetchone()[0]
+    
+    hourly_rows = 0
+    if target > rolled_until:
+        cur.execute('''
+            INSERT INTO command_stats_hourly (bucket, device_id, command, total, failed)
+            SELECT date_trunc('hour', created_at), device_id, command,
+                   count(*), count(*) FILTER (WHERE NOT success)
+            FROM command_history
+            WHERE created_at >= %s AND created_at < %s AND device_id IS NOT NULL
+            GROUP BY 1, 2, 3
+            ON CONFLICT (bucket, device_id, command) DO UPDATE
+            SET total = command_stats_hourly.total + EXCLUDED.total,
+                failed = command_stats_hourly.failed + EXCLUDED.failed
+        ''', (rolled_until, target))
+        hourly_rows = cur.rowcount
+        cur.execute('''
+            INSERT INTO command_stats_daily (bucket, device_id, command, total, failed)
+            SELECT bucket::date, device_id, command, sum(total), sum(failed)
+            FROM command_stats_hourly
+            WHERE bucket >= date_trunc('day', %s::timestamp) AND bucket < %s
+            GROUP BY 1, 2, 3
+            ON CONFLICT (bucket, device_id, command) DO UPDATE
+            SET total = EXCLUDED.total, failed = EXCLUDED.failed
+        ''', (rolled_until, target))
+        cur.execute("UPDATE command_stats_watermark SET rolled_until = %s WHERE name = 'hourly'", (target,))
+        rolled_until = target
+    
+    # Сырые данные удаляются только после того, как попали в агрегаты
+    cur.execute(f'''
+        SELECT LEAST(date_trunc('month', {UTC_NOW_SQL}) - make_interval(months => %s), %s)
+    ''', (HISTORY_RETENTION_MONTHS, rolled_until))
+    cutoff = cur.fetchone()[0]
+    cur.execute('SELECT drop_command_history_partitions(%s)', (cutoff,))
+    partitions_dropped = cur.fetchone()[0]
+    cur.execute(f'''
+        DELETE FROM command_stats_hourly
+        WHERE bucket < {UTC_NOW_SQL} - make_interval(days => %s)
+    ''', (HOURLY_STATS_RETENTION_DAYS,))
+    
+    return {
+        'rolled_until': rolled_until.isoformat(),
+        'hourly_rows': hourly_rows,
+        'partitions_created': partitions_created,
+        'partitions_dropped': partitions_dropped,
+        'retention_cutoff': cutoff.isoformat()
+    }
+
+def build_stats_query(params):
+    """Собирает запрос к агрегатам: period=day (по умолчанию) или hour, топ команд по числу нажатий"""
+    period = params.get('period') or 'day'
+    if period not in ('day', 'hour'):
+        raise ValueError('period must be day or hour')
+    try:
+        limit = int(params.get('limit') or 20)
+        days = int(params.get('days') or 30)
+    except ValueError:
+        raise ValueError('limit and days must be integers')
+    if not 1 <= limit <= STATS_MAX_LIMIT:
+        raise ValueError(f'limit must be between 1 and {STATS_MAX_LIMIT}')
+    
+    table = 'command_stats_daily' if period == 'day' else 'command_stats_hourly'
+    conditions = [f"s.bucket >= {UTC_NOW_SQL} - make_interval(days => %s)"]
+    query_params = [days]
+    if params.get('device_id'):
+        try:
+            query_params.append(int(params['device_id']))
+        except ValueError:
+            raise ValueError('device_id must be an integer')
+        conditions.append('s.device_id = %s')
+    query = f'''
+        SELECT s.device_id, d.name, s.command, sum(s.total) AS total, sum(s.failed) AS failed
+        FROM {table} s
+        LEFT JOIN devices d ON d.id = s.device_id
+        WHERE {' AND '.join(conditions)}
+        GROUP BY s.device_id, d.name, s.command
+        ORDER BY total DESC
+        LIMIT %s
+    '''
+    query_params.append(limit)
+    return query, query_params
+
+def with_cursor(route):
+    """Выдаёт маршруту соединение и курсор из пула и возвращает их после ответа"""
+    @functools.wraps(route)
+    def wrapper(event):
+        conn = get_db_connection()
+        cur = conn.cursor()
+        try:
+            return route(event, conn, cur)
+        finally:
+            cur.close()
+            release_db_connection(conn)
+    return wrapper
+
+@traced
+def handler(event: dict, context) -> dict:
+    '''API для управления ИК-устройствами и отправки команд'''
+    return route_request(event, {
+        ('GET', 'devices'): list_devices,
+        ('POST', 'command'): run_command,
+        ('GET', 'history'): get_history,
+        ('GET', 'stats'): get_stats,
+        ('POST', 'maintain_history'): run_history_maintenance,
+        ('GET', 'groups'): list_groups,
+        ('GET', 'bootstrap'): get_bootstrap,
+        ('GET', 'changes'): get_changes,
+        ('POST', 'add_device'): add_device
+    }, allow_headers='Content-Type, If-None-Match, Last-Event-ID')
+
+@with_cursor
+def list_devices(event, conn, cur):
+    """Список устройств с проекцией полей, keyset-страницами и ETag"""
+    params = event.get('queryStringParameters') or {}
+    
+    try:
+        fields = parse_device_fields(params.get('fields'))
+        limit = int(params['limit']) if params.get('limit') else None
+        cursor = decode_cursor(params['cursor']) if params.get('cursor') else None
+        if limit is not None and not 1 <= limit <= DEVICE_MAX_PAGE_SIZE:
+            raise ValueError(f'limit must be between 1 and {DEVICE_MAX_PAGE_SIZE}')
+    except ValueError as e:
+        return json_response(400, {'error': str(e)})
+    
+    # Версия списка: число строк и последнее изменение; совпала - отвечаем 304 без выборки
+    cur.execute('SELECT count(*), max(updated_at) FROM devices')
+    total, last_updated = cur.fetchone()
+    variant = f"{total}|{last_updated}|{','.join(fields)}|{limit}|{params.get('cursor')}"
+    etag = '"' + hashlib.md5(variant.encode()).hexdigest() + '"'
+    cache_headers = {
+        'ETag': etag,
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'ETag'
+    }
+    if get_header(event.get('headers') or {}, 'if-none-match') == etag:
+        return {'statusCode': 304, 'headers': cache_headers, 'body': '', 'isBase64Encoded': False}
+    
+    where = ''
+    query_params = [limit] * 3 if limit is not None else []
+    if cursor:
+        where = 'WHERE (d.created_at, d.id) < (%s, %s)'
+        query_params.extend(cursor)
+    page = ''
+    if limit is not None:
+        page = 'LIMIT %s'
+        query_params.append(limit + 1)
+    columns = ', '.join(f"{DEVICE_FIELD_SQL.get(field, 'd.' + field)} AS {field}" for field in fields)
+    cur.execute(json_page_query(f'''
+        SELECT {columns}, d.created_at AS cursor_created_at, d.id AS cursor_id
+        FROM devices d
+        LEFT JOIN ir_code_sets cs ON cs.id = d.code_set_id
+        {where}
+        ORDER BY d.created_at DESC, d.id DESC
+        {page}
+    ''', fields, limit), query_params)
+    devices_json, total, last_created_at, last_id = cur.fetchone()
+    
+    next_cursor = None
+    if limit is not None and total > limit and last_created_at:
+        next_cursor = encode_cursor(last_created_at, last_id)
+    
+    cache_headers['Content-Type'] = 'application/json'
+    return {
+        'statusCode': 200,
+        'headers': cache_headers,
+        'body': f'{{"devices": {devices_json}, "next_cursor": {json.dumps(next_cursor)}}}',
+        'isBase64Encoded': False
+    }
+
+@with_cursor
+def run_command(event, conn, cur):
+    """Проверяет команду устройства и записывает её в историю"""
+    body = read_json_body(event)
+    device_id = body.get('device_id')
+    command = body.get('command')
+    
+    device = get_device(conn, device_id)
+    
+    if not device:
+        return json_response(404, {'error': 'Device not found'})
+    
+    ir_code = device['ir_codes'].get(command)
+    
+    if not ir_code:
+        return json_response(400, {'error': 'Command not supported'})
+    
+    success = True
+    
+    record_history([(device_id, command, success, datetime.now(timezone.utc))])
     
-    dsn = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(dsn)
-    cur = conn.cursor()
-    
-    try:
-        params = event.get('queryStringParameters', {}) or {}
-        action = params.get('action', '')
-        
-        if method == 'GET' and action == 'devices':
-            cur.execute('''
-                SELECT id, name, model, type, brand, status, ir_codes, created_at 
-                FROM devices 
-                ORDER BY created_at DESC
-            ''')
-            devices = []
-            for row in cur.fetchall():
-                devices.append({
-                    'id': row[0],
-                    'name': row[1],
-                    'model': row[2],
-                    'type': row[3],
-                    'brand': row[4],
-                    'status': row[5],
-                    'ir_codes': row[6],
-                    'created_at': row[7].isoformat() if row[7] else None
-                })
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'devices': devices}),
-                'isBase64Encoded': False
-            }
-        
-        if method == 'POST' and action == 'command':
-            body = json.loads(event.get('body', '{}'))
-            device_id = body.get('device_id')
-            command = body.get('command')
-            
-            cur.execute('SELECT name, ir_codes FROM devices WHERE id = %s', (device_id,))
-            device = cur.fetchone()
-            
-            if not device:
-                return {
-                    'statusCode': 404,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Device not found'}),
-                    'isBase64Encoded': False
-                }
-            
-            ir_codes = device[1]
-            ir_code = ir_codes.get(command) if ir_codes else None
-            
-            if not ir_code:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Command not supported'}),
-                    'isBase64Encoded': False
-                }
-            
-            success = True
-            
-            cur.execute('''
-                INSERT INTO command_history (device_id, command, success) 
-                VALUES (%s, %s, %s)
-            ''', (device_id, command, success))
-            conn.commit()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'success': True,
-                    'ir_code': ir_code,
-                    'message': f'Command {command} sent successfully'
-                }),
-                'isBase64Encoded': False
-            }
-        
-        if method == 'GET' and action == 'history':
-            cur.execute('''
-                SELECT h.id, h.command, h.success, h.created_at, d.name, d.type
-                FROM command_history h
-                JOIN devices d ON h.device_id = d.id
-                ORDER BY h.created_at DESC
-                LIMIT 50
-            ''')
-            history = []
-            for row in cur.fetchall():
-                history.append({
-                    'id': row[0],
-                    'command': row[1],
-                    'success': row[2],
-                    'created_at': row[3].isoformat() if row[3] else None,
-                    'device_name': row[4],
-                    'device_type': row[5]
-                })
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'history': history}),
-                'isBase64Encoded': False
-            }
-        
-        if method == 'GET' and action == 'groups':
-            cur.execute('''
-                SELECT g.id, g.name, g.icon, 
-                       json_agg(json_build_object('id', d.id, 'name', d.name, 'type', d.type)) as devices
+    return json_response(200, {
+        'success': True,
+        'ir_code': ir_code,
+        'message': f'Command {command} sent successfully'
+    })
+
+@with_cursor
+def get_history(event, conn, cur):
+    """Страница истории команд с фильтрами и курсором"""
+    params = event.get('queryStringParameters') or {}
+    
+    try:
+        query, query_params, limit = build_history_query(params)
+    except ValueError as e:
+        return json_response(400, {'error': str(e)})
+    
+    cur.execute(json_page_query(query, HISTORY_COLUMNS, limit), [limit] * 3 + query_params)
+    history_json, total, last_created_at, last_id = cur.fetchone()
+    
+    next_cursor = None
+    if total > limit and last_created_at:
+        next_cursor = encode_cursor(last_created_at, last_id)
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': f'{{"history": {history_json}, "next_cursor": {json.dumps(next_cursor)}}}',
+        'isBase64Encoded': False
+    }
+
+@with_cursor
+def get_stats(event, conn, cur):
+    """Агрегаты команд из часовых и дневных роллапов"""
+    params = event.get('queryStringParameters') or {}
+    
+    try:
+        query, query_params = build_stats_query(params)
+    except ValueError as e:
+        return json_response(400, {'error': str(e)})
+    
+    cur.execute(query, query_params)
+    stats = []
+    for row in cur.fetchall():
+        stats.append({
+            'device_id': row[0],
+            'device_name': row[1],
+            'command': row[2],
+            'total': int(row[3]),
+            'failed': int(row[4])
+        })
+    
+    return json_response(200, {'stats': stats})
+
+@with_cursor
+def run_history_maintenance(event, conn, cur):
+    """Сбрасывает буфер истории и обслуживает партиции и роллапы"""
+    flush_history()
+    result = maintain_history(cur)
+    conn.commit()
+    
+    return json_response(200, result)
+
+@with_cursor
+def list_groups(event, conn, cur):
+    """Группы устройств с составом"""
+    cur.execute('''
+        SELECT g.id, g.name, g.icon, 
+               json_agg(json_build_object('id', d.id, 'name', d.name, 'type', d.type)) as devices
+        FROM device_groups g
+        LEFT JOIN group_devices gd ON g.id = gd.group_id
+        LEFT JOIN devices d ON gd.device_id = d.id
+        GROUP BY g.id, g.name, g.icon
+    ''')
+    groups = []
+    for row in cur.fetchall():
+        groups.append({
+            'id': row[0],
+            'name': row[1],
+            'icon': row[2],
+            'devices': row[3] if row[3] else []
+        })
+    
+    return json_response(200, {'groups': groups})
+
+# Последний собранный пакет стартового экрана; пока версия данных та же, отдаётся из памяти
+_bootstrap_cache = {'version': None, 'body': None, 'snapshot': None}
+
+# Счётчики bootstrap_versions растут триггерами, у каждой таблицы пакета свой; версия - их склейка
+BOOTSTRAP_VERSION_QUERY = "SELECT string_agg(version::text, '.' ORDER BY table_name) FROM bootstrap_versions"
+
+def bootstrap_query():
+    device_pairs = ', '.join(f"'{field}', {DEVICE_FIELD_SQL.get(field, 'd.' + field)}" for field in DEVICE_DEFAULT_FIELDS)
+    return f'''
+        SELECT json_build_object(
+            'version', %s,
+            'cursor', txid_current_snapshot()::text,
+            'devices', (
+                SELECT coalesce(json_agg(json_build_object({device_pairs}) ORDER BY d.created_at DESC, d.id DESC), '[]')
+                FROM devices d
+                LEFT JOIN ir_code_sets cs ON cs.id = d.code_set_id
+            ),
+            'layouts', (
+                SELECT coalesce(json_agg(json_build_object(
+                    'id', l.id, 'device_id', l.device_id, 'layout_data', l.layout_data, 'updated_at', l.updated_at
+                ) ORDER BY l.device_id, l.id), '[]')
+                FROM remote_layouts l
+                WHERE l.is_default
+            ),
+            'favorites', (
+                SELECT coalesce(json_agg(json_build_object(
+                    'id', f.id, 'device_id', f.device_id, 'command', f.command, 'label', f.label, 'icon', f.icon
+                ) ORDER BY f.id), '[]')
+                FROM favorites f
+            ),
+            'groups', (
+                SELECT coalesce(json_agg(json_build_object(
+                    'id', g.id, 'name', g.name, 'icon', g.icon,
+                    'devices', (
+                        SELECT coalesce(json_agg(json_build_object('id', d.id, 'name', d.name, 'type', d.type) ORDER BY d.id), '[]')
+                        FROM group_devices gd
+                        JOIN devices d ON d.id = gd.device_id
+                        WHERE gd.group_id = g.id
+                    )
+                ) ORDER BY g.id), '[]')
                 FROM device_groups g
-                LEFT JOIN group_devices gd ON g.id = gd.group_id
-                LEFT JOIN devices d ON gd.device_id = d.id
-                GROUP BY g.id, g.name, g.icon
-            ''')
-            groups = []
-            for row in cur.fetchall():
-                groups.append({
-                    'id': row[0],
-                    'name': row[1],
-                    'icon': row[2],
-                    'devices': row[3] if row[3] else []
-                })
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'groups': groups}),
-                'isBase64Encoded': False
-            }
-        
-        if method == 'POST' and action == 'add_device':
-            body = json.loads(event.get('body', '{}'))
-            name = body.get('name')
-            model = body.get('model')
-            device_type = body.get('type')
-            brand = body.get('brand')
-            
-            cur.execute('''
-                INSERT INTO devices (name, model, type, brand, status) 
-                VALUES (%s, %s, %s, %s, %s) 
-                RETURNING id
-            ''', (name, model, device_type, brand, 'online'))
-            device_id = cur.fetchone()[0]
-            conn.commit()
-            
-            return {
-                'statusCode': 201,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'id': device_id, 'message': 'Device added successfully'}),
-                'isBase64Encoded': False
-            }
-        
-        return {
-            'statusCode': 404,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Endpoint not found'}),
-            'isBase64Encoded': False
-        }
+            ),
+            'settings', (
+                SELECT coalesce(json_object_agg(setting_key, setting_value), '{{}}')
+                FROM app_settings
+            )
+        )::text, txid_current_snapshot()::text
+    '''
+
+@with_cursor
+def get_bootstrap(event, conn, cur):
+    """Всё для первого экрана одним запросом: устройства, раскладки по умолчанию, избранное, группы и настройки
+
+    Сначала читается версия данных - шесть строк счётчиков: совпала с If-None-Match - 304,
+    совпала с собранным ранее пакетом - тело из памяти процесса. Сам пакет
+    PostgreSQL собирает одним запросом в готовый JSON.
+    """
+    cur.execute(BOOTSTRAP_VERSION_QUERY)
+    version = cur.fetchone()[0]
+    etag = f'"{version}"'
+    headers = {
+        'ETag': etag,
+        'Cache-Control': 'private, no-cache',
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'ETag'
+    }
+    if get_header(event.get('headers') or {}, 'if-none-match') == etag:
+        return {'statusCode': 304, 'headers': headers, 'body': '', 'isBase64Encoded': False}
     
-    except Exception as e:
+    # Курсор пакета - снимок, из которого он собран; пакет из памяти годится, пока лента может продолжить
+    # с этого снимка, иначе клиент получил бы сброс и тот же пакет снова
+    ensure_feed_listener()
+    with _cache_lock:
+        body = _bootstrap_cache['body'] if _bootstrap_cache['version'] == version else None
+        snapshot = _bootstrap_cache['snapshot']
+    if body is not None:
+        with _feed_cond:
+            if not feed_covers(snapshot):
+                body = None
+    if body is None:
+        cur.execute(bootstrap_query(), (version,))
+        body, snapshot = cur.fetchone()
+        with _cache_lock:
+            _bootstrap_cache.update(version=version, body=body, snapshot=parse_snapshot(snapshot))
+    conn.commit()
+    
+    headers['Content-Type'] = 'application/json'
+    return {'statusCode': 200, 'headers': headers, 'body': body, 'isBase64Encoded': False}
+
+def get_changes(event):
+    """Долгий опрос ленты изменений devices, command_history и app_settings
+
+    Курсор берётся из Last-Event-ID или since, куда клиент кладёт снимок из
+    стартового пакета. С Accept: text/event-stream ответ оформлен как SSE -
+    EventSource сам переподключится с последним id. Тело собирается из
+    готовых текстов уведомлений, без запросов к базе.
+    """
+    params = event.get('queryStringParameters') or {}
+    headers = event.get('headers') or {}
+    # EventSource переподключается с тем же since, но с Last-Event-ID - он новее
+    cursor = get_header(headers, 'last-event-id') or params.get('since')
+    try:
+        timeout = min(FEED_WAIT_SECONDS, float(params.get('wait', FEED_WAIT_SECONDS)))
+    except ValueError:
+        return json_response(400, {'error': 'wait must be a number'})
+    
+    with span('feed_wait'):
+        cursor, reset, changes = read_feed(cursor, max(0.0, timeout))
+    if cursor is None:
+        return json_response(503, {'error': 'Change feed is not connected'})
+    
+    if 'text/event-stream' not in (get_header(headers, 'accept') or ''):
         return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': str(e)}),
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Cache-Control': 'no-store', 'Access-Control-Allow-Origin': '*'},
+            'body': f'{{"cursor": {json.dumps(cursor)}, "reset": {json.dumps(reset)}, "changes": [{", ".join(payload for _, payload in changes)}]}}',
             'isBase64Encoded': False
         }
-    finally:
-        cur.close()
-        conn.close()
\ No newline at end of file
+    
+    frames = ['retry: 1000\n']
+    if reset:
+        frames.append(f'event: reset\nid: {cursor}\ndata: {{}}\n')
+    for seq, payload in changes:
+        frames.append(f'id: {seq}\ndata: {payload}\n')
+    if not changes and not reset:
+        # Кадр без данных не доходит до обработчиков, но запоминает id для переподключения
+        frames.append(f'id: {cursor}\n')
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'text/event-stream', 'Cache-Control': 'no-store', 'Access-Control-Allow-Origin': '*'},
+        'body': '\n'.join(frames) + '\n',
+        'isBase64Encoded': False
+    }
+
+@with_cursor
+def add_device(event, conn, cur):
+    """Добавляет устройство"""
+    body = read_json_body(event)
+    name = body.get('name')
+    model = body.get('model')
+    device_type = body.get('type')
+    brand = body.get('brand')
+    
+    cur.execute('''
+        INSERT INTO devices (name, model, type, brand, status) 
+        VALUES (%s, %s, %s, %s, %s) 
+        RETURNING id
+    ''', (name, model, device_type, brand, 'offline'))
+    device_id = cur.fetchone()[0]
+    conn.commit()
+    
+    return json_response(201, {'id': device_id, 'message': 'Device added successfully'})
\ No newline at end of file
@@ -1,78 +1,447 @@
+import base64
+import functools
+import importlib
 import json
 import os
-import psycopg2
-from datetime import datetime
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from array import array
 
-def handler(event: dict, context) -> dict:
-    '''API для обучения пульта - запись ИК-кодов с реального пульта'''
-    
+FUNCTION_NAME = 'ir-learn'
+
+# >>> shared/framework.py (источник - scripts/shared/framework.py)
+class LazyModule:
+    """Модуль, импортируемый при первом обращении к атрибуту
+
+    Подмодули (psycopg2.extras, psycopg2.pool) подгружаются так же, поэтому
+    preflight и ответы из кэша не платят за импорт драйвера базы и HTTP-клиента.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        try:
+            return getattr(self._module, attr)
+        except AttributeError:
+            return importlib.import_module(f'{self._name}.{attr}')
+
+psycopg2 = LazyModule('psycopg2')
+
+def json_response(status, payload, headers=None):
+    """JSON-ответ функции с CORS-заголовком; headers дополняют стандартные"""
+    response_headers = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+    if headers:
+        response_headers.update(headers)
+    return {'statusCode': status, 'headers': response_headers, 'body': json.dumps(payload), 'isBase64Encoded': False}
+
+def read_json_body(event):
+    return json.loads(event.get('body') or '{}')
+
+def get_header(headers, name):
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+def route_request(event, routes, allow_headers='Content-Type'):
+    """Мини-роутер: preflight, выбор маршрута по (метод, action), 404/405 и ошибки в 500
+
+    routes - {(метод, action или None): функция(event)}. OPTIONS отвечает сразу,
+    не трогая базу и не импортируя драйвер.
+    """
     method = event.get('httpMethod', 'GET')
-    
+    methods = list(dict.fromkeys(route_method for route_method, _ in routes))
     if method == 'OPTIONS':
         return {
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type'
+                'Access-Control-Allow-Methods': ', '.join(methods + ['OPTIONS']),
+                'Access-Control-Allow-Headers': allow_headers
             },
-            'body': ''
+            'body': '',
+            'isBase64Encoded': False
         }
+    if method not in methods:
+        return json_response(405, {'error': 'Method not allowed'})
+    action = (event.get('queryStringParameters') or {}).get('action')
+    route = routes.get((method, action)) or routes.get((method, None))
+    if route is None:
+        return json_response(404, {'error': 'Endpoint not found'})
+    try:
+        return route(event)
+    except Exception as e:
+        return json_response(500, {'error': str(e)})
+
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0.05'))
+
+# Трассировка запроса: участки, число SQL-запросов и строк; вне выборки почти бесплатна
+_trace = threading.local()
+_traced_cursor_classes = {}
+_traced_connection = None
+
+@contextmanager
+def span(name):
+    """Добавляет длительность участка к текущей трассировке, если запрос попал в выборку"""
+    spans = getattr(_trace, 'spans', None)
+    if spans is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        spans[name] = spans.get(name, 0.0) + (time.perf_counter() - started) * 1000
+
+def _traced_cursor_class(base):
+    cursor_class = _traced_cursor_classes.get(base)
+    if cursor_class is None:
+        def execute(self, query, vars=None):
+            if getattr(_trace, 'spans', None) is None:
+                return base.execute(self, query, vars)
+            with span('query'):
+                result = base.execute(self, query, vars)
+            _trace.queries += 1
+            _trace.rows += max(self.rowcount, 0)
+            return result
+        cursor_class = type('Traced' + base.__name__, (base,), {'execute': execute})
+        _traced_cursor_classes[base] = cursor_class
+    return cursor_class
+
+def traced_connection_class():
+    """Класс соединения, курсоры которого отчитываются в трассировку; создаётся при первом подключении"""
+    global _traced_connection
+    if _traced_connection is None:
+        class TracedConnection(psycopg2.extensions.connection):
+            def cursor(self, *args, **kwargs):
+                base = kwargs.pop('cursor_factory', None) or self.cursor_factory or psycopg2.extensions.cursor
+                return super().cursor(*args, cursor_factory=_traced_cursor_class(base), **kwargs)
+
+            def commit(self):
+                with span('commit'):
+                    return super().commit()
+        _traced_connection = TracedConnection
+    return _traced_connection
+
+def traced(handler):
+    """Оборачивает handler: сэмплированные запросы получают Server-Timing и строку лога с метриками пула"""
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        headers = event.get('headers') or {}
+        forced = any(key.lower() == 'x-trace' for key in headers)
+        if not forced and random.random() >= TRACE_SAMPLE_RATE:
+            return handler(event, context)
+        _trace.spans = {}
+        _trace.queries = 0
+        _trace.rows = 0
+        started = time.perf_counter()
+        try:
+            response = handler(event, context)
+        finally:
+            total = (time.perf_counter() - started) * 1000
+            spans = _trace.spans
+            _trace.spans = None
+        timings = [f'{name};dur={duration:.2f}' for name, duration in spans.items()]
+        timings.append(f'db;desc="{_trace.queries} queries, {_trace.rows} rows"')
+        timings.append(f'total;dur={total:.2f}')
+        response_headers = response.setdefault('headers', {})
+        response_headers['Server-Timing'] = ', '.join(timings)
+        response_headers['Access-Control-Expose-Headers'] = ', '.join(
+            filter(None, [response_headers.get('Access-Control-Expose-Headers'), 'Server-Timing'])
+        )
+        print(json.dumps({
+            'function': FUNCTION_NAME,
+            'method': event.get('httpMethod'),
+            'action': (event.get('queryStringParameters') or {}).get('action'),
+            'status': response.get('statusCode'),
+            'total_ms': round(total, 2),
+            'spans': {name: round(duration, 2) for name, duration in spans.items()},
+            'queries': _trace.queries,
+            'rows': _trace.rows,
+            'pool': get_pool_stats()
+        }))
+        return response
+    return wrapper
+
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_MAX_AGE = float(os.environ.get('DB_POOL_MAX_AGE', '300'))
+DB_POOL_CHECK_AFTER = float(os.environ.get('DB_POOL_CHECK_AFTER', '30'))
+DB_POOL_WAIT_TIMEOUT = float(os.environ.get('DB_POOL_WAIT_TIMEOUT', '5'))
+
+# Пул живёт на уровне модуля и переживает тёплые вызовы функции
+_pool_cond = threading.Condition()
+_pool_idle = []
+_pool_meta = {}
+_pool_stats = {'size': 0, 'hits': 0, 'misses': 0, 'replaced': 0, 'waits': 0, 'wait_ms': 0.0}
+
+def get_db_connection():
+    """Выдаёт соединение из пула; ожидание и подключение попадают в трассировку как db_connect"""
+    with span('db_connect'):
+        return _checkout_connection()
+
+def _checkout_connection():
+    """Выдаёт соединение из пула процесса, заменяя устаревшие и разорванные"""
+    started = time.monotonic()
+    while True:
+        conn = _checkout_idle_connection(started)
+        if conn is None:
+            break
+        if _is_connection_usable(conn):
+            return conn
+        _discard_connection(conn)
+        _pool_stats['replaced'] += 1
+    try:
+        conn = psycopg2.connect(os.environ['DATABASE_URL'], connection_factory=traced_connection_class())
+    except Exception:
+        with _pool_cond:
+            _pool_stats['size'] -= 1
+            _pool_cond.notify()
+        raise
+    now = time.monotonic()
+    _pool_meta[conn] = {'created': now, 'used': now}
+    return conn
+
+def _checkout_idle_connection(started):
+    with _pool_cond:
+        while True:
+            if _pool_idle:
+                _pool_stats['hits'] += 1
+                _pool_stats['wait_ms'] += (time.monotonic() - started) * 1000
+                return _pool_idle.pop()
+            if _pool_stats['size'] < DB_POOL_MAX_SIZE:
+                _pool_stats['size'] += 1
+                _pool_stats['misses'] += 1
+                _pool_stats['wait_ms'] += (time.monotonic() - started) * 1000
+                return None
+            remaining = DB_POOL_WAIT_TIMEOUT - (time.monotonic() - started)
+            if remaining <= 0:
+                raise psycopg2.pool.PoolError('Connection pool exhausted')
+            _pool_stats['waits'] += 1
+            _pool_cond.wait(remaining)
+
+def _is_connection_usable(conn):
+    if conn.closed:
+        return False
+    meta = _pool_meta.get(conn)
+    now = time.monotonic()
+    if not meta or now - meta['created'] > DB_POOL_MAX_AGE:
+        return False
+    if now - meta['used'] > DB_POOL_CHECK_AFTER:
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+        except psycopg2.Error:
+            return False
+    return True
+
+def _discard_connection(conn):
+    _pool_meta.pop(conn, None)
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+    with _pool_cond:
+        _pool_stats['size'] -= 1
+        _pool_cond.notify()
+
+def release_db_connection(conn):
+    """Возвращает соединение в пул после отката незавершённой транзакции"""
+    try:
+        conn.rollback()
+    except psycopg2.Error:
+        pass
+    if conn.closed:
+        _discard_connection(conn)
+        return
+    _pool_meta[conn]['used'] = time.monotonic()
+    with _pool_cond:
+        _pool_idle.append(conn)
+        _pool_cond.notify()
+
+def get_pool_stats():
+    """Метрики пула: попадания, промахи, замены и суммарное ожидание"""
+    with _pool_cond:
+        stats = dict(_pool_stats)
+        stats['idle'] = len(_pool_idle)
+    stats['max_size'] = DB_POOL_MAX_SIZE
+    return stats
+# <<< shared/framework.py
+
+# >>> shared/codec.py (источник - scripts/shared/codec.py)
+IR_PROTOCOLS = ('NEC', 'NECX', 'SAMSUNG', 'SONY', 'RC5', 'RC6', 'PANASONIC', 'JVC', 'LG', 'SHARP')
+PRONTO_UNIT_US = 0.241246
+MAX_TIMINGS = 512
+
+def encode_ir_code(ir_code):
+    """Нормализует ИК-код в компактную посылку для блока
+
+    Поддерживаются "ПРОТОКОЛ:0xЗНАЧЕНИЕ[:биты]" (NEC раскладывается на адрес и
+    команду), Pronto Hex, "raw:частота:мкс,мкс,..." и короткие hex-коды, которые
+    передаются как есть. Тайминги упаковываются в uint16 и base64.
+    Нераспознанный формат - ValueError.
+    """
+    code = ir_code.strip() if isinstance(ir_code, str) else ''
+    if not code:
+        raise ValueError('IR code must be a non-empty string')
+    words = code.split()
+    if len(words) > 4 and all(len(word) == 4 for word in words):
+        return _encode_pronto(words)
+    if code.lower().startswith('raw:'):
+        return _encode_raw(code)
+    if ':' in code:
+        return _encode_protocol(code)
+    if len(code) <= 16 and all(char in '0123456789abcdefABCDEF' for char in code):
+        return {'code': code.upper()}
+    raise ValueError(f'Unrecognised IR code format: {code[:32]}')
+
+def _encode_protocol(code):
+    parts = code.split(':')
+    protocol = parts[0].upper()
+    if protocol not in IR_PROTOCOLS or len(parts) > 3:
+        raise ValueError(f'Unsupported IR protocol: {parts[0]}')
+    try:
+        value = int(parts[1], 16)
+        bits = int(parts[2]) if len(parts) == 3 else None
+    except ValueError:
+        raise ValueError(f'Invalid {protocol} code value: {parts[1]}')
+    if protocol == 'NEC' and bits in (None, 32):
+        if not 0 <= value <= 0xFFFFFFFF:
+            raise ValueError('NEC code must fit in 32 bits')
+        address, address_inv, command, command_inv = value.to_bytes(4, 'big')
+        if command ^ command_inv != 0xFF:
+            raise ValueError('NEC command byte fails its inverse check')
+        if address ^ address_inv != 0xFF:
+            # Расширенный NEC: 16-битный адрес без инверсии
+            address = (address << 8) | address_inv
+        return {'p': 'NEC', 'a': address, 'c': command}
+    payload = {'p': protocol, 'v': value}
+    if bits:
+        payload['b'] = bits
+    return payload
+
+def _encode_pronto(words):
+    try:
+        values = [int(word, 16) for word in words]
+    except ValueError:
+        raise ValueError('Pronto code must consist of 4-digit hex words')
+    kind, frequency_word, once_pairs, repeat_pairs = values[:4]
+    if kind != 0 or not frequency_word:
+        raise ValueError('Only learned (0000) Pronto codes are supported')
+    if len(values) != 4 + 2 * (once_pairs + repeat_pairs):
+        raise ValueError('Pronto code length does not match its burst pair counts')
+    period_us = frequency_word * PRONTO_UNIT_US
+    timings = [round(value * period_us) for value in values[4:]]
+    return _pack_timings(round(1000000 / period_us), timings, 2 * once_pairs)
+
+def _encode_raw(code):
+    parts = code.split(':')
+    try:
+        frequency = int(parts[1])
+        timings = [int(value) for value in parts[2].split(',')]
+    except (IndexError, ValueError):
+        raise ValueError('Raw code must look like raw:38000:9000,4500,...')
+    return _pack_timings(frequency, timings, len(timings))
+
+def _pack_timings(frequency, timings, repeat_from):
+    if not 10000 <= frequency <= 500000:
+        raise ValueError(f'Carrier frequency out of range: {frequency}')
+    if not timings or len(timings) % 2 or len(timings) > MAX_TIMINGS:
+        raise ValueError('Timings must be a non-empty even list of mark/space durations')
+    if any(value <= 0 for value in timings) or any(mark > 0xFFFF for mark in timings[::2]):
+        raise ValueError('Marks must be between 1 and 65535 us')
+    # Паузы длиннее 65 мс для блока неотличимы от тишины, обрезаем их до uint16
+    packed_timings = array('H', [min(value, 0xFFFF) for value in timings])
+    if sys.byteorder == 'big':
+        packed_timings.byteswap()
+    packed = base64.b64encode(packed_timings.tobytes()).decode()
+    payload = {'p': 'RAW', 'f': frequency, 't': packed}
+    if repeat_from < len(timings):
+        payload['r'] = repeat_from
+    return payload
+# <<< shared/codec.py
+
+BULK_LEARN_MAX_CODES = int(os.environ.get('BULK_LEARN_MAX_CODES', '200'))
+
+def validate_codes(device_id, codes):
+    """Проверяет пакет обучения {"кнопка": "код", ...}"""
+    if not device_id:
+        return 'Missing required field: device_id'
+    if not isinstance(codes, dict) or not codes:
+        return 'codes must be a non-empty object of button: ir_code'
+    if len(codes) > BULK_LEARN_MAX_CODES:
+        return f'At most {BULK_LEARN_MAX_CODES} codes per request'
+    for button, ir_code in codes.items():
+        if not button or not isinstance(ir_code, str) or not ir_code:
+            return f'Invalid IR code for button {button!r}'
+    return None
+
+@traced
+def handler(event: dict, context) -> dict:
+    '''API для обучения пульта - запись ИК-кодов с реального пульта'''
+    return route_request(event, {('POST', None): learn_codes})
+
+def learn_codes(event):
+    """Сохраняет один код кнопки или пакет {"кнопка": "код"} одним UPDATE"""
+    body = read_json_body(event)
+    device_id = body.get('device_id')
     
-    if method == 'POST':
-        body = json.loads(event.get('body', '{}'))
-        device_id = body.get('device_id')
+    if 'codes' in body:
+        codes = body.get('codes')
+        error = validate_codes(device_id, codes)
+    else:
         button = body.get('button')
         ir_code = body.get('ir_code')
-        
-        if not all([device_id, button, ir_code]):
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Missing required fields: device_id, button, ir_code'})
-            }
-        
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
-        cur = conn.cursor()
-        
-        # Получаем текущие коды устройства
-        cur.execute('SELECT ir_codes FROM devices WHERE id = %s', (device_id,))
-        result = cur.fetchone()
-        
-        if not result:
-            cur.close()
-            conn.close()
-            return {
-                'statusCode': 404,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Device not found'})
-            }
-        
-        ir_codes = result[0] or {}
-        ir_codes[button] = ir_code
-        
-        # Обновляем коды
-        cur.execute(
-            'UPDATE devices SET ir_codes = %s, updated_at = %s WHERE id = %s',
-            (json.dumps(ir_codes), datetime.utcnow().isoformat(), device_id)
-        )
+        codes = {button: ir_code}
+        error = None if all([device_id, button, ir_code]) else 'Missing required fields: device_id, button, ir_code'
+    
+    if not error:
+        try:
+            payloads = {button: encode_ir_code(code) for button, code in codes.items()}
+        except ValueError as e:
+            error = str(e)
+    
+    if error:
+        return json_response(400, {'error': error})
+    
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        # Слияние внутри БД: одна инструкция без чтения blob и без потерянных обновлений
+        cur.execute('''
+            UPDATE devices
+            SET ir_codes = COALESCE(ir_codes, '{}'::jsonb) || %s::jsonb,
+                ir_payloads = COALESCE(ir_payloads, '{}'::jsonb) || %s::jsonb,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s
+        ''', (json.dumps(codes), json.dumps(payloads), device_id))
+        updated = cur.rowcount
         conn.commit()
+    finally:
         cur.close()
-        conn.close()
-        
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({
-                'success': True,
-                'message': f'IR code for {button} saved successfully',
-                'button': button,
-                'ir_code': ir_code
-            })
-        }
+        release_db_connection(conn)
+    
+    if not updated:
+        return json_response(404, {'error': 'Device not found'})
+    
+    if 'codes' in body:
+        return json_response(200, {
+            'success': True,
+            'message': f'{len(codes)} IR codes saved successfully',
+            'buttons': list(codes)
+        })
     
-    return {
-        'statusCode': 405,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'error': 'Method not allowed'})
-    }
+    return json_response(200, {
+        'success': True,
+        'message': f'IR code for {button} saved successfully',
+        'button': button,
+        'ir_code': ir_code,
+        'payload': payloads[button]
+    })
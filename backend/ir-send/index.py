@@ -1,126 +1,1904 @@
 """API для отправки ИК-команд на устройства"""
+import atexit
+import copy
+import functools
+import hashlib
+import heapq
+import importlib
 import json
+import math
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
-import requests
-from datetime import datetime
+import random
+import select
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlsplit
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta, timezone
 
-def get_db_connection():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+FUNCTION_NAME = 'ir-send'
 
-def handler(event: dict, context) -> dict:
-    """Отправляет ИК-команду на устройство через HTTP API"""
+# >>> shared/framework.py (источник - scripts/shared/framework.py)
+class LazyModule:
+    """Модуль, импортируемый при первом обращении к атрибуту
+
+    Подмодули (psycopg2.extras, psycopg2.pool) подгружаются так же, поэтому
+    preflight и ответы из кэша не платят за импорт драйвера базы и HTTP-клиента.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        try:
+            return getattr(self._module, attr)
+        except AttributeError:
+            return importlib.import_module(f'{self._name}.{attr}')
+
+psycopg2 = LazyModule('psycopg2')
+
+def json_response(status, payload, headers=None):
+    """JSON-ответ функции с CORS-заголовком; headers дополняют стандартные"""
+    response_headers = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+    if headers:
+        response_headers.update(headers)
+    return {'statusCode': status, 'headers': response_headers, 'body': json.dumps(payload), 'isBase64Encoded': False}
+
+def read_json_body(event):
+    return json.loads(event.get('body') or '{}')
+
+def get_header(headers, name):
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+def route_request(event, routes, allow_headers='Content-Type'):
+    """Мини-роутер: preflight, выбор маршрута по (метод, action), 404/405 и ошибки в 500
+
+    routes - {(метод, action или None): функция(event)}. OPTIONS отвечает сразу,
+    не трогая базу и не импортируя драйвер.
+    """
     method = event.get('httpMethod', 'GET')
-    
+    methods = list(dict.fromkeys(route_method for route_method, _ in routes))
     if method == 'OPTIONS':
         return {
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type'
+                'Access-Control-Allow-Methods': ', '.join(methods + ['OPTIONS']),
+                'Access-Control-Allow-Headers': allow_headers
             },
-            'body': ''
+            'body': '',
+            'isBase64Encoded': False
         }
+    if method not in methods:
+        return json_response(405, {'error': 'Method not allowed'})
+    action = (event.get('queryStringParameters') or {}).get('action')
+    route = routes.get((method, action)) or routes.get((method, None))
+    if route is None:
+        return json_response(404, {'error': 'Endpoint not found'})
+    try:
+        return route(event)
+    except Exception as e:
+        return json_response(500, {'error': str(e)})
+
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0.05'))
+
+# Трассировка запроса: участки, число SQL-запросов и строк; вне выборки почти бесплатна
+_trace = threading.local()
+_traced_cursor_classes = {}
+_traced_connection = None
+
+@contextmanager
+def span(name):
+    """Добавляет длительность участка к текущей трассировке, если запрос попал в выборку"""
+    spans = getattr(_trace, 'spans', None)
+    if spans is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        spans[name] = spans.get(name, 0.0) + (time.perf_counter() - started) * 1000
+
+def _traced_cursor_class(base):
+    cursor_class = _traced_cursor_classes.get(base)
+    if cursor_class is None:
+        def execute(self, query, vars=None):
+            if getattr(_trace, 'spans', None) is None:
+                return base.execute(self, query, vars)
+            with span('query'):
+                result = base.execute(self, query, vars)
+            _trace.queries += 1
+            _trace.rows += max(self.rowcount, 0)
+            return result
+        cursor_class = type('Traced' + base.__name__, (base,), {'execute': execute})
+        _traced_cursor_classes[base] = cursor_class
+    return cursor_class
+
+def traced_connection_class():
+    """Класс соединения, курсоры которого отчитываются в трассировку; создаётся при первом подключении"""
+    global _traced_connection
+    if _traced_connection is None:
+        class TracedConnection(psycopg2.extensions.connection):
+            def cursor(self, *args, **kwargs):
+                base = kwargs.pop('cursor_factory', None) or self.cursor_factory or psycopg2.extensions.cursor
+                return super().cursor(*args, cursor_factory=_traced_cursor_class(base), **kwargs)
+
+            def commit(self):
+                with span('commit'):
+                    return super().commit()
+        _traced_connection = TracedConnection
+    return _traced_connection
+
+def traced(handler):
+    """Оборачивает handler: сэмплированные запросы получают Server-Timing и строку лога с метриками пула"""
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        headers = event.get('headers') or {}
+        forced = any(key.lower() == 'x-trace' for key in headers)
+        if not forced and random.random() >= TRACE_SAMPLE_RATE:
+            return handler(event, context)
+        _trace.spans = {}
+        _trace.queries = 0
+        _trace.rows = 0
+        started = time.perf_counter()
+        try:
+            response = handler(event, context)
+        finally:
+            total = (time.perf_counter() - started) * 1000
+            spans = _trace.spans
+            _trace.spans = None
+        timings = [f'{name};dur={duration:.2f}' for name, duration in spans.items()]
+        timings.append(f'db;desc="{_trace.queries} queries, {_trace.rows} rows"')
+        timings.append(f'total;dur={total:.2f}')
+        response_headers = response.setdefault('headers', {})
+        response_headers['Server-Timing'] = ', '.join(timings)
+        response_headers['Access-Control-Expose-Headers'] = ', '.join(
+            filter(None, [response_headers.get('Access-Control-Expose-Headers'), 'Server-Timing'])
+        )
+        print(json.dumps({
+            'function': FUNCTION_NAME,
+            'method': event.get('httpMethod'),
+            'action': (event.get('queryStringParameters') or {}).get('action'),
+            'status': response.get('statusCode'),
+            'total_ms': round(total, 2),
+            'spans': {name: round(duration, 2) for name, duration in spans.items()},
+            'queries': _trace.queries,
+            'rows': _trace.rows,
+            'pool': get_pool_stats()
+        }))
+        return response
+    return wrapper
+
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_MAX_AGE = float(os.environ.get('DB_POOL_MAX_AGE', '300'))
+DB_POOL_CHECK_AFTER = float(os.environ.get('DB_POOL_CHECK_AFTER', '30'))
+DB_POOL_WAIT_TIMEOUT = float(os.environ.get('DB_POOL_WAIT_TIMEOUT', '5'))
+
+# Пул живёт на уровне модуля и переживает тёплые вызовы функции
+_pool_cond = threading.Condition()
+_pool_idle = []
+_pool_meta = {}
+_pool_stats = {'size': 0, 'hits': 0, 'misses': 0, 'replaced': 0, 'waits': 0, 'wait_ms': 0.0}
+
+def get_db_connection():
+    """Выдаёт соединение из пула; ожидание и подключение попадают в трассировку как db_connect"""
+    with span('db_connect'):
+        return _checkout_connection()
+
+def _checkout_connection():
+    """Выдаёт соединение из пула процесса, заменяя устаревшие и разорванные"""
+    started = time.monotonic()
+    while True:
+        conn = _checkout_idle_connection(started)
+        if conn is None:
+            break
+        if _is_connection_usable(conn):
+            return conn
+        _discard_connection(conn)
+        _pool_stats['replaced'] += 1
+    try:
+        conn = psycopg2.connect(os.environ['DATABASE_URL'], connection_factory=traced_connection_class())
+    except Exception:
+        with _pool_cond:
+            _pool_stats['size'] -= 1
+            _pool_cond.notify()
+        raise
+    now = time.monotonic()
+    _pool_meta[conn] = {'created': now, 'used': now}
+    return conn
+
+def _checkout_idle_connection(started):
+    with _pool_cond:
+        while True:
+            if _pool_idle:
+                _pool_stats['hits'] += 1
+                _pool_stats['wait_ms'] += (time.monotonic() - started) * 1000
+                return _pool_idle.pop()
+            if _pool_stats['size'] < DB_POOL_MAX_SIZE:
+                _pool_stats['size'] += 1
+                _pool_stats['misses'] += 1
+                _pool_stats['wait_ms'] += (time.monotonic() - started) * 1000
+                return None
+            remaining = DB_POOL_WAIT_TIMEOUT - (time.monotonic() - started)
+            if remaining <= 0:
+                raise psycopg2.pool.PoolError('Connection pool exhausted')
+            _pool_stats['waits'] += 1
+            _pool_cond.wait(remaining)
+
+def _is_connection_usable(conn):
+    if conn.closed:
+        return False
+    meta = _pool_meta.get(conn)
+    now = time.monotonic()
+    if not meta or now - meta['created'] > DB_POOL_MAX_AGE:
+        return False
+    if now - meta['used'] > DB_POOL_CHECK_AFTER:
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+        except psycopg2.Error:
+            return False
+    return True
+
+def _discard_connection(conn):
+    _pool_meta.pop(conn, None)
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+    with _pool_cond:
+        _pool_stats['size'] -= 1
+        _pool_cond.notify()
+
+def release_db_connection(conn):
+    """Возвращает соединение в пул после отката незавершённой транзакции"""
+    try:
+        conn.rollback()
+    except psycopg2.Error:
+        pass
+    if conn.closed:
+        _discard_connection(conn)
+        return
+    _pool_meta[conn]['used'] = time.monotonic()
+    with _pool_cond:
+        _pool_idle.append(conn)
+        _pool_cond.notify()
+
+def get_pool_stats():
+    """Метрики пула: попадания, промахи, замены и суммарное ожидание"""
+    with _pool_cond:
+        stats = dict(_pool_stats)
+        stats['idle'] = len(_pool_idle)
+    stats['max_size'] = DB_POOL_MAX_SIZE
+    return stats
+# <<< shared/framework.py
+
+requests = LazyModule('requests')
+# Нужны только кругу проверки мостов и расписаниям, не каждому холодному старту
+asyncio = LazyModule('asyncio')
+zoneinfo = LazyModule('zoneinfo')
+
+DEVICE_CACHE_TTL = float(os.environ.get('DEVICE_CACHE_TTL', '30'))
+DEVICE_CACHE_MAX_SIZE = int(os.environ.get('DEVICE_CACHE_MAX_SIZE', '256'))
+SETTINGS_SNAPSHOT_TTL = float(os.environ.get('SETTINGS_SNAPSHOT_TTL', '60'))
+
+# Кэш ИК-кодов и снимок настроек; сбрасываются по NOTIFY из триггеров на devices и app_settings
+_device_cache = OrderedDict()
+# Растёт при каждом сбросе записей устройств: чтение, начатое до сброса, не кладётся в кэш
+_device_cache_state = {'generation': 0}
+_settings_snapshot = {'expires': 0.0, 'generation': 0, 'version': None, 'values': {}}
+_cache_lock = threading.Lock()
+_listen_conn = None
+
+def _drain_invalidations():
+    """Забирает накопленные уведомления об изменениях и выкидывает устаревшие записи кэша"""
+    global _listen_conn
+    try:
+        if _listen_conn is None or _listen_conn.closed:
+            _listen_conn = psycopg2.connect(os.environ['DATABASE_URL'])
+            _listen_conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with _listen_conn.cursor() as cur:
+                cur.execute('LISTEN device_changes; LISTEN settings_changes; LISTEN bridge_changes')
+            # Пока слушателя не было, изменения могли пройти незамеченными
+            clear_caches()
+        _listen_conn.poll()
+    except psycopg2.Error:
+        if _listen_conn is not None and not _listen_conn.closed:
+            _listen_conn.close()
+        _listen_conn = None
+        clear_caches()
+        return
+    with _cache_lock:
+        while _listen_conn.notifies:
+            notify = _listen_conn.notifies.pop(0)
+            if notify.channel == 'device_changes':
+                _device_cache.pop(notify.payload, None)
+                _device_cache_state['generation'] += 1
+            elif notify.channel == 'bridge_changes':
+                _invalidate_routing_table()
+            else:
+                _invalidate_settings_snapshot()
+
+def clear_caches():
+    with _cache_lock:
+        _device_cache.clear()
+        _device_cache_state['generation'] += 1
+        _invalidate_settings_snapshot()
+        _invalidate_routing_table()
+
+def _invalidate_settings_snapshot():
+    _settings_snapshot['expires'] = 0.0
+    _settings_snapshot['generation'] += 1
+
+def get_device(conn, device_id):
+    """Возвращает имя, ИК-коды и привязку к мостам устройства; повторные нажатия обслуживаются из кэша"""
+    return get_devices(conn, [device_id]).get(str(device_id))
+
+def get_devices(conn, device_ids):
+    """Возвращает {str(id): устройство}; всё, чего нет в кэше, читается одним запросом"""
+    _drain_invalidations()
+    now = time.monotonic()
+    found = {}
+    missing = []
+    with _cache_lock:
+        generation = _device_cache_state['generation']
+        for device_id in device_ids:
+            key = str(device_id)
+            entry = _device_cache.get(key)
+            if entry and entry[0] > now:
+                _device_cache.move_to_end(key)
+                found[key] = entry[1]
+            elif key not in missing:
+                missing.append(key)
+    if not missing:
+        return found
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT d.id, d.name,
+                   coalesce(cs.codes, '{}'::jsonb) || coalesce(d.ir_codes, '{}'::jsonb),
+                   coalesce(cs.payloads, '{}'::jsonb) || coalesce(d.ir_payloads, '{}'::jsonb),
+                   d.room, d.bridge_id, d.fallback_bridge_id
+            FROM t_p77920312_universal_remote_app.devices d
+            LEFT JOIN t_p77920312_universal_remote_app.ir_code_sets cs ON cs.id = d.code_set_id
+            WHERE d.id = ANY(%s)
+        """, ([int(key) for key in missing],))
+        rows = cur.fetchall()
+    with _cache_lock:
+        for row in rows:
+            key = str(row[0])
+            device = {
+                'name': row[1],
+                'ir_codes': row[2] or {},
+                'ir_payloads': row[3] or {},
+                'room': row[4],
+                'bridge_id': row[5],
+                'fallback_bridge_id': row[6]
+            }
+            found[key] = device
+            if _device_cache_state['generation'] == generation:
+                _device_cache[key] = (now + DEVICE_CACHE_TTL, device)
+                _device_cache.move_to_end(key)
+        while len(_device_cache) > DEVICE_CACHE_MAX_SIZE:
+            _device_cache.popitem(last=False)
+    return found
+
+def get_settings_snapshot(conn):
+    """Версионированный снимок app_settings; перечитывается целиком только после NOTIFY или по TTL"""
+    _drain_invalidations()
+    with _cache_lock:
+        if _settings_snapshot['expires'] > time.monotonic():
+            return dict(_settings_snapshot)
+        generation = _settings_snapshot['generation']
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT setting_key, setting_value
+            FROM t_p77920312_universal_remote_app.app_settings
+        """)
+        values = dict(cur.fetchall())
+    snapshot = {
+        'expires': time.monotonic() + SETTINGS_SNAPSHOT_TTL,
+        'generation': generation,
+        'version': hashlib.md5(json.dumps(values, sort_keys=True).encode()).hexdigest()[:16],
+        'values': values
+    }
+    with _cache_lock:
+        # Уведомление, пришедшее во время чтения, важнее только что прочитанного снимка
+        if _settings_snapshot['generation'] == generation:
+            _settings_snapshot.update(snapshot)
+    return snapshot
+
+def get_setting(conn, setting_key):
+    """Возвращает значение настройки из снимка"""
+    return get_settings_snapshot(conn)['values'].get(setting_key)
+
+BRIDGE_ROUTES_TTL = float(os.environ.get('BRIDGE_ROUTES_TTL', '300'))
+# Автомат на мост: после N неудач подряд мост пропускается BRIDGE_OPEN_SECONDS, затем одно пробное нажатие
+BRIDGE_FAILURE_THRESHOLD = int(os.environ.get('BRIDGE_FAILURE_THRESHOLD', '3'))
+BRIDGE_OPEN_SECONDS = float(os.environ.get('BRIDGE_OPEN_SECONDS', '30'))
+# Период фонового круга проверки мостов и статусов устройств; 0 отключает
+BRIDGE_PROBE_INTERVAL = float(os.environ.get('BRIDGE_PROBE_INTERVAL', '15'))
+BRIDGE_PROBE_TIMEOUT = float(os.environ.get('BRIDGE_PROBE_TIMEOUT', '1'))
+BRIDGE_PROBE_CONCURRENCY = int(os.environ.get('BRIDGE_PROBE_CONCURRENCY', '64'))
+# Статус пишется в devices, только когда столько кругов подряд дали один и тот же результат
+BRIDGE_STATUS_STABLE_PROBES = int(os.environ.get('BRIDGE_STATUS_STABLE_PROBES', '3'))
+# Ключ advisory-блокировки: мосты проверяет и пишет статусы только процесс, который её держит
+BRIDGE_PROBER_LOCK_ID = 7792031201
+
+# Таблица маршрутов из ir_bridges; сбрасывается по NOTIFY bridge_changes
+_routing_table = {'expires': 0.0, 'generation': 0, 'bridges': {}, 'rooms': {}}
+_bridge_lock = threading.Lock()
+_bridge_health = {}
+_prober_thread = None
+# Последний известный статус устройств лидера проверки; в devices.status пишутся только изменения
+_device_status = {}
+# Результат последних кругов по устройству: (online|offline, сколько кругов подряд)
+_status_streaks = {}
+_status_stats = {'leader': False, 'rounds': 0, 'probed': 0, 'changed': 0, 'checked_at': None}
+
+def _invalidate_routing_table():
+    _routing_table['expires'] = 0.0
+    _routing_table['generation'] += 1
+
+def get_routing_table(conn):
+    """Включённые мосты {id: endpoint} и мосты комнат {room: [endpoint]} в порядке priority"""
+    _drain_invalidations()
+    with _cache_lock:
+        if _routing_table['expires'] > time.monotonic():
+            return dict(_routing_table)
+        generation = _routing_table['generation']
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT id, endpoint, room
+            FROM t_p77920312_universal_remote_app.ir_bridges
+            WHERE enabled
+            ORDER BY priority, id
+        """)
+        rows = cur.fetchall()
+    table = {
+        'expires': time.monotonic() + BRIDGE_ROUTES_TTL,
+        'generation': generation,
+        'bridges': {bridge_id: endpoint for bridge_id, endpoint, room in rows},
+        'rooms': {}
+    }
+    for bridge_id, endpoint, room in rows:
+        if room:
+            table['rooms'].setdefault(room, []).append(endpoint)
+    with _cache_lock:
+        if _routing_table['generation'] == generation:
+            _routing_table.update(table)
+    return table
+
+def resolve_endpoints(conn, device):
+    """Кандидаты для устройства по порядку: свой мост, резервный, мосты комнаты, общий ir_endpoint"""
+    return route_candidates(get_routing_table(conn), get_setting(conn, 'ir_endpoint'), device)
+
+def route_candidates(table, default_endpoint, device):
+    candidates = [table['bridges'].get(device['bridge_id']), table['bridges'].get(device['fallback_bridge_id'])]
+    candidates.extend(table['rooms'].get(device['room'], ()))
+    candidates.append(default_endpoint)
+    return list(dict.fromkeys(endpoint for endpoint in candidates if endpoint))
+
+def bridge_available(endpoint, reserve=True):
+    """False, пока автомат моста разомкнут
+
+    По истечении BRIDGE_OPEN_SECONDS пропускается одно пробное обращение
+    (reserve=True занимает его), остальные ждут его исхода.
+    """
+    now = time.monotonic()
+    with _bridge_lock:
+        state = _bridge_health.get(endpoint)
+        if state is None or state['failures'] < BRIDGE_FAILURE_THRESHOLD:
+            return True
+        if state['open_until'] > now:
+            return False
+        if reserve:
+            state['open_until'] = now + BRIDGE_OPEN_SECONDS
+        return True
+
+def bridge_retry_after(endpoint):
+    """Секунды до пробного обращения к мосту с разомкнутым автоматом, 0 - если можно слать сейчас"""
+    with _bridge_lock:
+        state = _bridge_health.get(endpoint)
+        if state is None or state['failures'] < BRIDGE_FAILURE_THRESHOLD:
+            return 0.0
+        return max(0.0, state['open_until'] - time.monotonic())
+
+def preferred_endpoint(endpoints):
+    """Мост, на который сейчас уйдёт команда: первый с замкнутым автоматом"""
+    for endpoint in endpoints:
+        if bridge_available(endpoint, reserve=False):
+            return endpoint
+    return endpoints[0] if endpoints else None
+
+def record_bridge_result(endpoint, ok, error=None):
+    with _bridge_lock:
+        state = _bridge_health.setdefault(endpoint, {'failures': 0, 'open_until': 0.0, 'last_error': None})
+        if ok:
+            state['failures'] = 0
+            state['open_until'] = 0.0
+            return
+        state['failures'] += 1
+        state['last_error'] = error
+        if state['failures'] == BRIDGE_FAILURE_THRESHOLD:
+            state['open_until'] = time.monotonic() + BRIDGE_OPEN_SECONDS
+
+def ensure_bridge_prober():
+    """Запускает поток, который ждёт лидерства и проверяет мосты; нажатия его не запускают"""
+    global _prober_thread
+    if BRIDGE_PROBE_INTERVAL <= 0:
+        return
+    with _bridge_lock:
+        if _prober_thread is None or not _prober_thread.is_alive():
+            _prober_thread = threading.Thread(target=_bridge_prober, name='bridge-prober', daemon=True)
+            _prober_thread.start()
+
+def _bridge_prober():
+    """Круги проверки, пока процесс держит блокировку лидера; остальные процессы раз в круг пробуют её взять
+
+    Блокировка сессионная и живёт на отдельном соединении вне пула: упал
+    процесс или соединение - лидерство переходит к следующему.
+    """
+    conn = None
+    while True:
+        try:
+            if conn is None or conn.closed:
+                _status_stats['leader'] = False
+                conn = psycopg2.connect(os.environ['DATABASE_URL'])
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cur:
+                if _status_stats['leader']:
+                    cur.execute('SELECT 1')
+                else:
+                    cur.execute('SELECT pg_try_advisory_lock(%s)', (BRIDGE_PROBER_LOCK_ID,))
+                    _status_stats['leader'] = cur.fetchone()[0]
+        except psycopg2.Error:
+            _status_stats['leader'] = False
+            if conn is not None and not conn.closed:
+                conn.close()
+        if _status_stats['leader']:
+            try:
+                refresh_device_statuses()
+            except Exception:
+                pass
+        time.sleep(BRIDGE_PROBE_INTERVAL)
+
+def refresh_device_statuses():
+    """Круг проверки: все мосты параллельно, затем статусы устройств по их маршрутам
+
+    Устройство online, если доступен хотя бы один его кандидат. Статус
+    меняется только после BRIDGE_STATUS_STABLE_PROBES одинаковых кругов, чтобы
+    мигающий мост не переписывал строки; изменения пишутся одним UPDATE.
+    """
+    conn = get_db_connection()
+    try:
+        table = get_routing_table(conn)
+        default_endpoint = get_setting(conn, 'ir_endpoint')
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT id, room, bridge_id, fallback_bridge_id, status
+                FROM t_p77920312_universal_remote_app.devices
+            """)
+            rows = cur.fetchall()
+        conn.commit()
+    finally:
+        release_db_connection(conn)
+    
+    routes = {}
+    for device_id, room, bridge_id, fallback_bridge_id, status in rows:
+        device = {'room': room, 'bridge_id': bridge_id, 'fallback_bridge_id': fallback_bridge_id}
+        routes[device_id] = route_candidates(table, default_endpoint, device)
+    endpoints = set(table['bridges'].values())
+    for candidates in routes.values():
+        endpoints.update(candidates)
+    probes = asyncio.run(probe_endpoints(endpoints))
+    for endpoint, (ok, error) in probes.items():
+        record_bridge_result(endpoint, ok, error)
     
-    if method != 'POST':
+    changes = []
+    with _bridge_lock:
+        for device_id, room, bridge_id, fallback_bridge_id, status in rows:
+            observed = 'online' if any(probes[endpoint][0] for endpoint in routes[device_id]) else 'offline'
+            previous, rounds = _status_streaks.get(device_id, (None, 0))
+            rounds = rounds + 1 if observed == previous else 1
+            _status_streaks[device_id] = (observed, rounds)
+            current = observed if rounds >= BRIDGE_STATUS_STABLE_PROBES else status
+            _device_status[device_id] = current
+            if current != status:
+                changes.append((device_id, current))
+        for device_id in set(_device_status) - set(routes):
+            del _device_status[device_id]
+            _status_streaks.pop(device_id, None)
+        _status_stats['rounds'] += 1
+        _status_stats['probed'] += len(probes)
+        _status_stats['changed'] += len(changes)
+        _status_stats['checked_at'] = datetime.now(timezone.utc).isoformat()
+    if not changes:
+        return changes
+    
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            # updated_at не двигается: статус клиенты получают из ленты изменений и action=status,
+            # а ETag списков, кэши устройств и версия стартового экрана остаются прежними (V0014)
+            psycopg2.extras.execute_values(cur, """
+                UPDATE t_p77920312_universal_remote_app.devices d
+                SET status = v.status
+                FROM (VALUES %s) AS v(id, status)
+                WHERE d.id = v.id AND d.status IS DISTINCT FROM v.status
+            """, changes, template='(%s::integer, %s::varchar)')
+        conn.commit()
+    finally:
+        release_db_connection(conn)
+    return changes
+
+async def probe_endpoints(endpoints):
+    """{endpoint: (доступен, ошибка)} по TCP-подключению к хосту моста, не более BRIDGE_PROBE_CONCURRENCY разом"""
+    semaphore = asyncio.Semaphore(BRIDGE_PROBE_CONCURRENCY)
+    results = await asyncio.gather(*(_probe_endpoint(endpoint, semaphore) for endpoint in endpoints))
+    return dict(zip(endpoints, results))
+
+async def _probe_endpoint(endpoint, semaphore):
+    try:
+        parts = urlsplit(endpoint)
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+    except ValueError:
+        return False, 'Invalid endpoint'
+    if not parts.hostname:
+        return False, 'Invalid endpoint'
+    async with semaphore:
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(parts.hostname, port), BRIDGE_PROBE_TIMEOUT)
+        except asyncio.TimeoutError:
+            return False, 'Probe timed out'
+        except OSError as e:
+            return False, f'Probe failed: {e.strerror or type(e).__name__}'
+        writer.close()
+        return True, None
+
+def get_device_statuses():
+    with _bridge_lock:
+        return dict(_status_stats, devices={str(device_id): status for device_id, status in _device_status.items()})
+
+def get_bridge_health():
+    now = time.monotonic()
+    with _bridge_lock:
         return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Only POST method allowed'})
+            endpoint: {
+                'circuit': 'closed' if state['failures'] < BRIDGE_FAILURE_THRESHOLD
+                           else 'open' if state['open_until'] > now else 'half_open',
+                'failures': state['failures'],
+                'last_error': state['last_error']
+            }
+            for endpoint, state in _bridge_health.items()
         }
+
+HISTORY_TABLE = 't_p77920312_universal_remote_app.command_history'
+# >>> shared/history.py (источник - scripts/shared/history.py)
+HISTORY_MODE = os.environ.get('HISTORY_MODE', 'buffered')
+HISTORY_FLUSH_SIZE = int(os.environ.get('HISTORY_FLUSH_SIZE', '100'))
+HISTORY_FLUSH_INTERVAL = float(os.environ.get('HISTORY_FLUSH_INTERVAL', '1'))
+HISTORY_QUEUE_MAX_SIZE = int(os.environ.get('HISTORY_QUEUE_MAX_SIZE', '10000'))
+# block - нажатие ждёт освобождения места в очереди, drop - вытесняются самые старые записи
+HISTORY_BACKPRESSURE = os.environ.get('HISTORY_BACKPRESSURE', 'block')
+# Дольше этого block не ждёт: при недоступной базе записи отбрасываются, а нажатие идёт дальше
+HISTORY_BLOCK_TIMEOUT = float(os.environ.get('HISTORY_BLOCK_TIMEOUT', '2'))
+# Столько секунд неудачные пачки повторяются, потом записи отбрасываются: иначе они опоздают к агрегатам
+HISTORY_RETRY_WINDOW = float(os.environ.get('HISTORY_RETRY_WINDOW', '120'))
+
+# Буфер истории: записи копятся в памяти и уходят в БД пачками из фонового потока
+_history_cond = threading.Condition()
+_history_buffer = []
+_history_thread = None
+_history_stats = {'queued': 0, 'flushed': 0, 'dropped': 0, 'failed': 0}
+
+def record_history(rows):
+    """Ставит записи command_history в буфер, не добавляя коммит к нажатию"""
+    if HISTORY_MODE == 'sync':
+        _write_history(rows)
+        return
+    _ensure_history_writer()
+    deadline = time.monotonic() + HISTORY_BLOCK_TIMEOUT
+    with _history_cond:
+        while _history_buffer and len(_history_buffer) + len(rows) > HISTORY_QUEUE_MAX_SIZE:
+            remaining = deadline - time.monotonic()
+            if HISTORY_BACKPRESSURE == 'drop':
+                overflow = min(len(_history_buffer), len(_history_buffer) + len(rows) - HISTORY_QUEUE_MAX_SIZE)
+                del _history_buffer[:overflow]
+                _history_stats['dropped'] += overflow
+            elif remaining <= 0:
+                _history_stats['dropped'] += len(rows)
+                return
+            else:
+                _history_cond.notify_all()
+                _history_cond.wait(min(remaining, HISTORY_FLUSH_INTERVAL))
+        _history_buffer.extend(rows)
+        _history_stats['queued'] += len(rows)
+        if len(_history_buffer) >= HISTORY_FLUSH_SIZE:
+            _history_cond.notify_all()
+
+def flush_history():
+    """Синхронно сбрасывает весь буфер; вызывается и при завершении процесса"""
+    with _history_cond:
+        batch = _history_buffer[:]
+        del _history_buffer[:]
+    _flush_history_batch(batch)
+
+def _ensure_history_writer():
+    global _history_thread
+    with _history_cond:
+        if _history_thread is None or not _history_thread.is_alive():
+            _history_thread = threading.Thread(target=_history_writer, name='history-writer', daemon=True)
+            _history_thread.start()
+
+def _history_writer():
+    while True:
+        with _history_cond:
+            if len(_history_buffer) < HISTORY_FLUSH_SIZE:
+                _history_cond.wait(HISTORY_FLUSH_INTERVAL)
+            batch = _history_buffer[:]
+            del _history_buffer[:]
+        if not _flush_history_batch(batch):
+            time.sleep(HISTORY_FLUSH_INTERVAL)
+
+def _flush_history_batch(batch):
+    if not batch:
+        return True
+    try:
+        _write_history(batch)
+        _history_stats['flushed'] += len(batch)
+        return True
+    except Exception:
+        _history_stats['failed'] += len(batch)
+        # Возвращаем пачку в начало очереди, чтобы повторить при следующем сбросе
+        retry_after = datetime.now(timezone.utc) - timedelta(seconds=HISTORY_RETRY_WINDOW)
+        retry = [row for row in batch if row[3] >= retry_after]
+        with _history_cond:
+            room = max(0, HISTORY_QUEUE_MAX_SIZE - len(_history_buffer))
+            _history_buffer[:0] = retry[:room]
+            _history_stats['dropped'] += len(batch) - min(room, len(retry))
+        return False
+    finally:
+        with _history_cond:
+            _history_cond.notify_all()
+
+atexit.register(flush_history)
+
+def _write_history(rows):
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            # created_at - TIMESTAMP без зоны, в нём всегда UTC независимо от часового пояса сессии
+            psycopg2.extras.execute_values(cur, f"""
+                INSERT INTO {HISTORY_TABLE} (device_id, command, success, created_at)
+                VALUES %s
+            """, rows, template="(%s, %s, %s, %s AT TIME ZONE 'UTC')")
+        conn.commit()
+    finally:
+        release_db_connection(conn)
+# <<< shared/history.py
+
+IR_CONNECT_TIMEOUT = float(os.environ.get('IR_CONNECT_TIMEOUT', '2'))
+IR_READ_TIMEOUT = float(os.environ.get('IR_READ_TIMEOUT', '5'))
+IR_SESSION_POOL_SIZE = int(os.environ.get('IR_SESSION_POOL_SIZE', '4'))
+# legacy - {"code", "device"} как раньше, compact - предкодированная посылка из devices.ir_payloads
+IR_PAYLOAD_FORMAT = os.environ.get('IR_PAYLOAD_FORMAT', 'legacy')
+GROUP_SEND_CONCURRENCY = int(os.environ.get('GROUP_SEND_CONCURRENCY', '16'))
+BATCH_MAX_STEPS = int(os.environ.get('BATCH_MAX_STEPS', '50'))
+BATCH_MAX_REPEAT = int(os.environ.get('BATCH_MAX_REPEAT', '20'))
+BATCH_MAX_DELAY_MS = int(os.environ.get('BATCH_MAX_DELAY_MS', '5000'))
+
+_ir_sessions = {}
+_ir_sessions_lock = threading.Lock()
+_group_executor = ThreadPoolExecutor(max_workers=GROUP_SEND_CONCURRENCY)
+
+def get_ir_session(endpoint):
+    """Возвращает keep-alive сессию для хоста ИК-блока, создавая её один раз на процесс"""
+    parts = urlsplit(endpoint)
+    key = (parts.scheme, parts.netloc)
+    with _ir_sessions_lock:
+        session = _ir_sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=max(IR_SESSION_POOL_SIZE, GROUP_SEND_CONCURRENCY),
+                max_retries=0
+            )
+            session.mount(f'{parts.scheme}://', adapter)
+            _ir_sessions[key] = session
+        return session
+
+# Повторы одной команды внутри окна уходят на блок одним вызовом с repeat=N; 0 - без склейки
+COMMAND_DEBOUNCE_MS = int(os.environ.get('COMMAND_DEBOUNCE_MS', '150'))
+IDEMPOTENCY_TTL = float(os.environ.get('IDEMPOTENCY_TTL', '300'))
+IDEMPOTENCY_MAX_KEYS = int(os.environ.get('IDEMPOTENCY_MAX_KEYS', '10000'))
+# Токен-бакеты на вызовы блока: скорость в секунду и запас; 0 отключает лимит
+RATE_LIMIT_DEVICE_RPS = float(os.environ.get('RATE_LIMIT_DEVICE_RPS', '10'))
+RATE_LIMIT_DEVICE_BURST = float(os.environ.get('RATE_LIMIT_DEVICE_BURST', '20'))
+RATE_LIMIT_ENDPOINT_RPS = float(os.environ.get('RATE_LIMIT_ENDPOINT_RPS', '50'))
+RATE_LIMIT_ENDPOINT_BURST = float(os.environ.get('RATE_LIMIT_ENDPOINT_BURST', '100'))
+PRESS_WINDOWS_MAX_SIZE = 1024
+
+_press_lock = threading.Lock()
+_press_windows = {}
+_rate_buckets = {}
+_idempotency_cache = OrderedDict()
+
+def take_tokens(buckets):
+    """Списывает токены из всех бакетов сразу или ни из одного
+
+    buckets - список (ключ, скорость, запас, токенов). Возвращает 0, если
+    вызов разрешён, иначе через сколько секунд хватит токенов.
+    """
+    now = time.monotonic()
+    with _press_lock:
+        levels = {}
+        wait = 0.0
+        for key, rate, burst, tokens in buckets:
+            if rate <= 0:
+                continue
+            level, updated = _rate_buckets.get(key, (burst, now))
+            level = min(burst, level + (now - updated) * rate)
+            tokens = min(tokens, burst)
+            levels[key] = (level, tokens)
+            if level < tokens:
+                wait = max(wait, (tokens - level) / rate)
+        for key, (level, tokens) in levels.items():
+            _rate_buckets[key] = (level if wait else level - tokens, now)
+    return wait
+
+def rate_limited_response(wait):
+    return json_response(429, {'error': 'Rate limit exceeded', 'retry_after': round(wait, 3)}, {
+        'Retry-After': str(max(1, math.ceil(wait))),
+        'Access-Control-Expose-Headers': 'Retry-After'
+    })
+
+def _send_press(device_id, endpoints, ir_code, device_name, payload, repeat):
+    wait = take_tokens([
+        (('device', str(device_id)), RATE_LIMIT_DEVICE_RPS, RATE_LIMIT_DEVICE_BURST, 1),
+        (('endpoint', preferred_endpoint(endpoints)), RATE_LIMIT_ENDPOINT_RPS, RATE_LIMIT_ENDPOINT_BURST, 1)
+    ])
+    if wait:
+        return {'success': False, 'message': 'Rate limit exceeded', 'retry_after': wait, 'repeat': repeat}
+    return dict(send_ir_command(endpoints, ir_code, device_name, payload, repeat), repeat=repeat)
+
+def claim_press(device_id, command):
+    """Определяет роль нажатия в окне склейки COMMAND_DEBOUNCE_MS
+
+    ('send', None) - первое нажатие, уходит сразу и открывает окно;
+    ('flush', пачка) - первый повтор: ждёт конца окна и шлёт всю пачку с repeat=N;
+    ('join', пачка) - остальные повторы ждут результата этой пачки.
+    """
+    if COMMAND_DEBOUNCE_MS <= 0:
+        return 'send', None
+    key = (str(device_id), command)
+    window = COMMAND_DEBOUNCE_MS / 1000
+    with _press_lock:
+        now = time.monotonic()
+        state = _press_windows.get(key)
+        if state is None or (state['until'] <= now and state['batch'] is None):
+            if len(_press_windows) >= PRESS_WINDOWS_MAX_SIZE:
+                for stale in [k for k, s in _press_windows.items() if s['until'] <= now and s['batch'] is None]:
+                    del _press_windows[stale]
+            _press_windows[key] = {'until': now + window, 'batch': None}
+            return 'send', None
+        batch = state['batch']
+        role = 'join'
+        if batch is None:
+            batch = state['batch'] = {'key': key, 'until': state['until'], 'count': 0, 'done': Future()}
+            role = 'flush'
+        batch['count'] += 1
+        return role, batch
+
+def complete_press(role, batch, device_id, endpoints, ir_code, device_name, payload):
+    """Доводит нажатие до блока согласно роли из claim_press"""
+    if role == 'send':
+        return _send_press(device_id, endpoints, ir_code, device_name, payload, 1)
+    if role == 'join':
+        return dict(batch['done'].result(), coalesced=True)
     
+    time.sleep(max(0.0, batch['until'] - time.monotonic()))
+    with _press_lock:
+        repeat = batch['count']
+        _press_windows[batch['key']] = {'until': time.monotonic() + COMMAND_DEBOUNCE_MS / 1000, 'batch': None}
     try:
-        body = json.loads(event.get('body', '{}'))
-        device_id = body.get('device_id')
-        command = body.get('command')
-        
-        if not device_id or not command:
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'device_id and command are required'})
-            }
-        
-        conn = get_db_connection()
+        result = _send_press(device_id, endpoints, ir_code, device_name, payload, repeat)
+    except Exception as e:
+        batch['done'].set_exception(e)
+        raise
+    batch['done'].set_result(result)
+    return dict(result, coalesced=True)
+
+def idempotent(key, fingerprint, call):
+    """Повтор запроса с тем же Idempotency-Key получает сохранённый ответ, а не новую отправку
+
+    Ключи живут IDEMPOTENCY_TTL секунд в памяти процесса; одновременный повтор
+    ждёт ответа первого запроса. Ответы 429 и 5xx не запоминаются. Ключ
+    привязан к отпечатку тела: тот же ключ с другим телом получает 422.
+    Хранится копия ответа - handler дописывает заголовки в отданный объект.
+    """
+    if not key:
+        return call()
+    now = time.monotonic()
+    with _press_lock:
+        entry = _idempotency_cache.get(key)
+        owner = entry is None or entry[0] <= now
+        if owner:
+            entry = (now + IDEMPOTENCY_TTL, Future(), fingerprint)
+            _idempotency_cache[key] = entry
+            _idempotency_cache.move_to_end(key)
+            while len(_idempotency_cache) > IDEMPOTENCY_MAX_KEYS:
+                _idempotency_cache.popitem(last=False)
+    done = entry[1]
+    if not owner:
+        if entry[2] != fingerprint:
+            return json_response(422, {'error': 'Idempotency-Key was already used with a different request body'})
+        response = copy.deepcopy(done.result())
+        response['headers']['Idempotent-Replayed'] = 'true'
+        return response
+    try:
+        response = call()
+    except Exception as e:
+        with _press_lock:
+            _idempotency_cache.pop(key, None)
+        done.set_exception(e)
+        raise
+    if response['statusCode'] == 429 or response['statusCode'] >= 500:
+        with _press_lock:
+            _idempotency_cache.pop(key, None)
+    done.set_result(copy.deepcopy(response))
+    return response
+
+# direct - нажатие ждёт ответа блока; queued - команда пишется в command_queue, ответ сразу с её id
+IR_DELIVERY_MODE = os.environ.get('IR_DELIVERY_MODE', 'direct')
+QUEUE_CLAIM_SIZE = int(os.environ.get('QUEUE_CLAIM_SIZE', '50'))
+QUEUE_MAX_ATTEMPTS = int(os.environ.get('QUEUE_MAX_ATTEMPTS', '6'))
+QUEUE_BACKOFF_BASE = float(os.environ.get('QUEUE_BACKOFF_BASE', '1'))
+QUEUE_BACKOFF_MAX = float(os.environ.get('QUEUE_BACKOFF_MAX', '300'))
+# Строка в статусе sending дольше этого срока считается брошенной упавшим воркером
+QUEUE_LOCK_TIMEOUT = float(os.environ.get('QUEUE_LOCK_TIMEOUT', '60'))
+QUEUE_POLL_INTERVAL = float(os.environ.get('QUEUE_POLL_INTERVAL', '5'))
+QUEUE_SENT_RETENTION_HOURS = int(os.environ.get('QUEUE_SENT_RETENTION_HOURS', '24'))
+
+_queue_cond = threading.Condition()
+_queue_thread = None
+_queue_wakeups = 0
+_queue_stats = {'claimed': 0, 'sent': 0, 'retried': 0, 'deferred': 0, 'dead': 0}
+
+def enqueue_command(cur, device_id, command, endpoint, message):
+    cur.execute("""
+        INSERT INTO t_p77920312_universal_remote_app.command_queue (device_id, command, endpoint, message)
+        VALUES (%s, %s, %s, %s)
+        RETURNING id
+    """, (device_id, command, endpoint, json.dumps(message)))
+    return cur.fetchone()[0]
+
+def wake_queue_worker():
+    """Будит фоновый воркер очереди процесса, запуская его при необходимости"""
+    global _queue_thread, _queue_wakeups
+    with _queue_cond:
+        if _queue_thread is None or not _queue_thread.is_alive():
+            _queue_thread = threading.Thread(target=_queue_worker, name='command-queue', daemon=True)
+            _queue_thread.start()
+        _queue_wakeups += 1
+        _queue_cond.notify()
+
+def _queue_worker():
+    global _queue_wakeups
+    while True:
         try:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("""
-                    SELECT id, name, model, brand, ir_codes, status
-                    FROM t_p77920312_universal_remote_app.devices
-                    WHERE id = %s
-                """, (device_id,))
-                device = cur.fetchone()
-                
-                if not device:
-                    return {
-                        'statusCode': 404,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Device not found'})
-                    }
-                
-                ir_codes = device.get('ir_codes', {})
-                if not ir_codes or command not in ir_codes:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': f'Command {command} not found for device'})
-                    }
-                
-                ir_code = ir_codes[command]
-                
+            processed = drain_command_queue()
+        except Exception:
+            processed = 0
+        with _queue_cond:
+            # Без работы ждём пробуждения или повторов, у которых подошёл срок
+            if not processed and not _queue_wakeups:
+                _queue_cond.wait(QUEUE_POLL_INTERVAL)
+            _queue_wakeups = 0
+
+def drain_command_queue(max_rounds=100):
+    """Забирает готовые команды пачками через SKIP LOCKED и рассылает их; возвращает число обработанных
+
+    Команды одного блока уходят по очереди через одно keep-alive соединение,
+    разные блоки - параллельно. Недоступный блок не ждёт таймаута на каждой
+    команде: остаток его пачки сразу уходит на повтор.
+    """
+    processed = 0
+    for _ in range(max_rounds):
+        rows = _claim_commands()
+        if not rows:
+            break
+        batches = {}
+        for row in rows:
+            batches.setdefault(row[1], []).append(row)
+        outcomes = {}
+        for delivered in _group_executor.map(_deliver_endpoint_batch, batches.values()):
+            outcomes.update(delivered)
+        _settle_commands(rows, outcomes)
+        processed += len(rows)
+    return processed
+
+def _claim_commands():
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE t_p77920312_universal_remote_app.command_queue q
+                SET status = 'sending', attempts = q.attempts + 1, locked_at = CURRENT_TIMESTAMP
+                FROM (
+                    SELECT id
+                    FROM t_p77920312_universal_remote_app.command_queue
+                    WHERE (status = 'queued' AND next_attempt_at <= CURRENT_TIMESTAMP)
+                       OR (status = 'sending' AND locked_at < CURRENT_TIMESTAMP - make_interval(secs => %s))
+                    ORDER BY id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                ) ready
+                WHERE q.id = ready.id
+                RETURNING q.id, q.endpoint, q.message, q.attempts, q.device_id, q.command
+            """, (QUEUE_LOCK_TIMEOUT, QUEUE_CLAIM_SIZE))
+            rows = sorted(cur.fetchall())
+        conn.commit()
+    finally:
+        release_db_connection(conn)
+    _queue_stats['claimed'] += len(rows)
+    return rows
+
+def _deliver_endpoint_batch(rows):
+    """Исходы команд одного блока: (True|False, ошибка), None вместо успеха - команда не отправлялась"""
+    outcomes = {}
+    unreachable = None if bridge_available(rows[0][1]) else 'IR bridge circuit is open'
+    for command_id, endpoint, message, attempts, device_id, command in rows:
+        if unreachable:
+            outcomes[command_id] = (None, unreachable)
+            continue
+        result = post_ir_message(endpoint, message)
+        outcomes[command_id] = (result['success'], None if result['success'] else result['message'])
+        if result.get('unreachable'):
+            unreachable = result['message']
+    return outcomes
+
+def _settle_commands(rows, outcomes):
+    sent = []
+    retries = []
+    dead = []
+    history = []
+    deferred = 0
+    for command_id, endpoint, message, attempts, device_id, command in rows:
+        success, error = outcomes[command_id]
+        if success:
+            sent.append(command_id)
+            history.append((device_id, command, True, datetime.now(timezone.utc)))
+        elif success is None:
+            # Блок не вызывался: попытка возвращается, а повтор ждёт пробного обращения к мосту
+            delay = max(bridge_retry_after(endpoint), QUEUE_BACKOFF_BASE) * (1 + random.random() / 2)
+            retries.append((command_id, delay, error, 1))
+            deferred += 1
+        elif attempts >= QUEUE_MAX_ATTEMPTS:
+            dead.append((command_id, error))
+            history.append((device_id, command, False, datetime.now(timezone.utc)))
+        else:
+            # Экспоненциальная задержка с джиттером, чтобы повторы не шли одной волной
+            delay = min(QUEUE_BACKOFF_MAX, QUEUE_BACKOFF_BASE * 2 ** (attempts - 1)) * (0.5 + random.random() / 2)
+            retries.append((command_id, delay, error, 0))
+    
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            if sent:
                 cur.execute("""
-                    SELECT setting_value 
-                    FROM t_p77920312_universal_remote_app.app_settings
-                    WHERE setting_key = 'ir_endpoint'
-                """)
-                endpoint_row = cur.fetchone()
-                ir_endpoint = endpoint_row['setting_value'] if endpoint_row else None
-                
-                result = send_ir_command(ir_endpoint, ir_code, device['name'])
-                
+                    UPDATE t_p77920312_universal_remote_app.command_queue
+                    SET status = 'sent', sent_at = CURRENT_TIMESTAMP, locked_at = NULL, last_error = NULL
+                    WHERE id = ANY(%s)
+                """, (sent,))
+            if retries:
+                psycopg2.extras.execute_values(cur, """
+                    UPDATE t_p77920312_universal_remote_app.command_queue q
+                    SET status = 'queued', locked_at = NULL, last_error = v.error,
+                        attempts = q.attempts - v.refund,
+                        next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => v.delay)
+                    FROM (VALUES %s) AS v(id, delay, error, refund)
+                    WHERE q.id = v.id
+                """, retries, template='(%s::bigint, %s::float8, %s::text, %s::int)')
+            if dead:
+                psycopg2.extras.execute_values(cur, """
+                    WITH moved AS (
+                        DELETE FROM t_p77920312_universal_remote_app.command_queue q
+                        USING (VALUES %s) AS v(id, error)
+                        WHERE q.id = v.id
+                        RETURNING q.id, q.device_id, q.command, q.endpoint, q.message, q.attempts, v.error, q.created_at
+                    )
+                    INSERT INTO t_p77920312_universal_remote_app.command_dead_letters
+                    (id, device_id, command, endpoint, message, attempts, last_error, created_at)
+                    SELECT * FROM moved
+                """, dead, template='(%s::bigint, %s::text)')
+            cur.execute("""
+                DELETE FROM t_p77920312_universal_remote_app.command_queue
+                WHERE status = 'sent' AND sent_at < CURRENT_TIMESTAMP - make_interval(hours => %s)
+            """, (QUEUE_SENT_RETENTION_HOURS,))
+        conn.commit()
+    finally:
+        release_db_connection(conn)
+    # Команда из очереди попадает в историю один раз - когда доставлена или исчерпала попытки
+    if history:
+        record_history(history)
+    _queue_stats['sent'] += len(sent)
+    _queue_stats['retried'] += len(retries) - deferred
+    _queue_stats['deferred'] += deferred
+    _queue_stats['dead'] += len(dead)
+
+# Планировщик: куча таймеров процесса держит срабатывания ближайших SCHEDULE_HORIZON секунд
+SCHEDULE_HORIZON = float(os.environ.get('SCHEDULE_HORIZON', '300'))
+SCHEDULE_CLAIM_SIZE = int(os.environ.get('SCHEDULE_CLAIM_SIZE', '200'))
+# Срабатывание, опоздавшее сильнее (процесс не работал), пропускается, а не догоняется
+SCHEDULE_MISFIRE_GRACE = float(os.environ.get('SCHEDULE_MISFIRE_GRACE', '300'))
+SCHEDULE_LIST_LIMIT = 500
+SCHEDULER_RETRY_DELAY = float(os.environ.get('SCHEDULER_RETRY_DELAY', '5'))
+
+_schedule_lock = threading.Lock()
+_schedule_heap = []
+_schedule_timers = {}
+_scheduler_thread = None
+_schedule_stats = {'claimed': 0, 'fired': 0, 'queued': 0, 'missed': 0, 'failed': 0}
+
+def next_schedule_run(run_at, time_of_day, weekdays, zone_name, after):
+    """Ближайшее срабатывание строго после after или None
+
+    Без time_of_day расписание разовое и срабатывает в run_at. С ним - в
+    time_of_day по часовому поясу расписания в отмеченные дни недели, начиная
+    не раньше run_at, если он задан.
+    """
+    if time_of_day is None:
+        return run_at if run_at and run_at > after else None
+    if run_at and run_at > after:
+        after = run_at - timedelta(microseconds=1)
+    zone = zoneinfo.ZoneInfo(zone_name)
+    local_day = after.astimezone(zone).date()
+    for offset in range(8):
+        day = local_day + timedelta(days=offset)
+        if not weekdays & (1 << day.weekday()):
+            continue
+        candidate = datetime.combine(day, time_of_day, tzinfo=zone)
+        if candidate > after:
+            return candidate
+    return None
+
+def ensure_scheduler():
+    """Запускает поток планировщика процесса, если он ещё не работает"""
+    global _scheduler_thread
+    with _schedule_lock:
+        if _scheduler_thread is None or not _scheduler_thread.is_alive():
+            _scheduler_thread = threading.Thread(target=_scheduler, name='command-scheduler', daemon=True)
+            _scheduler_thread.start()
+
+def _scheduler():
+    """Спит до ближайшего таймера, конца горизонта или NOTIFY о новом времени срабатывания
+
+    Таблица не сканируется по кругу: раз в SCHEDULE_HORIZON по индексу
+    читаются срабатывания следующего окна, остальное приходит уведомлениями.
+    """
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(os.environ['DATABASE_URL'])
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cur:
+                cur.execute('LISTEN schedule_changes')
+            horizon = 0.0
+            while True:
+                now = time.time()
+                if now >= horizon:
+                    horizon = now + SCHEDULE_HORIZON
+                    load_schedule_timers(conn, horizon)
+                due, wait = pop_due_timers(now)
+                if due:
+                    try:
+                        run_due_schedules()
+                    except Exception:
+                        # Таймеры уже сняты: просроченные строки вернёт перечитывание окна
+                        _schedule_stats['failed'] += 1
+                        horizon = 0.0
+                        time.sleep(1)
+                    continue
+                timeout = horizon - now if wait is None else min(wait, horizon - now)
+                select.select([conn], [], [], max(timeout, 0))
+                conn.poll()
+                while conn.notifies:
+                    schedule_id, when = conn.notifies.pop(0).payload.split(':')
+                    if float(when) < horizon:
+                        push_schedule_timer(int(schedule_id), float(when))
+        except Exception as error:
+            # Любая ошибка, не только базы, не должна останавливать поток: соединение
+            # пересоздаётся, а куча перечитывается из таблицы
+            _schedule_stats['failed'] += 1
+            print(json.dumps({'function': FUNCTION_NAME, 'thread': 'command-scheduler', 'error': repr(error)}))
+            if conn is not None and not conn.closed:
+                conn.close()
+            time.sleep(SCHEDULER_RETRY_DELAY)
+
+def load_schedule_timers(conn, horizon):
+    """Заменяет кучу срабатываниями до horizon, включая уже просроченные"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT id, extract(epoch FROM next_run_at)::float8
+            FROM t_p77920312_universal_remote_app.command_schedules
+            WHERE enabled AND next_run_at < to_timestamp(%s)
+        """, (horizon,))
+        rows = cur.fetchall()
+    with _schedule_lock:
+        _schedule_timers.clear()
+        _schedule_timers.update(rows)
+        _schedule_heap[:] = [(when, schedule_id) for schedule_id, when in rows]
+        heapq.heapify(_schedule_heap)
+
+def push_schedule_timer(schedule_id, when):
+    """Кладёт срабатывание в кучу; прежняя запись того же расписания станет устаревшей"""
+    with _schedule_lock:
+        _schedule_timers[schedule_id] = when
+        heapq.heappush(_schedule_heap, (when, schedule_id))
+
+def pop_due_timers(now):
+    """Снимает наступившие таймеры: (есть ли среди них действующие, секунд до следующего или None)"""
+    due = False
+    with _schedule_lock:
+        while _schedule_heap and _schedule_heap[0][0] <= now:
+            when, schedule_id = heapq.heappop(_schedule_heap)
+            if _schedule_timers.get(schedule_id) == when:
+                del _schedule_timers[schedule_id]
+                due = True
+        wait = _schedule_heap[0][0] - now if _schedule_heap else None
+    return due, wait
+
+def run_due_schedules(max_rounds=50):
+    """Забирает наступившие расписания пачками через SKIP LOCKED; возвращает число поставленных команд
+
+    Команды ставятся в command_queue в той же транзакции, где сдвигается
+    next_run_at, поэтому несколько процессов не выполнят одно срабатывание
+    дважды. Доставку пачками по мостам и повторы берёт на себя воркер очереди.
+    """
+    queued = 0
+    for _ in range(max_rounds):
+        claimed, commands = _fire_schedules()
+        queued += commands
+        if claimed < SCHEDULE_CLAIM_SIZE:
+            break
+    if queued:
+        wake_queue_worker()
+    return queued
+
+def _fire_schedules():
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT id, device_id, group_id, command, run_at, time_of_day, weekdays, timezone,
+                       next_run_at, CURRENT_TIMESTAMP
+                FROM t_p77920312_universal_remote_app.command_schedules
+                WHERE enabled AND next_run_at <= CURRENT_TIMESTAMP
+                ORDER BY next_run_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            """, (SCHEDULE_CLAIM_SIZE,))
+            rows = cur.fetchall()
+            if not rows:
+                return 0, 0
+            
+            members = {}
+            group_ids = [row[2] for row in rows if row[2]]
+            if group_ids:
                 cur.execute("""
-                    INSERT INTO t_p77920312_universal_remote_app.command_history
-                    (device_id, command_name, executed_at)
-                    VALUES (%s, %s, CURRENT_TIMESTAMP)
-                """, (device_id, command))
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'success': result['success'],
-                        'message': result['message'],
-                        'device': device['name'],
-                        'command': command,
-                        'ir_code': ir_code
-                    })
-                }
-        finally:
-            conn.close()
+                    SELECT group_id, device_id
+                    FROM t_p77920312_universal_remote_app.group_devices
+                    WHERE group_id = ANY(%s)
+                    ORDER BY device_id
+                """, (group_ids,))
+                for group_id, device_id in cur.fetchall():
+                    members.setdefault(group_id, []).append(device_id)
+            targets = {row[0]: [row[1]] if row[1] else members.get(row[2], []) for row in rows}
+            devices = get_devices(conn, [device_id for ids in targets.values() for device_id in ids])
             
-    except Exception as e:
+            commands = []
+            updates = []
+            for schedule_id, device_id, group_id, command, run_at, time_of_day, weekdays, zone_name, next_run_at, now in rows:
+                error = None
+                if (now - next_run_at).total_seconds() > SCHEDULE_MISFIRE_GRACE:
+                    error = f'Missed run at {next_run_at.isoformat()}'
+                    _schedule_stats['missed'] += 1
+                elif not targets[schedule_id]:
+                    error = 'Group not found or empty'
+                for target in targets[schedule_id] if error is None else ():
+                    device = devices.get(str(target))
+                    endpoints = resolve_endpoints(conn, device) if device else []
+                    if not device or command not in device['ir_codes']:
+                        error = f'Command {command} not found for device {target}'
+                    elif not endpoints:
+                        error = 'IR endpoint is not configured'
+                    else:
+                        message = build_ir_message(device['ir_codes'][command], device['name'], device['ir_payloads'].get(command))
+                        commands.append((target, command, preferred_endpoint(endpoints), json.dumps(message)))
+                updates.append((schedule_id, next_schedule_run(run_at, time_of_day, weekdays, zone_name, now), error))
+            
+            if commands:
+                psycopg2.extras.execute_values(cur, """
+                    INSERT INTO t_p77920312_universal_remote_app.command_queue (device_id, command, endpoint, message)
+                    VALUES %s
+                """, commands, template='(%s, %s, %s, %s::jsonb)')
+            # Отработавшие разовые расписания выключаются и выпадают из индекса срабатываний
+            psycopg2.extras.execute_values(cur, """
+                UPDATE t_p77920312_universal_remote_app.command_schedules s
+                SET next_run_at = v.next_run_at, enabled = v.next_run_at IS NOT NULL,
+                    last_run_at = CURRENT_TIMESTAMP, last_error = v.error, updated_at = CURRENT_TIMESTAMP
+                FROM (VALUES %s) AS v(id, next_run_at, error)
+                WHERE s.id = v.id
+            """, updates, template='(%s::int, %s::timestamptz, %s::text)')
+        conn.commit()
+    finally:
+        release_db_connection(conn)
+    
+    _schedule_stats['claimed'] += len(rows)
+    _schedule_stats['fired'] += sum(1 for update in updates if update[2] is None)
+    _schedule_stats['queued'] += len(commands)
+    return len(rows), len(commands)
+
+def get_queued_command(event):
+    """Статус команды из очереди по command_id: queued, sending, sent или dead"""
+    try:
+        command_id = int((event.get('queryStringParameters') or {}).get('command_id') or '')
+    except ValueError:
+        return json_response(400, {'error': 'command_id must be an integer'})
+    
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT id, device_id, command, status, attempts, last_error, created_at, sent_at
+                FROM t_p77920312_universal_remote_app.command_queue
+                WHERE id = %s
+                UNION ALL
+                SELECT id, device_id, command, 'dead', attempts, last_error, created_at, NULL
+                FROM t_p77920312_universal_remote_app.command_dead_letters
+                WHERE id = %s
+            """, (command_id, command_id))
+            row = cur.fetchone()
+    finally:
+        release_db_connection(conn)
+    
+    if not row:
+        return json_response(404, {'error': 'Command not found'})
+    
+    return json_response(200, {
+        'command_id': row[0],
+        'device_id': row[1],
+        'command': row[2],
+        'status': row[3],
+        'attempts': row[4],
+        'last_error': row[5],
+        'created_at': row[6].isoformat() if row[6] else None,
+        'sent_at': row[7].isoformat() if row[7] else None
+    })
+
+def drain_queue_route(event):
+    """Ручной или плановый прогон очереди, например по крону"""
+    processed = drain_command_queue()
+    return json_response(200, dict(_queue_stats, processed=processed))
+
+def list_statuses(event):
+    """Статусы устройств: у лидера проверки - из памяти, у остальных процессов - записанные им в devices"""
+    ensure_bridge_prober()
+    if _status_stats['leader']:
+        return json_response(200, get_device_statuses())
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT id, status FROM t_p77920312_universal_remote_app.devices')
+            rows = cur.fetchall()
+    finally:
+        release_db_connection(conn)
+    return json_response(200, {'leader': False, 'devices': {str(device_id): status for device_id, status in rows}})
+
+def list_bridges(event):
+    """Таблица маршрутов процесса и состояние автоматов мостов"""
+    conn = get_db_connection()
+    try:
+        table = get_routing_table(conn)
+        ir_endpoint = get_setting(conn, 'ir_endpoint')
+    finally:
+        release_db_connection(conn)
+    health = get_bridge_health()
+    return json_response(200, {
+        'bridges': [
+            dict(health.get(endpoint, {'circuit': 'closed', 'failures': 0, 'last_error': None}), id=bridge_id, endpoint=endpoint)
+            for bridge_id, endpoint in table['bridges'].items()
+        ],
+        'rooms': table['rooms'],
+        'default_endpoint': ir_endpoint
+    })
+
+SCHEDULE_FIELDS = (
+    'id', 'name', 'device_id', 'group_id', 'command', 'run_at', 'time_of_day', 'weekdays', 'timezone',
+    'enabled', 'next_run_at', 'last_run_at', 'last_error'
+)
+SCHEDULE_COLUMNS = ', '.join(SCHEDULE_FIELDS)
+
+def _schedule_row(row):
+    schedule = dict(zip(SCHEDULE_FIELDS, row))
+    for key in ('run_at', 'next_run_at', 'last_run_at'):
+        schedule[key] = schedule[key].isoformat() if schedule[key] else None
+    schedule['time_of_day'] = schedule['time_of_day'].strftime('%H:%M') if schedule['time_of_day'] else None
+    return schedule
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def parse_schedule(data):
+    """Проверяет тело расписания; возвращает (значения колонок, ошибка)
+
+    Разовое срабатывание задаётся run_at (ISO) или in_seconds (таймер сна),
+    повторяющееся - time_of_day "ЧЧ:ММ" и weekdays: списком дней 0-6 от
+    понедельника или битовой маской.
+    """
+    if not isinstance(data, dict):
+        return None, 'Request body must be a JSON object'
+    for field in ('id', 'device_id', 'group_id', 'in_seconds'):
+        if data.get(field) is not None and not _is_int(data[field]):
+            return None, f'{field} must be an integer'
+    for field in ('command', 'name', 'run_at', 'time_of_day', 'timezone'):
+        if data.get(field) is not None and not isinstance(data[field], str):
+            return None, f'{field} must be a string'
+    if data.get('enabled') is not None and not isinstance(data['enabled'], bool):
+        return None, 'enabled must be a boolean'
+    if not data.get('command') or (data.get('device_id') is None) == (data.get('group_id') is None):
+        return None, 'command and exactly one of device_id or group_id are required'
+    
+    weekdays = data.get('weekdays')
+    if weekdays is None:
+        weekdays = 127
+    elif isinstance(weekdays, list):
+        if not all(_is_int(day) and 0 <= day <= 6 for day in weekdays):
+            return None, 'weekdays must list days from 0 (Monday) to 6 (Sunday)'
+        weekdays = sum(1 << day for day in set(weekdays))
+    elif not _is_int(weekdays):
+        return None, 'weekdays must be a list of days or a bit mask'
+    if not 1 <= weekdays <= 127:
+        return None, 'weekdays must select at least one day'
+    
+    zone_name = data.get('timezone') or 'UTC'
+    try:
+        zone = zoneinfo.ZoneInfo(zone_name)
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        return None, f'Unknown timezone {zone_name}'
+    try:
+        run_at = None
+        if data.get('in_seconds') is not None:
+            run_at = datetime.now(timezone.utc) + timedelta(seconds=data['in_seconds'])
+        elif data.get('run_at'):
+            run_at = datetime.fromisoformat(data['run_at'].replace('Z', '+00:00'))
+            if run_at.tzinfo is None:
+                run_at = run_at.replace(tzinfo=zone)
+        time_of_day = datetime.strptime(data['time_of_day'], '%H:%M').time() if data.get('time_of_day') else None
+    except (OverflowError, ValueError):
+        return None, 'run_at, in_seconds or time_of_day has an invalid format'
+    if run_at is None and time_of_day is None:
+        return None, 'run_at, in_seconds or time_of_day is required'
+    
+    next_run_at = next_schedule_run(run_at, time_of_day, weekdays, zone_name, datetime.now(timezone.utc))
+    if next_run_at is None:
+        return None, 'run_at must be in the future'
+    return {
+        'name': data.get('name'),
+        'device_id': data.get('device_id'),
+        'group_id': data.get('group_id'),
+        'command': data['command'],
+        'run_at': run_at,
+        'time_of_day': time_of_day,
+        'weekdays': weekdays,
+        'timezone': zone_name,
+        'enabled': data.get('enabled', True),
+        'next_run_at': next_run_at
+    }, None
+
+def list_schedules(event):
+    """Расписания устройства или все, ближайшие первыми, и счётчики планировщика процесса"""
+    device_id = (event.get('queryStringParameters') or {}).get('device_id')
+    if device_id is not None:
+        try:
+            device_id = int(device_id)
+        except ValueError:
+            return json_response(400, {'error': 'device_id must be an integer'})
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                SELECT {SCHEDULE_COLUMNS}
+                FROM t_p77920312_universal_remote_app.command_schedules
+                WHERE %s::int IS NULL OR device_id = %s::int
+                ORDER BY next_run_at NULLS LAST, id
+                LIMIT %s
+            """, (device_id, device_id, SCHEDULE_LIST_LIMIT))
+            rows = cur.fetchall()
+    finally:
+        release_db_connection(conn)
+    ensure_scheduler()
+    with _schedule_lock:
+        scheduler = dict(_schedule_stats, timers=len(_schedule_timers))
+    return json_response(200, {'schedules': [_schedule_row(row) for row in rows], 'scheduler': scheduler})
+
+def save_schedule(event):
+    """Создаёт расписание или меняет существующее по id; планировщики узнают о нём по NOTIFY"""
+    data = read_json_body(event)
+    values, error = parse_schedule(data)
+    if error:
+        return json_response(400, {'error': error})
+    
+    columns = list(values)
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            if data.get('id'):
+                cur.execute(f"""
+                    UPDATE t_p77920312_universal_remote_app.command_schedules
+                    SET {', '.join(f'{column} = %s' for column in columns)}, last_error = NULL, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = %s
+                    RETURNING {SCHEDULE_COLUMNS}
+                """, [values[column] for column in columns] + [data['id']])
+            else:
+                cur.execute(f"""
+                    INSERT INTO t_p77920312_universal_remote_app.command_schedules ({', '.join(columns)})
+                    VALUES ({', '.join(['%s'] * len(columns))})
+                    RETURNING {SCHEDULE_COLUMNS}
+                """, [values[column] for column in columns])
+            row = cur.fetchone()
+        conn.commit()
+    finally:
+        release_db_connection(conn)
+    
+    if not row:
+        return json_response(404, {'error': 'Schedule not found'})
+    # Поток планировщика поднимается только ради записанной строки, а не ради каждого запроса
+    ensure_scheduler()
+    return json_response(200, _schedule_row(row))
+
+def delete_schedule(event):
+    schedule_id = (event.get('queryStringParameters') or {}).get('id')
+    if not schedule_id:
+        return json_response(400, {'error': 'Schedule ID is required'})
+    try:
+        schedule_id = int(schedule_id)
+    except ValueError:
+        return json_response(400, {'error': 'Schedule ID must be an integer'})
+    
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                DELETE FROM t_p77920312_universal_remote_app.command_schedules
+                WHERE id = %s
+            """, (schedule_id,))
+        conn.commit()
+    finally:
+        release_db_connection(conn)
+    return json_response(200, {'message': 'Schedule deleted successfully'})
+
+def run_schedules_route(event):
+    """Прогон наступивших расписаний по крону: будит и планировщик процесса, если тот уснул"""
+    queued = run_due_schedules()
+    ensure_scheduler()
+    return json_response(200, dict(_schedule_stats, queued_now=queued))
+
+@traced
+def handler(event: dict, context) -> dict:
+    """Отправляет ИК-команду на устройство через HTTP API"""
+    return route_request(event, {
+        ('POST', None): send_command,
+        ('POST', 'drain_queue'): drain_queue_route,
+        ('GET', None): get_queued_command,
+        ('GET', 'bridges'): list_bridges,
+        ('GET', 'status'): list_statuses,
+        ('GET', 'schedules'): list_schedules,
+        ('PUT', 'schedules'): save_schedule,
+        ('DELETE', 'schedules'): delete_schedule,
+        ('POST', 'run_schedules'): run_schedules_route
+    }, allow_headers='Content-Type, Idempotency-Key')
+
+def send_command(event):
+    """Одна команда, пакет шагов (steps) или команда группе (group_id)"""
+    body = read_json_body(event)
+    key = get_header(event.get('headers') or {}, 'idempotency-key') or body.get('idempotency_key')
+    fingerprint = hashlib.md5(json.dumps(body, sort_keys=True).encode()).hexdigest()
+    return idempotent(key, fingerprint, lambda: execute_command(body))
+
+def execute_command(body):
+    if 'steps' in body:
+        return send_batch(body.get('steps'))
+    if 'group_id' in body:
+        return send_group(body.get('group_id'), body.get('command'))
+    
+    device_id = body.get('device_id')
+    command = body.get('command')
+    
+    if not device_id or not command:
+        return json_response(400, {'error': 'device_id and command are required'})
+    
+    command_id = None
+    conn = get_db_connection()
+    try:
+        device = get_device(conn, device_id)
+        
+        if not device:
+            return json_response(404, {'error': 'Device not found'})
+        
+        ir_codes = device['ir_codes']
+        if command not in ir_codes:
+            return json_response(400, {'error': f'Command {command} not found for device'})
+        
+        ir_code = ir_codes[command]
+        endpoints = resolve_endpoints(conn, device)
+        
+        if IR_DELIVERY_MODE == 'queued' and endpoints:
+            message = build_ir_message(ir_code, device['name'], device['ir_payloads'].get(command))
+            with conn.cursor() as cur:
+                command_id = enqueue_command(cur, device_id, command, preferred_endpoint(endpoints), message)
+            conn.commit()
+    finally:
+        release_db_connection(conn)
+    
+    if command_id is not None:
+        wake_queue_worker()
+        return json_response(202, {
+            'queued': True,
+            'command_id': command_id,
+            'device': device['name'],
+            'command': command
+        })
+    
+    role, batch = claim_press(device_id, command)
+    with span('blaster'):
+        result = complete_press(role, batch, device_id, endpoints, ir_code, device['name'], device['ir_payloads'].get(command))
+    
+    if 'retry_after' in result:
+        return rate_limited_response(result['retry_after'])
+    
+    # В историю идёт исход отправки, поэтому запись только после ответа блока
+    with span('history'):
+        record_history([(device_id, command, result['success'], datetime.now(timezone.utc))])
+    
+    response = {
+        'success': result['success'],
+        'message': result['message'],
+        'device': device['name'],
+        'command': command,
+        'ir_code': ir_code
+    }
+    if result.get('coalesced'):
+        response['coalesced'] = True
+        response['repeat'] = result['repeat']
+    return json_response(200, response)
+
+def send_batch(steps):
+    """Выполняет макрос: упорядоченный список шагов с повторами и паузами за один запрос
+
+    Шаг: {"device_id", "command", "repeat" (по умолчанию 1), "delay_ms" - пауза после каждого нажатия}
+    """
+    error = validate_batch(steps)
+    if error:
+        return json_response(400, {'error': error})
+    
+    conn = get_db_connection()
+    try:
+        devices = get_devices(conn, [step['device_id'] for step in steps])
+        routes = {key: resolve_endpoints(conn, device) for key, device in devices.items()}
+    finally:
+        release_db_connection(conn)
+    
+    for step in steps:
+        device = devices.get(str(step['device_id']))
+        if not device:
+            return json_response(404, {'error': f"Device {step['device_id']} not found"})
+        if step['command'] not in device['ir_codes']:
+            return json_response(400, {'error': f"Command {step['command']} not found for device {step['device_id']}"})
+    
+    # Пока идут паузы макроса, соединение с БД не удерживается
+    results = []
+    history = []
+    for index, step in enumerate(steps):
+        device = devices[str(step['device_id'])]
+        ir_code = device['ir_codes'][step['command']]
+        payload = device['ir_payloads'].get(step['command'])
+        repeat = int(step.get('repeat', 1))
+        delay = int(step.get('delay_ms', 0)) / 1000
+        sent = 0
+        result = None
+        for attempt in range(repeat):
+            if attempt and delay:
+                time.sleep(delay)
+            with span('blaster'):
+                result = send_ir_command(routes[str(step['device_id'])], ir_code, device['name'], payload)
+            history.append((step['device_id'], step['command'], result['success'], datetime.now(timezone.utc)))
+            if not result['success']:
+                break
+            sent += 1
+        results.append({
+            'device_id': step['device_id'],
+            'command': step['command'],
+            'repeat': repeat,
+            'sent': sent,
+            'success': result['success'],
+            'message': result['message']
+        })
+        if delay and index < len(steps) - 1:
+            time.sleep(delay)
+    
+    record_history(history)
+    
+    return json_response(200, {
+        'success': all(result['success'] for result in results),
+        'steps': results
+    })
+
+def send_group(group_id, command):
+    """Отправляет одну команду всем устройствам группы параллельно"""
+    if not group_id or not command:
+        return json_response(400, {'error': 'group_id and command are required'})
+    try:
+        if isinstance(group_id, bool):
+            raise ValueError
+        group_id = int(group_id)
+    except (TypeError, ValueError):
+        return json_response(400, {'error': 'group_id must be an integer'})
+    
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT d.id, d.name,
+                       coalesce(d.ir_codes ->> %s, cs.codes ->> %s),
+                       coalesce(d.ir_payloads -> %s, cs.payloads -> %s),
+                       d.room, d.bridge_id, d.fallback_bridge_id
+                FROM t_p77920312_universal_remote_app.group_devices gd
+                JOIN t_p77920312_universal_remote_app.devices d ON d.id = gd.device_id
+                LEFT JOIN t_p77920312_universal_remote_app.ir_code_sets cs ON cs.id = d.code_set_id
+                WHERE gd.group_id = %s
+                ORDER BY d.id
+            """, (command, command, command, command, group_id))
+            rows = cur.fetchall()
+        members = []
+        for device_id, name, ir_code, payload, room, bridge_id, fallback_bridge_id in rows:
+            device = {'room': room, 'bridge_id': bridge_id, 'fallback_bridge_id': fallback_bridge_id}
+            members.append((device_id, name, ir_code, payload, resolve_endpoints(conn, device)))
+    finally:
+        release_db_connection(conn)
+    
+    if not members:
+        return json_response(404, {'error': 'Group not found or empty'})
+    
+    # Устройства группы могут висеть на разных мостах - токены списываются с каждого моста
+    # и с каждого устройства, иначе команды группе обходили бы лимит устройства
+    targets = Counter(preferred_endpoint(member[4]) for member in members if member[2])
+    wait = take_tokens([
+        (('endpoint', endpoint), RATE_LIMIT_ENDPOINT_RPS, RATE_LIMIT_ENDPOINT_BURST, count)
+        for endpoint, count in targets.items()
+    ] + [
+        (('device', str(device_id)), RATE_LIMIT_DEVICE_RPS, RATE_LIMIT_DEVICE_BURST, 1)
+        for device_id, name, ir_code, payload, endpoints in members if ir_code
+    ])
+    if wait:
+        return rate_limited_response(wait)
+    
+    pending = {}
+    for device_id, name, ir_code, payload, endpoints in members:
+        if ir_code:
+            pending[device_id] = _group_executor.submit(send_ir_command, endpoints, ir_code, name, payload)
+    
+    results = []
+    history = []
+    for device_id, name, ir_code, payload, endpoints in members:
+        if device_id in pending:
+            with span('blaster'):
+                result = pending[device_id].result()
+            history.append((device_id, command, result['success'], datetime.now(timezone.utc)))
+        else:
+            result = {'success': False, 'message': f'Command {command} not found for device'}
+        results.append({
+            'device_id': device_id,
+            'device': name,
+            'success': result['success'],
+            'message': result['message']
+        })
+    
+    if history:
+        record_history(history)
+    
+    return json_response(200, {
+        'success': all(result['success'] for result in results),
+        'group_id': group_id,
+        'command': command,
+        'results': results
+    })
+
+def validate_batch(steps):
+    if not isinstance(steps, list) or not steps:
+        return 'steps must be a non-empty list'
+    if len(steps) > BATCH_MAX_STEPS:
+        return f'At most {BATCH_MAX_STEPS} steps allowed'
+    for position, step in enumerate(steps):
+        if not isinstance(step, dict) or not step.get('device_id') or not step.get('command'):
+            return f'Step {position}: device_id and command are required'
+        try:
+            int(step['device_id'])
+            repeat = int(step.get('repeat', 1))
+            delay_ms = int(step.get('delay_ms', 0))
+        except (TypeError, ValueError):
+            return f'Step {position}: device_id, repeat and delay_ms must be integers'
+        if not 1 <= repeat <= BATCH_MAX_REPEAT:
+            return f'Step {position}: repeat must be between 1 and {BATCH_MAX_REPEAT}'
+        if not 0 <= delay_ms <= BATCH_MAX_DELAY_MS:
+            return f'Step {position}: delay_ms must be between 0 and {BATCH_MAX_DELAY_MS}'
+    return None
+
+def send_ir_command(endpoints, ir_code, device_name, payload=None, repeat=1):
+    """Отправляет ИК-команду через HTTP API; repeat > 1 просит блок повторить её"""
+    return deliver_ir_message(endpoints, build_ir_message(ir_code, device_name, payload, repeat))
+
+def deliver_ir_message(endpoints, message):
+    """Шлёт на первый мост с замкнутым автоматом, при отказе моста переходит к следующему кандидату"""
+    if not endpoints:
+        return post_ir_message(None, message)
+    result = None
+    for endpoint in endpoints:
+        if not bridge_available(endpoint):
+            continue
+        result = post_ir_message(endpoint, message)
+        if not is_bridge_failure(result):
+            return result
+    if result is None:
         return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': str(e)})
+            'success': False,
+            'message': 'All IR bridges are unavailable',
+            'unreachable': True
         }
+    return result
 
-def send_ir_command(endpoint, ir_code, device_name):
-    """Отправляет ИК-команду через HTTP API"""
+def is_bridge_failure(result):
+    return result.get('unreachable', False) or result.get('status_code', 0) >= 500
+
+def build_ir_message(ir_code, device_name, payload=None, repeat=1):
+    if IR_PAYLOAD_FORMAT == 'compact' and payload:
+        message = {'ir': payload, 'device': device_name}
+    else:
+        message = {'code': ir_code, 'device': device_name}
+    if repeat > 1:
+        message['repeat'] = repeat
+    return message
+
+def post_ir_message(endpoint, message):
+    """POST готового тела на блок; исход попадает в автомат моста"""
     if not endpoint:
         return {
             'success': False,
             'message': 'IR endpoint not configured in settings'
         }
     
+    result = _post_ir_message(endpoint, message)
+    record_bridge_result(endpoint, not is_bridge_failure(result), result['message'])
+    return result
+
+def _post_ir_message(endpoint, message):
+    """unreachable отмечает ошибки соединения и таймауты, status_code - ответ блока не 200"""
     try:
-        response = requests.post(
+        response = get_ir_session(endpoint).post(
             endpoint,
-            json={'code': ir_code, 'device': device_name},
-            timeout=5
+            json=message,
+            timeout=(IR_CONNECT_TIMEOUT, IR_READ_TIMEOUT)
         )
         
         if response.status_code == 200:
@@ -131,17 +1909,20 @@ def send_ir_command(endpoint, ir_code, device_name):
         else:
             return {
                 'success': False,
-                'message': f'IR device returned status {response.status_code}'
+                'message': f'IR device returned status {response.status_code}',
+                'status_code': response.status_code
             }
     except requests.exceptions.Timeout:
         return {
             'success': False,
-            'message': 'Timeout connecting to IR device'
+            'message': 'Timeout connecting to IR device',
+            'unreachable': True
         }
     except requests.exceptions.ConnectionError:
         return {
             'success': False,
-            'message': 'Could not connect to IR device'
+            'message': 'Could not connect to IR device',
+            'unreachable': True
         }
     except Exception as e:
         return {
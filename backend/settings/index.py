@@ -1,87 +1,460 @@
 """API для управления настройками приложения"""
+import functools
+import hashlib
+import importlib
 import json
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import random
+import threading
+import time
+from contextlib import contextmanager
 
-def get_db_connection():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+FUNCTION_NAME = 'settings'
 
-def handler(event: dict, context) -> dict:
-    """Управление настройками приложения"""
+# >>> shared/framework.py (источник - scripts/shared/framework.py)
+class LazyModule:
+    """Модуль, импортируемый при первом обращении к атрибуту
+
+    Подмодули (psycopg2.extras, psycopg2.pool) подгружаются так же, поэтому
+    preflight и ответы из кэша не платят за импорт драйвера базы и HTTP-клиента.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        try:
+            return getattr(self._module, attr)
+        except AttributeError:
+            return importlib.import_module(f'{self._name}.{attr}')
+
+psycopg2 = LazyModule('psycopg2')
+
+def json_response(status, payload, headers=None):
+    """JSON-ответ функции с CORS-заголовком; headers дополняют стандартные"""
+    response_headers = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+    if headers:
+        response_headers.update(headers)
+    return {'statusCode': status, 'headers': response_headers, 'body': json.dumps(payload), 'isBase64Encoded': False}
+
+def read_json_body(event):
+    return json.loads(event.get('body') or '{}')
+
+def get_header(headers, name):
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+def route_request(event, routes, allow_headers='Content-Type'):
+    """Мини-роутер: preflight, выбор маршрута по (метод, action), 404/405 и ошибки в 500
+
+    routes - {(метод, action или None): функция(event)}. OPTIONS отвечает сразу,
+    не трогая базу и не импортируя драйвер.
+    """
     method = event.get('httpMethod', 'GET')
-    
+    methods = list(dict.fromkeys(route_method for route_method, _ in routes))
     if method == 'OPTIONS':
         return {
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type'
+                'Access-Control-Allow-Methods': ', '.join(methods + ['OPTIONS']),
+                'Access-Control-Allow-Headers': allow_headers
             },
-            'body': ''
+            'body': '',
+            'isBase64Encoded': False
         }
-    
+    if method not in methods:
+        return json_response(405, {'error': 'Method not allowed'})
+    action = (event.get('queryStringParameters') or {}).get('action')
+    route = routes.get((method, action)) or routes.get((method, None))
+    if route is None:
+        return json_response(404, {'error': 'Endpoint not found'})
     try:
-        if method == 'GET':
-            return get_settings()
-        elif method == 'PUT':
-            body = json.loads(event.get('body', '{}'))
-            return update_settings(body)
-        else:
-            return {
-                'statusCode': 405,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Method not allowed'})
-            }
+        return route(event)
     except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': str(e)})
-        }
+        return json_response(500, {'error': str(e)})
+
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0.05'))
+
+# Трассировка запроса: участки, число SQL-запросов и строк; вне выборки почти бесплатна
+_trace = threading.local()
+_traced_cursor_classes = {}
+_traced_connection = None
+
+@contextmanager
+def span(name):
+    """Добавляет длительность участка к текущей трассировке, если запрос попал в выборку"""
+    spans = getattr(_trace, 'spans', None)
+    if spans is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        spans[name] = spans.get(name, 0.0) + (time.perf_counter() - started) * 1000
+
+def _traced_cursor_class(base):
+    cursor_class = _traced_cursor_classes.get(base)
+    if cursor_class is None:
+        def execute(self, query, vars=None):
+            if getattr(_trace, 'spans', None) is None:
+                return base.execute(self, query, vars)
+            with span('query'):
+                result = base.execute(self, query, vars)
+            _trace.queries += 1
+            _trace.rows += max(self.rowcount, 0)
+            return result
+        cursor_class = type('Traced' + base.__name__, (base,), {'execute': execute})
+        _traced_cursor_classes[base] = cursor_class
+    return cursor_class
+
+def traced_connection_class():
+    """Класс соединения, курсоры которого отчитываются в трассировку; создаётся при первом подключении"""
+    global _traced_connection
+    if _traced_connection is None:
+        class TracedConnection(psycopg2.extensions.connection):
+            def cursor(self, *args, **kwargs):
+                base = kwargs.pop('cursor_factory', None) or self.cursor_factory or psycopg2.extensions.cursor
+                return super().cursor(*args, cursor_factory=_traced_cursor_class(base), **kwargs)
+
+            def commit(self):
+                with span('commit'):
+                    return super().commit()
+        _traced_connection = TracedConnection
+    return _traced_connection
+
+def traced(handler):
+    """Оборачивает handler: сэмплированные запросы получают Server-Timing и строку лога с метриками пула"""
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        headers = event.get('headers') or {}
+        forced = any(key.lower() == 'x-trace' for key in headers)
+        if not forced and random.random() >= TRACE_SAMPLE_RATE:
+            return handler(event, context)
+        _trace.spans = {}
+        _trace.queries = 0
+        _trace.rows = 0
+        started = time.perf_counter()
+        try:
+            response = handler(event, context)
+        finally:
+            total = (time.perf_counter() - started) * 1000
+            spans = _trace.spans
+            _trace.spans = None
+        timings = [f'{name};dur={duration:.2f}' for name, duration in spans.items()]
+        timings.append(f'db;desc="{_trace.queries} queries, {_trace.rows} rows"')
+        timings.append(f'total;dur={total:.2f}')
+        response_headers = response.setdefault('headers', {})
+        response_headers['Server-Timing'] = ', '.join(timings)
+        response_headers['Access-Control-Expose-Headers'] = ', '.join(
+            filter(None, [response_headers.get('Access-Control-Expose-Headers'), 'Server-Timing'])
+        )
+        print(json.dumps({
+            'function': FUNCTION_NAME,
+            'method': event.get('httpMethod'),
+            'action': (event.get('queryStringParameters') or {}).get('action'),
+            'status': response.get('statusCode'),
+            'total_ms': round(total, 2),
+            'spans': {name: round(duration, 2) for name, duration in spans.items()},
+            'queries': _trace.queries,
+            'rows': _trace.rows,
+            'pool': get_pool_stats()
+        }))
+        return response
+    return wrapper
+
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_MAX_AGE = float(os.environ.get('DB_POOL_MAX_AGE', '300'))
+DB_POOL_CHECK_AFTER = float(os.environ.get('DB_POOL_CHECK_AFTER', '30'))
+DB_POOL_WAIT_TIMEOUT = float(os.environ.get('DB_POOL_WAIT_TIMEOUT', '5'))
+
+# Пул живёт на уровне модуля и переживает тёплые вызовы функции
+_pool_cond = threading.Condition()
+_pool_idle = []
+_pool_meta = {}
+_pool_stats = {'size': 0, 'hits': 0, 'misses': 0, 'replaced': 0, 'waits': 0, 'wait_ms': 0.0}
+
+def get_db_connection():
+    """Выдаёт соединение из пула; ожидание и подключение попадают в трассировку как db_connect"""
+    with span('db_connect'):
+        return _checkout_connection()
+
+def _checkout_connection():
+    """Выдаёт соединение из пула процесса, заменяя устаревшие и разорванные"""
+    started = time.monotonic()
+    while True:
+        conn = _checkout_idle_connection(started)
+        if conn is None:
+            break
+        if _is_connection_usable(conn):
+            return conn
+        _discard_connection(conn)
+        _pool_stats['replaced'] += 1
+    try:
+        conn = psycopg2.connect(os.environ['DATABASE_URL'], connection_factory=traced_connection_class())
+    except Exception:
+        with _pool_cond:
+            _pool_stats['size'] -= 1
+            _pool_cond.notify()
+        raise
+    now = time.monotonic()
+    _pool_meta[conn] = {'created': now, 'used': now}
+    return conn
+
+def _checkout_idle_connection(started):
+    with _pool_cond:
+        while True:
+            if _pool_idle:
+                _pool_stats['hits'] += 1
+                _pool_stats['wait_ms'] += (time.monotonic() - started) * 1000
+                return _pool_idle.pop()
+            if _pool_stats['size'] < DB_POOL_MAX_SIZE:
+                _pool_stats['size'] += 1
+                _pool_stats['misses'] += 1
+                _pool_stats['wait_ms'] += (time.monotonic() - started) * 1000
+                return None
+            remaining = DB_POOL_WAIT_TIMEOUT - (time.monotonic() - started)
+            if remaining <= 0:
+                raise psycopg2.pool.PoolError('Connection pool exhausted')
+            _pool_stats['waits'] += 1
+            _pool_cond.wait(remaining)
+
+def _is_connection_usable(conn):
+    if conn.closed:
+        return False
+    meta = _pool_meta.get(conn)
+    now = time.monotonic()
+    if not meta or now - meta['created'] > DB_POOL_MAX_AGE:
+        return False
+    if now - meta['used'] > DB_POOL_CHECK_AFTER:
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+        except psycopg2.Error:
+            return False
+    return True
+
+def _discard_connection(conn):
+    _pool_meta.pop(conn, None)
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+    with _pool_cond:
+        _pool_stats['size'] -= 1
+        _pool_cond.notify()
+
+def release_db_connection(conn):
+    """Возвращает соединение в пул после отката незавершённой транзакции"""
+    try:
+        conn.rollback()
+    except psycopg2.Error:
+        pass
+    if conn.closed:
+        _discard_connection(conn)
+        return
+    _pool_meta[conn]['used'] = time.monotonic()
+    with _pool_cond:
+        _pool_idle.append(conn)
+        _pool_cond.notify()
+
+def get_pool_stats():
+    """Метрики пула: попадания, промахи, замены и суммарное ожидание"""
+    with _pool_cond:
+        stats = dict(_pool_stats)
+        stats['idle'] = len(_pool_idle)
+    stats['max_size'] = DB_POOL_MAX_SIZE
+    return stats
+# <<< shared/framework.py
+
+SETTINGS_SNAPSHOT_TTL = float(os.environ.get('SETTINGS_SNAPSHOT_TTL', '60'))
 
-def get_settings():
+# Снимок настроек процесса; сбрасывается по NOTIFY settings_changes из триггера на app_settings
+_settings_lock = threading.Lock()
+_settings_snapshot = {'expires': 0.0, 'generation': 0, 'version': None, 'values': {}}
+_listen_conn = None
+
+def _drain_settings_changes():
+    """Забирает накопленные уведомления об изменении настроек"""
+    global _listen_conn
+    try:
+        if _listen_conn is None or _listen_conn.closed:
+            _listen_conn = psycopg2.connect(os.environ['DATABASE_URL'])
+            _listen_conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with _listen_conn.cursor() as cur:
+                cur.execute('LISTEN settings_changes')
+            invalidate_settings_snapshot()
+        _listen_conn.poll()
+    except psycopg2.Error:
+        if _listen_conn is not None and not _listen_conn.closed:
+            _listen_conn.close()
+        _listen_conn = None
+        invalidate_settings_snapshot()
+        return
+    if _listen_conn.notifies:
+        del _listen_conn.notifies[:]
+        invalidate_settings_snapshot()
+
+def invalidate_settings_snapshot():
+    with _settings_lock:
+        _settings_snapshot['expires'] = 0.0
+        _settings_snapshot['generation'] += 1
+
+def get_settings_snapshot():
+    """Версионированный снимок app_settings; перечитывается целиком только после NOTIFY или по TTL
+
+    Свежий снимок отдаётся без обращения к пулу соединений.
+    """
+    _drain_settings_changes()
+    with _settings_lock:
+        if _settings_snapshot['expires'] > time.monotonic():
+            return dict(_settings_snapshot)
+        generation = _settings_snapshot['generation']
     conn = get_db_connection()
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        with conn.cursor() as cur:
             cur.execute("""
-                SELECT setting_key, setting_value, updated_at
+                SELECT setting_key, setting_value
                 FROM t_p77920312_universal_remote_app.app_settings
-                ORDER BY setting_key
             """)
-            rows = cur.fetchall()
-            
-            settings = {}
-            for row in rows:
-                settings[row['setting_key']] = row['setting_value']
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps(settings)
-            }
+            values = dict(cur.fetchall())
     finally:
-        conn.close()
+        release_db_connection(conn)
+    snapshot = {
+        'expires': time.monotonic() + SETTINGS_SNAPSHOT_TTL,
+        'generation': generation,
+        'version': hashlib.md5(json.dumps(values, sort_keys=True).encode()).hexdigest()[:16],
+        'values': values
+    }
+    with _settings_lock:
+        if _settings_snapshot['generation'] == generation:
+            _settings_snapshot.update(snapshot)
+    return snapshot
+
+@traced
+def handler(event: dict, context) -> dict:
+    """Управление настройками приложения"""
+    return route_request(event, {
+        ('GET', None): lambda event: get_settings(event.get('headers') or {}),
+        ('PUT', None): lambda event: update_settings(read_json_body(event)),
+        ('GET', 'bridges'): lambda event: list_bridges(),
+        ('PUT', 'bridges'): lambda event: save_bridge(read_json_body(event)),
+        ('DELETE', 'bridges'): lambda event: delete_bridge((event.get('queryStringParameters') or {}).get('id'))
+    }, allow_headers='Content-Type, If-None-Match')
+
+def get_settings(headers):
+    """Отдаёт снимок настроек с ETag по его версии"""
+    snapshot = get_settings_snapshot()
+    etag = '"' + snapshot['version'] + '"'
+    response_headers = {
+        'ETag': etag,
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'ETag'
+    }
+    if get_header(headers, 'if-none-match') == etag:
+        return {'statusCode': 304, 'headers': response_headers, 'body': ''}
+    
+    response_headers['Content-Type'] = 'application/json'
+    return {
+        'statusCode': 200,
+        'headers': response_headers,
+        'body': json.dumps(dict(sorted(snapshot['values'].items())))
+    }
 
 def update_settings(data):
+    """Записывает все настройки одним upsert; остальные процессы узнают об этом по NOTIFY"""
+    if not data:
+        return json_response(200, {'message': 'Settings updated successfully'})
+    
     conn = get_db_connection()
     try:
         with conn.cursor() as cur:
-            for key, value in data.items():
-                cur.execute("""
-                    INSERT INTO t_p77920312_universal_remote_app.app_settings 
-                    (setting_key, setting_value, updated_at)
-                    VALUES (%s, %s, CURRENT_TIMESTAMP)
-                    ON CONFLICT (setting_key) 
-                    DO UPDATE SET setting_value = %s, updated_at = CURRENT_TIMESTAMP
-                """, (key, str(value), str(value)))
+            cur.execute("""
+                INSERT INTO t_p77920312_universal_remote_app.app_settings 
+                (setting_key, setting_value, updated_at)
+                SELECT key, value, CURRENT_TIMESTAMP
+                FROM unnest(%s::text[], %s::text[]) AS s(key, value)
+                ON CONFLICT (setting_key) 
+                DO UPDATE SET setting_value = EXCLUDED.setting_value, updated_at = CURRENT_TIMESTAMP
+            """, (list(data.keys()), [str(value) for value in data.values()]))
             conn.commit()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'message': 'Settings updated successfully'})
-            }
+        invalidate_settings_snapshot()
+        
+        return json_response(200, {'message': 'Settings updated successfully'})
     finally:
-        conn.close()
+        release_db_connection(conn)
+
+BRIDGE_COLUMNS = 'id, name, endpoint, room, priority, enabled, created_at, updated_at'
+
+def _bridge_row(row):
+    bridge = dict(zip(('id', 'name', 'endpoint', 'room', 'priority', 'enabled', 'created_at', 'updated_at'), row))
+    bridge['created_at'] = bridge['created_at'].isoformat() if bridge['created_at'] else None
+    bridge['updated_at'] = bridge['updated_at'].isoformat() if bridge['updated_at'] else None
+    return bridge
+
+def list_bridges():
+    """Реестр ИК-мостов"""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                SELECT {BRIDGE_COLUMNS}
+                FROM t_p77920312_universal_remote_app.ir_bridges
+                ORDER BY room NULLS LAST, priority, id
+            """)
+            rows = cur.fetchall()
+    finally:
+        release_db_connection(conn)
+    return json_response(200, {'bridges': [_bridge_row(row) for row in rows]})
+
+def save_bridge(data):
+    """Добавляет мост или обновляет существующий с тем же endpoint; ir-send узнаёт об этом по NOTIFY"""
+    if not data.get('endpoint') or not data.get('name'):
+        return json_response(400, {'error': 'name and endpoint are required'})
+    
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                INSERT INTO t_p77920312_universal_remote_app.ir_bridges (name, endpoint, room, priority, enabled)
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT (endpoint)
+                DO UPDATE SET name = EXCLUDED.name, room = EXCLUDED.room, priority = EXCLUDED.priority,
+                              enabled = EXCLUDED.enabled, updated_at = CURRENT_TIMESTAMP
+                RETURNING {BRIDGE_COLUMNS}
+            """, (
+                data['name'],
+                data['endpoint'],
+                data.get('room'),
+                int(data.get('priority', 0)),
+                bool(data.get('enabled', True))
+            ))
+            bridge = cur.fetchone()
+            conn.commit()
+        return json_response(200, _bridge_row(bridge))
+    finally:
+        release_db_connection(conn)
+
+def delete_bridge(bridge_id):
+    """Удаляет мост; привязанные к нему устройства переходят на резервные маршруты"""
+    if not bridge_id:
+        return json_response(400, {'error': 'Bridge ID is required'})
+    
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                DELETE FROM t_p77920312_universal_remote_app.ir_bridges
+                WHERE id = %s
+            """, (bridge_id,))
+            conn.commit()
+        return json_response(200, {'message': 'Bridge deleted successfully'})
+    finally:
+        release_db_connection(conn)
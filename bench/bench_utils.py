@@ -0,0 +1,34 @@
+"""Общие помощники бенчмарков: загрузка функций и перцентили задержек"""
+import importlib.util
+import os
+import statistics
+import time
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend')
+
+
+def load_function(name):
+    """Импортирует index.py облачной функции по имени каталога"""
+    path = os.path.join(BACKEND_DIR, name, 'index.py')
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def measure(label, presses, call):
+    call()
+    samples = []
+    for _ in range(presses):
+        started = time.perf_counter()
+        call()
+        samples.append((time.perf_counter() - started) * 1000)
+    print(f'{label:<28} p50={percentile(samples, 50):7.3f}ms  p99={percentile(samples, 99):7.3f}ms  '
+          f'mean={statistics.mean(samples):7.3f}ms')
+    return samples
@@ -0,0 +1,72 @@
+"""Бенчмарк массовой загрузки: COPY-импорт NDJSON против create_device по одному
+
+Запуск: python bench/bulk_bench.py --devices 5000
+
+Нужен DATABASE_URL на отдельной тестовой базе с применёнными миграциями.
+Засеянные устройства получают бренд bench-bulk и удаляются в конце. Для
+сравнения импорт повторяется через POST на каждое устройство, затем
+замеряется выгрузка NDJSON и CSV серверным курсором.
+"""
+import argparse
+import json
+import sys
+import time
+
+import psycopg2
+
+from bench_utils import load_function, measure
+
+BRAND = 'bench-bulk'
+IR_CODES = {f'button_{index}': f'NEC:0x20DF{index:02X}{255 - index:02X}' for index in range(14)}
+
+
+def device_rows(count, prefix):
+    return [
+        {'name': f'{prefix} {index}', 'model': f'BB-{index % 40}', 'type': 'tv', 'brand': BRAND, 'ir_codes': IR_CODES}
+        for index in range(count)
+    ]
+
+
+def timed(label, call):
+    started = time.perf_counter()
+    result = call()
+    elapsed = time.perf_counter() - started
+    print(f'{label:<28} {elapsed * 1000:9.1f}ms')
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--devices', type=int, default=5000)
+    parser.add_argument('--samples', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    devices_fn = load_function('devices')
+    body = '\n'.join(json.dumps(row) for row in device_rows(args.devices, 'Bulk TV'))
+    import_event = {'httpMethod': 'POST', 'queryStringParameters': {'action': 'import'}, 'body': body, 'headers': {}}
+    try:
+        response = timed(f'COPY import of {args.devices}', lambda: devices_fn.handler(import_event, None))
+        print(f"  {response['body'][:120]}")
+        singles = device_rows(args.devices, 'Single TV')
+        timed(f'create_device x{args.devices}', lambda: [devices_fn.create_device(row) for row in singles])
+
+        for fmt in ('ndjson', 'csv'):
+            event = {'httpMethod': 'GET', 'queryStringParameters': {'action': 'export', 'format': fmt}, 'headers': {}}
+            print(f'{fmt} export body: {len(devices_fn.handler(event, None)["body"])} bytes')
+            measure(f'export {fmt}', args.samples, lambda: devices_fn.handler(event, None))
+    except psycopg2.Error as e:
+        print(f'database error: {e}', file=sys.stderr)
+        return 1
+    finally:
+        conn = devices_fn.get_db_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute('DELETE FROM t_p77920312_universal_remote_app.devices WHERE brand = %s', (BRAND,))
+            conn.commit()
+        finally:
+            devices_fn.release_db_connection(conn)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
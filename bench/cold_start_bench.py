@@ -0,0 +1,65 @@
+"""Холодный старт функций: импорт index.py и первый OPTIONS в свежем процессе
+
+Запуск: python bench/cold_start_bench.py --runs 15
+        python bench/cold_start_bench.py --functions ir-send settings
+
+Каждый замер - отдельный интерпретатор, как при холодном старте контейнера:
+время exec_module(index.py), время первого preflight-запроса и число модулей
+в sys.modules после него. База и ИК-блок не нужны - OPTIONS их не трогает.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from bench_utils import BACKEND_DIR
+
+FUNCTIONS = ('devices', 'ir-control', 'ir-learn', 'ir-send', 'settings')
+
+PROBE = '''
+import importlib.util, json, sys, time
+started = time.perf_counter()
+spec = importlib.util.spec_from_file_location('index', sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+imported = time.perf_counter()
+module.handler({'httpMethod': 'OPTIONS', 'headers': {}}, None)
+done = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'options_ms': (done - imported) * 1000,
+    'modules': len(sys.modules),
+    'psycopg2': 'psycopg2' in sys.modules,
+    'requests': 'requests' in sys.modules
+}))
+'''
+
+
+def probe(name):
+    env = dict(os.environ, DATABASE_URL=os.environ.get('DATABASE_URL', 'postgresql://bench@localhost/bench'))
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE, os.path.join(BACKEND_DIR, name, 'index.py')],
+        capture_output=True, text=True, check=True, env=env
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--functions', nargs='+', default=FUNCTIONS, choices=FUNCTIONS)
+    args = parser.parse_args()
+
+    print(f'{"function":<12} {"import p50":>11} {"OPTIONS p50":>12} {"modules":>8}  heavy imports')
+    for name in args.functions:
+        samples = [probe(name) for _ in range(args.runs)]
+        heavy = [lib for lib in ('psycopg2', 'requests') if samples[-1][lib]]
+        print(f'{name:<12} {statistics.median(s["import_ms"] for s in samples):9.1f}ms '
+              f'{statistics.median(s["options_ms"] for s in samples):10.2f}ms '
+              f'{samples[-1]["modules"]:>8}  {", ".join(heavy) or "-"}')
+
+
+if __name__ == '__main__':
+    main()
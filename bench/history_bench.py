@@ -0,0 +1,114 @@
+"""Бенчмарк истории команд: keyset-страницы против OFFSET на большой таблице
+
+Запуск: python bench/history_bench.py --rows 10000000
+
+Нужен DATABASE_URL на отдельной тестовой базе с применёнными миграциями.
+Скрипт досеивает command_history до --rows строк (generate_series пачками),
+затем замеряет выборку страниц на разной глубине через handler ir-control
+и тот же запрос с OFFSET. С --cleanup засеянные строки удаляются в конце.
+"""
+import argparse
+import json
+import sys
+import time
+
+import psycopg2
+
+from bench_utils import load_function, measure
+
+COMMANDS = ['power', 'volume_up', 'volume_down', 'mute', 'up', 'down', 'ok', 'back', 'home', 'source']
+
+
+def seed_history(conn, rows, chunk):
+    with conn.cursor() as cur:
+        cur.execute('SELECT array_agg(id) FROM devices')
+        device_ids = cur.fetchone()[0]
+        if not device_ids:
+            raise SystemExit('devices table is empty, apply V0001 seed first')
+        cur.execute('SELECT count(*), coalesce(max(id), 0) FROM command_history')
+        existing, max_id = cur.fetchone()
+    remaining = rows - existing
+    started = time.perf_counter()
+    while remaining > 0:
+        size = min(chunk, remaining)
+        with conn.cursor() as cur:
+            # Год истории: равномерно размазываем нажатия по времени в прошлое
+            cur.execute("""
+                INSERT INTO command_history (device_id, command, success, created_at)
+                SELECT (%(devices)s::int[])[1 + (g %% array_length(%(devices)s::int[], 1))],
+                       (%(commands)s::text[])[1 + (g %% array_length(%(commands)s::text[], 1))],
+                       g %% 50 <> 0,
+                       now() - (g * interval '3 seconds')
+                FROM generate_series(%(start)s, %(stop)s) AS g
+            """, {'devices': device_ids, 'commands': COMMANDS, 'start': rows - remaining, 'stop': rows - remaining + size - 1})
+        conn.commit()
+        remaining -= size
+        print(f'seeded {rows - remaining:>10} rows', end='\r', flush=True)
+    print(f'seeded to {rows} rows in {time.perf_counter() - started:.1f}s')
+    with conn.cursor() as cur:
+        cur.execute('ANALYZE command_history')
+    conn.commit()
+    return max_id
+
+
+def walk_cursor(ir_control, pages, extra):
+    """Проходит pages страниц по курсору и возвращает курсор последней"""
+    cursor = None
+    for _ in range(pages):
+        params = dict(extra, action='history')
+        if cursor:
+            params['cursor'] = cursor
+        response = ir_control.handler({'httpMethod': 'GET', 'queryStringParameters': params}, None)
+        cursor = json.loads(response['body'])['next_cursor']
+    return cursor
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--chunk', type=int, default=500_000)
+    parser.add_argument('--samples', type=int, default=200)
+    parser.add_argument('--cleanup', action='store_true')
+    args = parser.parse_args(argv)
+
+    ir_control = load_function('ir-control')
+    conn = ir_control.get_db_connection()
+    try:
+        seeded_after = seed_history(conn, args.rows, args.chunk)
+        for depth in (0, 100, 1000):
+            cursor = walk_cursor(ir_control, depth, {}) if depth else None
+            params = {'action': 'history'}
+            if cursor:
+                params['cursor'] = cursor
+            event = {'httpMethod': 'GET', 'queryStringParameters': params}
+            measure(f'keyset page {depth}', args.samples, lambda: ir_control.handler(event, None))
+
+            def offset_page(offset=depth * ir_control.HISTORY_PAGE_SIZE):
+                with conn.cursor() as cur:
+                    cur.execute('''
+                        SELECT h.id, h.command, h.success, h.created_at, d.name, d.type
+                        FROM command_history h
+                        JOIN devices d ON h.device_id = d.id
+                        ORDER BY h.created_at DESC, h.id DESC
+                        LIMIT 50 OFFSET %s
+                    ''', (offset,))
+                    cur.fetchall()
+                conn.rollback()
+            measure(f'offset page {depth}', min(args.samples, 50), offset_page)
+
+        event = {'httpMethod': 'GET', 'queryStringParameters': {'action': 'history', 'device_id': '1', 'command': 'power'}}
+        measure('keyset device+command', args.samples, lambda: ir_control.handler(event, None))
+
+        if args.cleanup:
+            with conn.cursor() as cur:
+                cur.execute('DELETE FROM command_history WHERE id > %s', (seeded_after,))
+            conn.commit()
+    except psycopg2.Error as e:
+        print(f'database error: {e}', file=sys.stderr)
+        return 1
+    finally:
+        ir_control.release_db_connection(conn)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""Бенчмарк отправки ИК-команды: новое соединение на каждый запрос против keep-alive сессии
+
+Запуск: python bench/ir_send_bench.py --presses 2000 --delay 0.002
+
+С флагом --device-id дополнительно прогоняет весь handler ir-send с записью
+истории sync и buffered (нужен DATABASE_URL; ir_endpoint в app_settings
+временно указывается на заглушку и затем восстанавливается).
+"""
+import argparse
+import json
+import sys
+
+import requests
+
+from bench_utils import load_function, measure
+from stub_blaster import start_stub_blaster
+
+
+def bench_send_path(ir_send, url, presses):
+    def fresh_connection():
+        requests.post(url, json={'code': '0000', 'device': 'Bench TV'}, timeout=5)
+
+    def pooled_session():
+        ir_send.send_ir_command([url], '0000', 'Bench TV')
+
+    measure('before: requests.post', presses, fresh_connection)
+    measure('after: keep-alive session', presses, pooled_session)
+
+
+def bench_handler(ir_send, url, presses, device_id):
+    conn = ir_send.get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT setting_value FROM t_p77920312_universal_remote_app.app_settings
+                WHERE setting_key = 'ir_endpoint'
+            """)
+            row = cur.fetchone()
+            previous = row[0] if row else None
+            cur.execute("""
+                INSERT INTO t_p77920312_universal_remote_app.app_settings (setting_key, setting_value)
+                VALUES ('ir_endpoint', %s)
+                ON CONFLICT (setting_key) DO UPDATE SET setting_value = EXCLUDED.setting_value
+            """, (url,))
+            conn.commit()
+    finally:
+        ir_send.release_db_connection(conn)
+
+    event = {'httpMethod': 'POST', 'body': json.dumps({'device_id': device_id, 'command': 'power'})}
+    try:
+        for mode in ('sync', 'buffered'):
+            ir_send.HISTORY_MODE = mode
+            measure(f'handler: history {mode}', presses, lambda: ir_send.handler(event, None))
+    finally:
+        conn = ir_send.get_db_connection()
+        try:
+            with conn.cursor() as cur:
+                if previous is None:
+                    cur.execute("""
+                        DELETE FROM t_p77920312_universal_remote_app.app_settings
+                        WHERE setting_key = 'ir_endpoint'
+                    """)
+                else:
+                    cur.execute("""
+                        UPDATE t_p77920312_universal_remote_app.app_settings
+                        SET setting_value = %s WHERE setting_key = 'ir_endpoint'
+                    """, (previous,))
+                conn.commit()
+        finally:
+            ir_send.release_db_connection(conn)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--presses', type=int, default=1000)
+    parser.add_argument('--delay', type=float, default=0.0, help='задержка ответа заглушки, с')
+    parser.add_argument('--device-id', type=int, help='прогнать также весь handler на этом устройстве')
+    args = parser.parse_args(argv)
+
+    server, url = start_stub_blaster(delay=args.delay)
+    try:
+        ir_send = load_function('ir-send')
+        # Нажатия идут подряд без пауз: склейка и лимиты замерили бы окно, а не путь отправки
+        ir_send.COMMAND_DEBOUNCE_MS = 0
+        ir_send.RATE_LIMIT_DEVICE_RPS = 0
+        ir_send.RATE_LIMIT_ENDPOINT_RPS = 0
+        bench_send_path(ir_send, url, args.presses)
+        if args.device_id is not None:
+            bench_handler(ir_send, url, args.presses, args.device_id)
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""Бенчмарк сериализации списков: JSON из PostgreSQL против разбора и json.dumps в Python
+
+Запуск: python bench/json_bench.py --devices 10000 --cleanup
+
+Нужен DATABASE_URL на отдельной тестовой базе с применёнными миграциями.
+Скрипт досеивает устройства бренда bench-json до --devices штук, затем
+замеряет полный список через handler devices (json_agg в базе) и прежний
+путь: RealDictCursor, isoformat в цикле и json.dumps. Отдельно - страница
+ir-control action=devices и размер тел ответов. С --cleanup засеянные
+устройства удаляются в конце.
+"""
+import argparse
+import json
+import sys
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from bench_utils import load_function, measure
+
+BRAND = 'bench-json'
+FIELDS = 'id, name, model, type, brand, ir_codes, status, created_at, updated_at'
+IR_CODES = {f'button_{index}': f'NEC:0x20DF{index:02X}{255 - index:02X}' for index in range(24)}
+
+
+def seed_devices(conn, count):
+    with conn.cursor() as cur:
+        cur.execute('SELECT count(*) FROM t_p77920312_universal_remote_app.devices')
+        existing = cur.fetchone()[0]
+        if existing < count:
+            cur.execute("""
+                INSERT INTO t_p77920312_universal_remote_app.devices
+                (name, model, type, brand, ir_codes, status, created_at, updated_at)
+                SELECT 'Bench TV ' || g, 'BX-' || (g %% 40), 'tv', %s, %s::jsonb, 'offline',
+                       now() - g * interval '1 minute', now() - g * interval '1 minute'
+                FROM generate_series(1, %s) AS g
+            """, (BRAND, json.dumps(IR_CODES), count - existing))
+    conn.commit()
+    print(f'devices table has {max(existing, count)} rows')
+
+
+def python_encode(conn):
+    """Прежний путь get_devices: словари, isoformat в цикле и json.dumps"""
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(f"""
+            SELECT {FIELDS}
+            FROM t_p77920312_universal_remote_app.devices
+            ORDER BY created_at DESC, id DESC
+        """)
+        devices = cur.fetchall()
+    conn.rollback()
+    for device in devices:
+        if device.get('created_at'):
+            device['created_at'] = device['created_at'].isoformat()
+        if device.get('updated_at'):
+            device['updated_at'] = device['updated_at'].isoformat()
+    return json.dumps(devices)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--devices', type=int, default=10_000)
+    parser.add_argument('--samples', type=int, default=50)
+    parser.add_argument('--cleanup', action='store_true')
+    args = parser.parse_args(argv)
+
+    devices_fn = load_function('devices')
+    ir_control = load_function('ir-control')
+    conn = devices_fn.get_db_connection()
+    try:
+        seed_devices(conn, args.devices)
+
+        list_event = {'httpMethod': 'GET', 'queryStringParameters': {}, 'headers': {}}
+        page_event = {'httpMethod': 'GET', 'queryStringParameters': {'action': 'devices', 'limit': '500'}}
+        print(f'body sizes: postgres={len(devices_fn.handler(list_event, None)["body"])} '
+              f'python={len(python_encode(conn))} bytes')
+
+        measure('full list, python encode', args.samples, lambda: python_encode(conn))
+        measure('full list, postgres json', args.samples, lambda: devices_fn.handler(list_event, None))
+        measure('ir-control page of 500', args.samples, lambda: ir_control.handler(page_event, None))
+
+        if args.cleanup:
+            with conn.cursor() as cur:
+                cur.execute('DELETE FROM t_p77920312_universal_remote_app.devices WHERE brand = %s', (BRAND,))
+            conn.commit()
+    except psycopg2.Error as e:
+        print(f'database error: {e}', file=sys.stderr)
+        return 1
+    finally:
+        devices_fn.release_db_connection(conn)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
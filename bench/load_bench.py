@@ -0,0 +1,301 @@
+"""Нагрузочный бенчмарк всех пяти функций: смесь нажатий, обучения и списков
+
+Запуск: python bench/load_bench.py --duration 30 --concurrency 8
+        python bench/load_bench.py --save-baseline bench/baseline.json
+        python bench/load_bench.py --baseline bench/baseline.json --tolerance 0.2
+
+Нужен DATABASE_URL на отдельной тестовой базе с применёнными миграциями и
+хотя бы одним устройством. Каждый handler(event, context) вызывается прямо в
+процессе, ИК-блок подменяется локальной заглушкой (ir_endpoint в app_settings
+на время прогона указывает на неё и потом восстанавливается). Для каждого
+сценария печатаются RPS, p50/p95/p99 и число SQL-запросов на запрос; запросы
+фоновых потоков (буфер истории, групповые отправки) в счёт не идут.
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+import psycopg2.extensions
+
+from bench_utils import load_function, percentile
+from stub_blaster import start_stub_blaster
+
+DEFAULT_MIX = 'press=60,control=10,list=10,learn=5,history=10,settings=5'
+BENCH_BUTTON = 'bench_button'
+
+_query_counter = threading.local()
+_counting_cursors = {}
+
+
+def _counting_cursor_class(base):
+    """Подкласс курсора нужного типа, считающий execute в текущем потоке"""
+    if base not in _counting_cursors:
+        def execute(self, query, vars=None):
+            _query_counter.count = getattr(_query_counter, 'count', 0) + 1
+            return base.execute(self, query, vars)
+        _counting_cursors[base] = type(f'Counting{base.__name__}', (base,), {'execute': execute})
+    return _counting_cursors[base]
+
+
+class CountingConnection(psycopg2.extensions.connection):
+    def cursor(self, *args, **kwargs):
+        base = kwargs.pop('cursor_factory', None) or self.cursor_factory or psycopg2.extensions.cursor
+        return super().cursor(*args, cursor_factory=_counting_cursor_class(base), **kwargs)
+
+
+def install_query_counter():
+    original_connect = psycopg2.connect
+
+    def connect(*args, **kwargs):
+        # Функции подключаются со своим TracedConnection - счётчик встаёт поверх него
+        factory = kwargs.get('connection_factory')
+        if factory is not None and not issubclass(factory, CountingConnection):
+            factory = type(f'Counting{factory.__name__}', (CountingConnection, factory), {})
+        kwargs['connection_factory'] = factory or CountingConnection
+        return original_connect(*args, **kwargs)
+    psycopg2.connect = connect
+
+
+def disable_press_guards(ir_send):
+    """Бенчмарк жмёт одни и те же кнопки чаще живого пользователя - склейка и лимиты исказили бы задержки"""
+    ir_send.COMMAND_DEBOUNCE_MS = 0
+    ir_send.RATE_LIMIT_DEVICE_RPS = 0
+    ir_send.RATE_LIMIT_ENDPOINT_RPS = 0
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, weight = part.split('=')
+        mix[name.strip()] = float(weight)
+    unknown = set(mix) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return mix
+
+
+def scenario_press(functions, device):
+    command = random.choice(device['commands'])
+    body = json.dumps({'device_id': device['id'], 'command': command})
+    return functions['ir-send'].handler({'httpMethod': 'POST', 'body': body}, None)
+
+
+def scenario_control(functions, device):
+    command = random.choice(device['commands'])
+    event = {
+        'httpMethod': 'POST',
+        'queryStringParameters': {'action': 'command'},
+        'body': json.dumps({'device_id': device['id'], 'command': command})
+    }
+    return functions['ir-control'].handler(event, None)
+
+
+def scenario_list(functions, device):
+    if random.random() < 0.5:
+        return functions['devices'].handler({'httpMethod': 'GET', 'queryStringParameters': {}}, None)
+    event = {'httpMethod': 'GET', 'queryStringParameters': {'action': 'devices', 'fields': 'id,name,type,status'}}
+    return functions['ir-control'].handler(event, None)
+
+
+def scenario_learn(functions, device):
+    body = json.dumps({'device_id': device['id'], 'button': BENCH_BUTTON, 'ir_code': 'NEC:0x20DF10EF'})
+    return functions['ir-learn'].handler({'httpMethod': 'POST', 'body': body}, None)
+
+
+def scenario_history(functions, device):
+    params = {'action': 'history'}
+    if random.random() < 0.5:
+        params['device_id'] = str(device['id'])
+    return functions['ir-control'].handler({'httpMethod': 'GET', 'queryStringParameters': params}, None)
+
+
+def scenario_settings(functions, device):
+    return functions['settings'].handler({'httpMethod': 'GET'}, None)
+
+
+SCENARIOS = {
+    'press': scenario_press,
+    'control': scenario_control,
+    'list': scenario_list,
+    'learn': scenario_learn,
+    'history': scenario_history,
+    'settings': scenario_settings,
+}
+
+
+def prepare(functions, url):
+    """Направляет ir_endpoint на заглушку и возвращает (устройства, прежний endpoint)"""
+    ir_send = functions['ir-send']
+    conn = ir_send.get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT d.id, coalesce(cs.codes, '{}'::jsonb) || coalesce(d.ir_codes, '{}'::jsonb) AS codes
+                FROM t_p77920312_universal_remote_app.devices d
+                LEFT JOIN t_p77920312_universal_remote_app.ir_code_sets cs ON cs.id = d.code_set_id
+                WHERE coalesce(cs.codes, d.ir_codes, '{}'::jsonb) <> '{}'::jsonb
+            """)
+            devices = [{'id': row[0], 'commands': sorted(row[1])} for row in cur.fetchall()]
+            cur.execute("""
+                SELECT setting_value FROM t_p77920312_universal_remote_app.app_settings
+                WHERE setting_key = 'ir_endpoint'
+            """)
+            row = cur.fetchone()
+        conn.commit()
+    finally:
+        ir_send.release_db_connection(conn)
+    if not devices:
+        raise SystemExit('no devices with IR codes found, apply V0001 seed first')
+    functions['settings'].update_settings({'ir_endpoint': url})
+    return devices, row[0] if row else None
+
+
+def restore(functions, previous_endpoint):
+    for name in ('ir-send', 'ir-control'):
+        functions[name].flush_history()
+    conn = functions['ir-send'].get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                UPDATE t_p77920312_universal_remote_app.devices
+                SET ir_codes = ir_codes - '{BENCH_BUTTON}', ir_payloads = ir_payloads - '{BENCH_BUTTON}'
+                WHERE ir_codes ? '{BENCH_BUTTON}'
+            """)
+            if previous_endpoint is None:
+                cur.execute("""
+                    DELETE FROM t_p77920312_universal_remote_app.app_settings
+                    WHERE setting_key = 'ir_endpoint'
+                """)
+        conn.commit()
+    finally:
+        functions['ir-send'].release_db_connection(conn)
+    if previous_endpoint is not None:
+        functions['settings'].update_settings({'ir_endpoint': previous_endpoint})
+
+
+def run_load(functions, devices, mix, concurrency, duration):
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    results = {name: {'latencies': [], 'queries': [], 'errors': 0} for name in names}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        while time.perf_counter() < deadline:
+            name = random.choices(names, weights)[0]
+            device = random.choice(devices)
+            _query_counter.count = 0
+            started = time.perf_counter()
+            response = SCENARIOS[name](functions, device)
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                result = results[name]
+                result['latencies'].append(elapsed)
+                result['queries'].append(_query_counter.count)
+                if response['statusCode'] >= 400:
+                    result['errors'] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        workers = [executor.submit(worker) for _ in range(concurrency)]
+        for future in workers:
+            future.result()
+    wall = time.perf_counter() - started
+
+    report = {}
+    for name, result in results.items():
+        latencies = result['latencies']
+        if not latencies:
+            continue
+        report[name] = {
+            'requests': len(latencies),
+            'errors': result['errors'],
+            'rps': round(len(latencies) / wall, 1),
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p95_ms': round(percentile(latencies, 95), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+            'queries_per_request': round(sum(result['queries']) / len(latencies), 2),
+        }
+    return report
+
+
+def print_report(report, baseline=None):
+    print(f"{'scenario':<10} {'req':>7} {'err':>5} {'rps':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'q/req':>6}")
+    for name, row in report.items():
+        line = (f"{name:<10} {row['requests']:>7} {row['errors']:>5} {row['rps']:>8} {row['p50_ms']:>8}ms "
+                f"{row['p95_ms']:>8}ms {row['p99_ms']:>8}ms {row['queries_per_request']:>6}")
+        if baseline and name in baseline:
+            delta = (row['p95_ms'] - baseline[name]['p95_ms']) / max(baseline[name]['p95_ms'], 0.001)
+            line += f'  p95 {delta:+.0%} vs baseline'
+        print(line)
+
+
+def regressions(report, baseline, tolerance):
+    failed = []
+    for name, row in report.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        if row['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            failed.append(f"{name}: p95 {base['p95_ms']}ms -> {row['p95_ms']}ms")
+        if row['queries_per_request'] > base['queries_per_request'] + 0.5:
+            failed.append(f"{name}: queries/request {base['queries_per_request']} -> {row['queries_per_request']}")
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'веса сценариев, по умолчанию {DEFAULT_MIX}')
+    parser.add_argument('--blaster-delay', type=float, default=0.002, help='задержка ответа заглушки, с')
+    parser.add_argument('--warmup', type=float, default=2)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save-baseline', help='записать результат в JSON-файл')
+    parser.add_argument('--baseline', help='сравнить с сохранённым JSON-файлом')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='допустимый рост p95 относительно baseline')
+    parser.add_argument('--press-guards', action='store_true', help='не отключать склейку повторов и лимиты ir-send')
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    mix = parse_mix(args.mix)
+    install_query_counter()
+    functions = {name: load_function(name) for name in ('devices', 'ir-control', 'ir-learn', 'ir-send', 'settings')}
+    if not args.press_guards:
+        disable_press_guards(functions['ir-send'])
+    server, url = start_stub_blaster(delay=args.blaster_delay)
+    devices, previous_endpoint = prepare(functions, url)
+    try:
+        if args.warmup:
+            run_load(functions, devices, mix, args.concurrency, args.warmup)
+        report = run_load(functions, devices, mix, args.concurrency, args.duration)
+    finally:
+        restore(functions, previous_endpoint)
+        server.shutdown()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['scenarios']
+    print_report(report, baseline)
+    print(f'blaster requests: {server.received}')
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'concurrency': args.concurrency, 'mix': args.mix, 'scenarios': report}, f, indent=2)
+        print(f'baseline saved to {args.save_baseline}')
+    if baseline:
+        failed = regressions(report, baseline, args.tolerance)
+        for line in failed:
+            print(f'REGRESSION {line}', file=sys.stderr)
+        return 1 if failed else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,45 @@
+"""Локальная заглушка HTTP ИК-блока для бенчмарков"""
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubBlasterHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        # Без TCP_NODELAY заголовки и тело уходят разными пакетами и keep-alive ловит delayed ACK
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = self.rfile.read(length)
+        self.server.received += 1
+        self.server.last_payload = payload
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        body = json.dumps({'ok': True}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_blaster(delay=0.0, port=0):
+    """Поднимает заглушку в фоновом потоке и возвращает (server, url)"""
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubBlasterHandler)
+    server.daemon_threads = True
+    server.delay = delay
+    server.received = 0
+    server.last_payload = None
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, bound_port = server.server_address
+    return server, f'http://{host}:{bound_port}/send'
@@ -0,0 +1,32 @@
+CREATE TABLE IF NOT EXISTS app_settings (
+    id SERIAL PRIMARY KEY,
+    setting_key VARCHAR(100) NOT NULL UNIQUE,
+    setting_value TEXT,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE OR REPLACE FUNCTION notify_device_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('device_changes', OLD.id::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER devices_notify_change
+    AFTER UPDATE OR DELETE ON devices
+    FOR EACH ROW EXECUTE FUNCTION notify_device_change();
+
+CREATE OR REPLACE FUNCTION notify_settings_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('settings_changes', OLD.setting_key);
+    ELSE
+        PERFORM pg_notify('settings_changes', NEW.setting_key);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER app_settings_notify_change
+    AFTER INSERT OR UPDATE OR DELETE ON app_settings
+    FOR EACH ROW EXECUTE FUNCTION notify_settings_change();
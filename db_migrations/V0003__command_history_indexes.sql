@@ -0,0 +1,8 @@
+CREATE INDEX IF NOT EXISTS idx_command_history_created_at
+    ON command_history (created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_command_history_device_created_at
+    ON command_history (device_id, created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_command_history_command_created_at
+    ON command_history (command, created_at DESC, id DESC);
@@ -0,0 +1,109 @@
+-- command_history становится секционированной по месяцам; старые секции удаляются целиком
+ALTER TABLE command_history RENAME TO command_history_legacy;
+ALTER SEQUENCE command_history_id_seq OWNED BY NONE;
+
+CREATE TABLE command_history (
+    id INTEGER NOT NULL DEFAULT nextval('command_history_id_seq'),
+    device_id INTEGER REFERENCES devices(id),
+    command VARCHAR(100) NOT NULL,
+    success BOOLEAN DEFAULT true,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+CREATE TABLE command_history_default PARTITION OF command_history DEFAULT;
+
+CREATE OR REPLACE FUNCTION ensure_command_history_partitions(months_ahead INTEGER DEFAULT 2, from_month DATE DEFAULT NULL)
+RETURNS INTEGER AS $$
+DECLARE
+    part_start DATE := date_trunc('month', COALESCE(from_month, CURRENT_DATE))::date;
+    last_start DATE := (date_trunc('month', CURRENT_DATE) + make_interval(months => months_ahead))::date;
+    created INTEGER := 0;
+BEGIN
+    WHILE part_start <= last_start LOOP
+        IF to_regclass('command_history_' || to_char(part_start, 'YYYY_MM')) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF command_history FOR VALUES FROM (%L) TO (%L)',
+                'command_history_' || to_char(part_start, 'YYYY_MM'),
+                part_start,
+                (part_start + interval '1 month')::date
+            );
+            created := created + 1;
+        END IF;
+        part_start := (part_start + interval '1 month')::date;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION drop_command_history_partitions(older_than TIMESTAMP)
+RETURNS INTEGER AS $$
+DECLARE
+    part RECORD;
+    dropped INTEGER := 0;
+BEGIN
+    FOR part IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'command_history'::regclass
+          AND c.relname ~ '^command_history_[0-9]{4}_[0-9]{2}$'
+    LOOP
+        IF to_date(substr(part.relname, 17), 'YYYY_MM') + interval '1 month' <= older_than THEN
+            EXECUTE format('DROP TABLE %I', part.relname);
+            dropped := dropped + 1;
+        END IF;
+    END LOOP;
+    DELETE FROM command_history_default WHERE created_at < older_than;
+    RETURN dropped;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT ensure_command_history_partitions(2, (SELECT min(created_at)::date FROM command_history_legacy));
+
+INSERT INTO command_history (id, device_id, command, success, created_at)
+SELECT id, device_id, command, success, COALESCE(created_at, CURRENT_TIMESTAMP)
+FROM command_history_legacy;
+
+DROP TABLE command_history_legacy;
+ALTER SEQUENCE command_history_id_seq OWNED BY command_history.id;
+
+CREATE INDEX IF NOT EXISTS idx_command_history_created_at
+    ON command_history (created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_command_history_device_created_at
+    ON command_history (device_id, created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_command_history_command_created_at
+    ON command_history (command, created_at DESC, id DESC);
+
+-- Предагрегаты для статистики «самые нажимаемые кнопки»
+CREATE TABLE IF NOT EXISTS command_stats_hourly (
+    bucket TIMESTAMP NOT NULL,
+    device_id INTEGER NOT NULL,
+    command VARCHAR(100) NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, device_id, command)
+);
+
+CREATE TABLE IF NOT EXISTS command_stats_daily (
+    bucket DATE NOT NULL,
+    device_id INTEGER NOT NULL,
+    command VARCHAR(100) NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, device_id, command)
+);
+
+CREATE INDEX IF NOT EXISTS idx_command_stats_daily_device
+    ON command_stats_daily (device_id, bucket);
+
+CREATE TABLE IF NOT EXISTS command_stats_watermark (
+    name VARCHAR(50) PRIMARY KEY,
+    rolled_until TIMESTAMP NOT NULL
+);
+
+INSERT INTO command_stats_watermark (name, rolled_until)
+VALUES ('hourly', TIMESTAMP '1970-01-01')
+ON CONFLICT (name) DO NOTHING;
@@ -0,0 +1,2 @@
+-- Предкодированные посылки для ИК-блока: {"кнопка": {"p": "NEC", "a": 4, "c": 8}, ...}
+ALTER TABLE devices ADD COLUMN IF NOT EXISTS ir_payloads JSONB;
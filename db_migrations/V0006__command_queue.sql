@@ -0,0 +1,33 @@
+-- Очередь исходящих ИК-команд: воркеры забирают строки через FOR UPDATE SKIP LOCKED
+CREATE TABLE IF NOT EXISTS command_queue (
+    id BIGSERIAL PRIMARY KEY,
+    device_id INTEGER REFERENCES devices(id) ON DELETE SET NULL,
+    command VARCHAR(100) NOT NULL,
+    endpoint TEXT NOT NULL,
+    message JSONB NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    locked_at TIMESTAMP,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    sent_at TIMESTAMP
+);
+
+-- Готовые к отправке и зависшие у упавшего воркера строки
+CREATE INDEX IF NOT EXISTS idx_command_queue_ready ON command_queue (next_attempt_at, id) WHERE status = 'queued';
+CREATE INDEX IF NOT EXISTS idx_command_queue_sending ON command_queue (locked_at) WHERE status = 'sending';
+CREATE INDEX IF NOT EXISTS idx_command_queue_sent ON command_queue (sent_at) WHERE status = 'sent';
+
+-- Команды, исчерпавшие попытки, переносятся сюда с исходным id
+CREATE TABLE IF NOT EXISTS command_dead_letters (
+    id BIGINT PRIMARY KEY,
+    device_id INTEGER,
+    command VARCHAR(100) NOT NULL,
+    endpoint TEXT NOT NULL,
+    message JSONB NOT NULL,
+    attempts INTEGER NOT NULL,
+    last_error TEXT,
+    created_at TIMESTAMP NOT NULL,
+    failed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
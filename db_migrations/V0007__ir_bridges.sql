@@ -0,0 +1,28 @@
+-- Реестр ИК-мостов: устройство шлётся через свой мост, затем резервный, затем мосты комнаты
+CREATE TABLE IF NOT EXISTS ir_bridges (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    endpoint TEXT NOT NULL UNIQUE,
+    room VARCHAR(100),
+    -- Мосты комнаты перебираются по возрастанию priority
+    priority INTEGER NOT NULL DEFAULT 0,
+    enabled BOOLEAN NOT NULL DEFAULT true,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+ALTER TABLE devices ADD COLUMN IF NOT EXISTS room VARCHAR(100);
+ALTER TABLE devices ADD COLUMN IF NOT EXISTS bridge_id INTEGER REFERENCES ir_bridges(id) ON DELETE SET NULL;
+ALTER TABLE devices ADD COLUMN IF NOT EXISTS fallback_bridge_id INTEGER REFERENCES ir_bridges(id) ON DELETE SET NULL;
+
+-- Таблица маршрутов в памяти ir-send перечитывается по этому уведомлению
+CREATE OR REPLACE FUNCTION notify_bridge_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('bridge_changes', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER ir_bridges_notify_change
+    AFTER INSERT OR UPDATE OR DELETE ON ir_bridges
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_bridge_change();
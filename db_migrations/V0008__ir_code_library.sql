@@ -0,0 +1,51 @@
+-- Библиотека ИК-кодов: одинаковые наборы хранятся один раз, модели ссылаются на набор
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE TABLE IF NOT EXISTS ir_code_sets (
+    id SERIAL PRIMARY KEY,
+    -- md5 канонического текста jsonb: ключи в нём уже упорядочены
+    content_hash CHAR(32) NOT NULL UNIQUE,
+    codes JSONB NOT NULL,
+    payloads JSONB NOT NULL DEFAULT '{}'::jsonb,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS ir_code_models (
+    id SERIAL PRIMARY KEY,
+    brand VARCHAR(100) NOT NULL,
+    model VARCHAR(255) NOT NULL,
+    type VARCHAR(50),
+    code_set_id INTEGER NOT NULL REFERENCES ir_code_sets(id),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (brand, model)
+);
+
+-- Нечёткий поиск "samsng ue5" и поиск по началу бренда или модели
+CREATE INDEX IF NOT EXISTS idx_ir_code_models_trgm ON ir_code_models USING gin (lower(brand || ' ' || model) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_ir_code_models_model_prefix ON ir_code_models (lower(model) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_ir_code_models_brand_prefix ON ir_code_models (lower(brand) text_pattern_ops);
+
+-- devices.ir_codes и ir_payloads теперь хранят только собственные коды устройства поверх набора
+ALTER TABLE devices ADD COLUMN IF NOT EXISTS code_set_id INTEGER REFERENCES ir_code_sets(id);
+CREATE INDEX IF NOT EXISTS idx_devices_code_set ON devices (code_set_id);
+
+-- Перенос существующих кодов: по набору на уникальное содержимое, по модели на пару бренд/модель
+INSERT INTO ir_code_sets (content_hash, codes, payloads)
+SELECT DISTINCT ON (md5(ir_codes::text)) md5(ir_codes::text), ir_codes, coalesce(ir_payloads, '{}'::jsonb)
+FROM devices
+WHERE ir_codes IS NOT NULL AND ir_codes <> '{}'::jsonb
+ORDER BY md5(ir_codes::text), id
+ON CONFLICT (content_hash) DO NOTHING;
+
+INSERT INTO ir_code_models (brand, model, type, code_set_id)
+SELECT DISTINCT ON (d.brand, d.model) d.brand, d.model, d.type, s.id
+FROM devices d
+JOIN ir_code_sets s ON s.content_hash = md5(d.ir_codes::text)
+WHERE coalesce(d.brand, '') <> '' AND d.model <> ''
+ORDER BY d.brand, d.model, d.id
+ON CONFLICT (brand, model) DO NOTHING;
+
+UPDATE devices d
+SET code_set_id = s.id, ir_codes = '{}'::jsonb, ir_payloads = '{}'::jsonb
+FROM ir_code_sets s
+WHERE d.code_set_id IS NULL AND s.content_hash = md5(d.ir_codes::text);
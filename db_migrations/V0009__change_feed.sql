@@ -0,0 +1,49 @@
+-- Лента изменений для клиентов: один канал change_feed, полезная нагрузка - JSON с таблицей и строкой
+CREATE OR REPLACE FUNCTION notify_feed_device() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('change_feed', json_build_object('table', 'devices', 'op', TG_OP, 'id', OLD.id)::text);
+    ELSE
+        PERFORM pg_notify('change_feed', json_build_object(
+            'table', 'devices', 'op', TG_OP, 'id', NEW.id, 'status', NEW.status, 'updated_at', NEW.updated_at
+        )::text);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER devices_feed_change
+    AFTER INSERT OR UPDATE OR DELETE ON devices
+    FOR EACH ROW EXECUTE FUNCTION notify_feed_device();
+
+CREATE OR REPLACE FUNCTION notify_feed_history() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('change_feed', json_build_object(
+        'table', 'command_history', 'op', TG_OP, 'id', NEW.id, 'device_id', NEW.device_id,
+        'command', NEW.command, 'success', NEW.success, 'created_at', NEW.created_at
+    )::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Триггер на секционированной таблице наследуется всеми секциями, в том числе будущими
+CREATE TRIGGER command_history_feed_insert
+    AFTER INSERT ON command_history
+    FOR EACH ROW EXECUTE FUNCTION notify_feed_history();
+
+CREATE OR REPLACE FUNCTION notify_feed_setting() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('change_feed', json_build_object('table', 'app_settings', 'op', TG_OP, 'key', OLD.setting_key)::text);
+    ELSE
+        PERFORM pg_notify('change_feed', json_build_object(
+            'table', 'app_settings', 'op', TG_OP, 'key', NEW.setting_key, 'value', NEW.setting_value
+        )::text);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER app_settings_feed_change
+    AFTER INSERT OR UPDATE OR DELETE ON app_settings
+    FOR EACH ROW EXECUTE FUNCTION notify_feed_setting();
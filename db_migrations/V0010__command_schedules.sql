@@ -0,0 +1,40 @@
+-- Расписания команд: разовые (run_at, таймер сна) и по дням недели в time_of_day по своему часовому поясу
+CREATE TABLE IF NOT EXISTS command_schedules (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(100),
+    device_id INTEGER REFERENCES devices(id) ON DELETE CASCADE,
+    group_id INTEGER REFERENCES device_groups(id) ON DELETE CASCADE,
+    command VARCHAR(100) NOT NULL,
+    run_at TIMESTAMPTZ,
+    time_of_day TIME,
+    -- Битовая маска дней: 1 - понедельник ... 64 - воскресенье
+    weekdays SMALLINT NOT NULL DEFAULT 127,
+    timezone VARCHAR(64) NOT NULL DEFAULT 'UTC',
+    enabled BOOLEAN NOT NULL DEFAULT true,
+    -- NULL у отработавших разовых расписаний
+    next_run_at TIMESTAMPTZ,
+    last_run_at TIMESTAMPTZ,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    CHECK ((device_id IS NULL) <> (group_id IS NULL)),
+    CHECK (run_at IS NOT NULL OR time_of_day IS NOT NULL)
+);
+
+-- Исполнитель читает только ближайшие срабатывания диапазоном по этому индексу
+CREATE INDEX IF NOT EXISTS idx_command_schedules_due ON command_schedules (next_run_at) WHERE enabled AND next_run_at IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_command_schedules_device ON command_schedules (device_id);
+
+-- Планировщики процессов ir-send добавляют новое время срабатывания в свою кучу таймеров
+CREATE OR REPLACE FUNCTION notify_schedule_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('schedule_changes', NEW.id || ':' || extract(epoch FROM NEW.next_run_at));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER command_schedules_notify_change
+    AFTER INSERT OR UPDATE OF next_run_at, enabled ON command_schedules
+    FOR EACH ROW
+    WHEN (NEW.enabled AND NEW.next_run_at IS NOT NULL)
+    EXECUTE FUNCTION notify_schedule_change();
@@ -0,0 +1,41 @@
+-- Номера событий ленты общие для всех экземпляров ir-control: "номер:JSON" в полезной нагрузке.
+-- NOTIFY доходит до всех слушателей в одном порядке коммитов, поэтому курсор действует на любом экземпляре
+CREATE SEQUENCE IF NOT EXISTS change_feed_seq;
+
+CREATE OR REPLACE FUNCTION notify_feed_device() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('change_feed', nextval('change_feed_seq') || ':' ||
+            json_build_object('table', 'devices', 'op', TG_OP, 'id', OLD.id)::text);
+    ELSE
+        PERFORM pg_notify('change_feed', nextval('change_feed_seq') || ':' || json_build_object(
+            'table', 'devices', 'op', TG_OP, 'id', NEW.id, 'status', NEW.status, 'updated_at', NEW.updated_at
+        )::text);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION notify_feed_history() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('change_feed', nextval('change_feed_seq') || ':' || json_build_object(
+        'table', 'command_history', 'op', TG_OP, 'id', NEW.id, 'device_id', NEW.device_id,
+        'command', NEW.command, 'success', NEW.success, 'created_at', NEW.created_at
+    )::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION notify_feed_setting() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('change_feed', nextval('change_feed_seq') || ':' ||
+            json_build_object('table', 'app_settings', 'op', TG_OP, 'key', OLD.setting_key)::text);
+    ELSE
+        PERFORM pg_notify('change_feed', nextval('change_feed_seq') || ':' || json_build_object(
+            'table', 'app_settings', 'op', TG_OP, 'key', NEW.setting_key, 'value', NEW.setting_value
+        )::text);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,39 @@
+-- Версия данных стартового экрана: счётчик растёт в той же транзакции, что и изменение любой из таблиц пакета,
+-- поэтому проверка ETag читает одну строку вместо агрегатов по таблицам
+CREATE TABLE IF NOT EXISTS bootstrap_version (
+    id BOOLEAN PRIMARY KEY DEFAULT true CHECK (id),
+    version BIGINT NOT NULL DEFAULT 1
+);
+
+INSERT INTO bootstrap_version (id) VALUES (true) ON CONFLICT (id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_bootstrap_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE bootstrap_version SET version = version + 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER devices_bump_bootstrap
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON devices
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_bootstrap_version();
+
+CREATE TRIGGER remote_layouts_bump_bootstrap
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON remote_layouts
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_bootstrap_version();
+
+CREATE TRIGGER favorites_bump_bootstrap
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON favorites
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_bootstrap_version();
+
+CREATE TRIGGER device_groups_bump_bootstrap
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON device_groups
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_bootstrap_version();
+
+CREATE TRIGGER group_devices_bump_bootstrap
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON group_devices
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_bootstrap_version();
+
+CREATE TRIGGER app_settings_bump_bootstrap
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON app_settings
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_bootstrap_version();
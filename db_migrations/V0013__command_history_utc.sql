@@ -0,0 +1,26 @@
+-- command_history и агрегаты ведутся в UTC: так пишут буферы истории и считает maintain_history
+ALTER TABLE command_history ALTER COLUMN created_at SET DEFAULT (now() AT TIME ZONE 'UTC');
+
+CREATE OR REPLACE FUNCTION ensure_command_history_partitions(months_ahead INTEGER DEFAULT 2, from_month DATE DEFAULT NULL)
+RETURNS INTEGER AS $$
+DECLARE
+    today DATE := (now() AT TIME ZONE 'UTC')::date;
+    part_start DATE := date_trunc('month', COALESCE(from_month, today))::date;
+    last_start DATE := (date_trunc('month', today) + make_interval(months => months_ahead))::date;
+    created INTEGER := 0;
+BEGIN
+    WHILE part_start <= last_start LOOP
+        IF to_regclass('command_history_' || to_char(part_start, 'YYYY_MM')) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF command_history FOR VALUES FROM (%L) TO (%L)',
+                'command_history_' || to_char(part_start, 'YYYY_MM'),
+                part_start,
+                (part_start + interval '1 month')::date
+            );
+            created := created + 1;
+        END IF;
+        part_start := (part_start + interval '1 month')::date;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
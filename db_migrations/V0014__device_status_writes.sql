@@ -0,0 +1,38 @@
+-- Статус устройства пишет только лидер проверки мостов. Такое UPDATE не сбрасывает кэши устройств
+-- в процессах и не меняет версию стартового экрана: клиенты получают статус из ленты изменений
+DROP TRIGGER IF EXISTS devices_notify_change ON devices;
+
+CREATE TRIGGER devices_notify_change
+    AFTER UPDATE ON devices
+    FOR EACH ROW
+    WHEN ((to_jsonb(OLD) - 'status') IS DISTINCT FROM (to_jsonb(NEW) - 'status'))
+    EXECUTE FUNCTION notify_device_change();
+
+CREATE TRIGGER devices_notify_delete
+    AFTER DELETE ON devices
+    FOR EACH ROW EXECUTE FUNCTION notify_device_change();
+
+CREATE OR REPLACE FUNCTION bump_bootstrap_version_devices() RETURNS trigger AS $$
+BEGIN
+    IF EXISTS (
+        SELECT 1
+        FROM old_devices o
+        JOIN new_devices n ON n.id = o.id
+        WHERE (to_jsonb(o) - 'status') IS DISTINCT FROM (to_jsonb(n) - 'status')
+    ) THEN
+        UPDATE bootstrap_version SET version = version + 1;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS devices_bump_bootstrap ON devices;
+
+CREATE TRIGGER devices_bump_bootstrap
+    AFTER INSERT OR DELETE OR TRUNCATE ON devices
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_bootstrap_version();
+
+CREATE TRIGGER devices_update_bump_bootstrap
+    AFTER UPDATE ON devices
+    REFERENCING OLD TABLE AS old_devices NEW TABLE AS new_devices
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_bootstrap_version_devices();
@@ -0,0 +1,35 @@
+-- Версия стартового экрана - счётчик на каждую таблицу пакета вместо одной строки на всех:
+-- записи в разные таблицы больше не ждут друг друга на блокировке общей строки до коммита
+CREATE TABLE IF NOT EXISTS bootstrap_versions (
+    table_name VARCHAR(64) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 1
+);
+
+INSERT INTO bootstrap_versions (table_name, version)
+SELECT t.table_name, (SELECT version FROM bootstrap_version)
+FROM (VALUES ('devices'), ('remote_layouts'), ('favorites'), ('device_groups'), ('group_devices'), ('app_settings'))
+    AS t(table_name)
+ON CONFLICT (table_name) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_bootstrap_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE bootstrap_versions SET version = version + 1 WHERE table_name = TG_TABLE_NAME;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION bump_bootstrap_version_devices() RETURNS trigger AS $$
+BEGIN
+    IF EXISTS (
+        SELECT 1
+        FROM old_devices o
+        JOIN new_devices n ON n.id = o.id
+        WHERE (to_jsonb(o) - 'status') IS DISTINCT FROM (to_jsonb(n) - 'status')
+    ) THEN
+        UPDATE bootstrap_versions SET version = version + 1 WHERE table_name = TG_TABLE_NAME;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TABLE IF EXISTS bootstrap_version;
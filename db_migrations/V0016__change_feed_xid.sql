@@ -0,0 +1,40 @@
+-- В полезной нагрузке ленты теперь "номер:xid:JSON". По xid ir-control решает, попало ли событие
+-- в снимок, из которого собран стартовый пакет: клиент продолжает ленту ровно с первого изменения,
+-- которого в пакете нет
+CREATE OR REPLACE FUNCTION notify_feed_device() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('change_feed', nextval('change_feed_seq') || ':' || txid_current() || ':' ||
+            json_build_object('table', 'devices', 'op', TG_OP, 'id', OLD.id)::text);
+    ELSE
+        PERFORM pg_notify('change_feed', nextval('change_feed_seq') || ':' || txid_current() || ':' || json_build_object(
+            'table', 'devices', 'op', TG_OP, 'id', NEW.id, 'status', NEW.status, 'updated_at', NEW.updated_at
+        )::text);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION notify_feed_history() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('change_feed', nextval('change_feed_seq') || ':' || txid_current() || ':' || json_build_object(
+        'table', 'command_history', 'op', TG_OP, 'id', NEW.id, 'device_id', NEW.device_id,
+        'command', NEW.command, 'success', NEW.success, 'created_at', NEW.created_at
+    )::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION notify_feed_setting() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('change_feed', nextval('change_feed_seq') || ':' || txid_current() || ':' ||
+            json_build_object('table', 'app_settings', 'op', TG_OP, 'key', OLD.setting_key)::text);
+    ELSE
+        PERFORM pg_notify('change_feed', nextval('change_feed_seq') || ':' || txid_current() || ':' || json_build_object(
+            'table', 'app_settings', 'op', TG_OP, 'key', NEW.setting_key, 'value', NEW.setting_value
+        )::text);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
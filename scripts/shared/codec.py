@@ -0,0 +1,97 @@
+"""Кодирование ИК-кодов в компактные посылки блока для devices и ir-learn"""
+import base64
+import sys
+from array import array
+
+# >>> shared/codec.py (источник - scripts/shared/codec.py)
+IR_PROTOCOLS = ('NEC', 'NECX', 'SAMSUNG', 'SONY', 'RC5', 'RC6', 'PANASONIC', 'JVC', 'LG', 'SHARP')
+PRONTO_UNIT_US = 0.241246
+MAX_TIMINGS = 512
+
+def encode_ir_code(ir_code):
+    """Нормализует ИК-код в компактную посылку для блока
+
+    Поддерживаются "ПРОТОКОЛ:0xЗНАЧЕНИЕ[:биты]" (NEC раскладывается на адрес и
+    команду), Pronto Hex, "raw:частота:мкс,мкс,..." и короткие hex-коды, которые
+    передаются как есть. Тайминги упаковываются в uint16 и base64.
+    Нераспознанный формат - ValueError.
+    """
+    code = ir_code.strip() if isinstance(ir_code, str) else ''
+    if not code:
+        raise ValueError('IR code must be a non-empty string')
+    words = code.split()
+    if len(words) > 4 and all(len(word) == 4 for word in words):
+        return _encode_pronto(words)
+    if code.lower().startswith('raw:'):
+        return _encode_raw(code)
+    if ':' in code:
+        return _encode_protocol(code)
+    if len(code) <= 16 and all(char in '0123456789abcdefABCDEF' for char in code):
+        return {'code': code.upper()}
+    raise ValueError(f'Unrecognised IR code format: {code[:32]}')
+
+def _encode_protocol(code):
+    parts = code.split(':')
+    protocol = parts[0].upper()
+    if protocol not in IR_PROTOCOLS or len(parts) > 3:
+        raise ValueError(f'Unsupported IR protocol: {parts[0]}')
+    try:
+        value = int(parts[1], 16)
+        bits = int(parts[2]) if len(parts) == 3 else None
+    except ValueError:
+        raise ValueError(f'Invalid {protocol} code value: {parts[1]}')
+    if protocol == 'NEC' and bits in (None, 32):
+        if not 0 <= value <= 0xFFFFFFFF:
+            raise ValueError('NEC code must fit in 32 bits')
+        address, address_inv, command, command_inv = value.to_bytes(4, 'big')
+        if command ^ command_inv != 0xFF:
+            raise ValueError('NEC command byte fails its inverse check')
+        if address ^ address_inv != 0xFF:
+            # Расширенный NEC: 16-битный адрес без инверсии
+            address = (address << 8) | address_inv
+        return {'p': 'NEC', 'a': address, 'c': command}
+    payload = {'p': protocol, 'v': value}
+    if bits:
+        payload['b'] = bits
+    return payload
+
+def _encode_pronto(words):
+    try:
+        values = [int(word, 16) for word in words]
+    except ValueError:
+        raise ValueError('Pronto code must consist of 4-digit hex words')
+    kind, frequency_word, once_pairs, repeat_pairs = values[:4]
+    if kind != 0 or not frequency_word:
+        raise ValueError('Only learned (0000) Pronto codes are supported')
+    if len(values) != 4 + 2 * (once_pairs + repeat_pairs):
+        raise ValueError('Pronto code length does not match its burst pair counts')
+    period_us = frequency_word * PRONTO_UNIT_US
+    timings = [round(value * period_us) for value in values[4:]]
+    return _pack_timings(round(1000000 / period_us), timings, 2 * once_pairs)
+
+def _encode_raw(code):
+    parts = code.split(':')
+    try:
+        frequency = int(parts[1])
+        timings = [int(value) for value in parts[2].split(',')]
+    except (IndexError, ValueError):
+        raise ValueError('Raw code must look like raw:38000:9000,4500,...')
+    return _pack_timings(frequency, timings, len(timings))
+
+def _pack_timings(frequency, timings, repeat_from):
+    if not 10000 <= frequency <= 500000:
+        raise ValueError(f'Carrier frequency out of range: {frequency}')
+    if not timings or len(timings) % 2 or len(timings) > MAX_TIMINGS:
+        raise ValueError('Timings must be a non-empty even list of mark/space durations')
+    if any(value <= 0 for value in timings) or any(mark > 0xFFFF for mark in timings[::2]):
+        raise ValueError('Marks must be between 1 and 65535 us')
+    # Паузы длиннее 65 мс для блока неотличимы от тишины, обрезаем их до uint16
+    packed_timings = array('H', [min(value, 0xFFFF) for value in timings])
+    if sys.byteorder == 'big':
+        packed_timings.byteswap()
+    packed = base64.b64encode(packed_timings.tobytes()).decode()
+    payload = {'p': 'RAW', 'f': frequency, 't': packed}
+    if repeat_from < len(timings):
+        payload['r'] = repeat_from
+    return payload
+# <<< shared/codec.py
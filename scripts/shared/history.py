@@ -0,0 +1,117 @@
+"""Буфер command_history для ir-send и ir-control: нажатие не ждёт коммита записи истории
+
+HISTORY_TABLE функция объявляет сама: ir-send пишет в таблицу со схемой.
+"""
+import atexit
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from framework import get_db_connection, psycopg2, release_db_connection
+
+HISTORY_TABLE = 'command_history'
+
+# >>> shared/history.py (источник - scripts/shared/history.py)
+HISTORY_MODE = os.environ.get('HISTORY_MODE', 'buffered')
+HISTORY_FLUSH_SIZE = int(os.environ.get('HISTORY_FLUSH_SIZE', '100'))
+HISTORY_FLUSH_INTERVAL = float(os.environ.get('HISTORY_FLUSH_INTERVAL', '1'))
+HISTORY_QUEUE_MAX_SIZE = int(os.environ.get('HISTORY_QUEUE_MAX_SIZE', '10000'))
+# block - нажатие ждёт освобождения места в очереди, drop - вытесняются самые старые записи
+HISTORY_BACKPRESSURE = os.environ.get('HISTORY_BACKPRESSURE', 'block')
+# Дольше этого block не ждёт: при недоступной базе записи отбрасываются, а нажатие идёт дальше
+HISTORY_BLOCK_TIMEOUT = float(os.environ.get('HISTORY_BLOCK_TIMEOUT', '2'))
+# Столько секунд неудачные пачки повторяются, потом записи отбрасываются: иначе они опоздают к агрегатам
+HISTORY_RETRY_WINDOW = float(os.environ.get('HISTORY_RETRY_WINDOW', '120'))
+
+# Буфер истории: записи копятся в памяти и уходят в БД пачками из фонового потока
+_history_cond = threading.Condition()
+_history_buffer = []
+_history_thread = None
+_history_stats = {'queued': 0, 'flushed': 0, 'dropped': 0, 'failed': 0}
+
+def record_history(rows):
+    """Ставит записи command_history в буфер, не добавляя коммит к нажатию"""
+    if HISTORY_MODE == 'sync':
+        _write_history(rows)
+        return
+    _ensure_history_writer()
+    deadline = time.monotonic() + HISTORY_BLOCK_TIMEOUT
+    with _history_cond:
+        while _history_buffer and len(_history_buffer) + len(rows) > HISTORY_QUEUE_MAX_SIZE:
+            remaining = deadline - time.monotonic()
+            if HISTORY_BACKPRESSURE == 'drop':
+                overflow = min(len(_history_buffer), len(_history_buffer) + len(rows) - HISTORY_QUEUE_MAX_SIZE)
+                del _history_buffer[:overflow]
+                _history_stats['dropped'] += overflow
+            elif remaining <= 0:
+                _history_stats['dropped'] += len(rows)
+                return
+            else:
+                _history_cond.notify_all()
+                _history_cond.wait(min(remaining, HISTORY_FLUSH_INTERVAL))
+        _history_buffer.extend(rows)
+        _history_stats['queued'] += len(rows)
+        if len(_history_buffer) >= HISTORY_FLUSH_SIZE:
+            _history_cond.notify_all()
+
+def flush_history():
+    """Синхронно сбрасывает весь буфер; вызывается и при завершении процесса"""
+    with _history_cond:
+        batch = _history_buffer[:]
+        del _history_buffer[:]
+    _flush_history_batch(batch)
+
+def _ensure_history_writer():
+    global _history_thread
+    with _history_cond:
+        if _history_thread is None or not _history_thread.is_alive():
+            _history_thread = threading.Thread(target=_history_writer, name='history-writer', daemon=True)
+            _history_thread.start()
+
+def _history_writer():
+    while True:
+        with _history_cond:
+            if len(_history_buffer) < HISTORY_FLUSH_SIZE:
+                _history_cond.wait(HISTORY_FLUSH_INTERVAL)
+            batch = _history_buffer[:]
+            del _history_buffer[:]
+        if not _flush_history_batch(batch):
+            time.sleep(HISTORY_FLUSH_INTERVAL)
+
+def _flush_history_batch(batch):
+    if not batch:
+        return True
+    try:
+        _write_history(batch)
+        _history_stats['flushed'] += len(batch)
+        return True
+    except Exception:
+        _history_stats['failed'] += len(batch)
+        # Возвращаем пачку в начало очереди, чтобы повторить при следующем сбросе
+        retry_after = datetime.now(timezone.utc) - timedelta(seconds=HISTORY_RETRY_WINDOW)
+        retry = [row for row in batch if row[3] >= retry_after]
+        with _history_cond:
+            room = max(0, HISTORY_QUEUE_MAX_SIZE - len(_history_buffer))
+            _history_buffer[:0] = retry[:room]
+            _history_stats['dropped'] += len(batch) - min(room, len(retry))
+        return False
+    finally:
+        with _history_cond:
+            _history_cond.notify_all()
+
+atexit.register(flush_history)
+
+def _write_history(rows):
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            # created_at - TIMESTAMP без зоны, в нём всегда UTC независимо от часового пояса сессии
+            psycopg2.extras.execute_values(cur, f"""
+                INSERT INTO {HISTORY_TABLE} (device_id, command, success, created_at)
+                VALUES %s
+            """, rows, template="(%s, %s, %s, %s AT TIME ZONE 'UTC')")
+        conn.commit()
+    finally:
+        release_db_connection(conn)
+# <<< shared/history.py
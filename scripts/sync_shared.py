@@ -0,0 +1,68 @@
+"""Раскладывает общий код из scripts/shared по функциям backend
+
+Запуск: python3 scripts/sync_shared.py [--check]
+
+Каждая функция деплоится своей папкой с одним index.py, поэтому общий каркас,
+буфер истории и кодек ИК-кодов лежат в ней копией между маркерами
+"# >>> shared/<модуль>" и "# <<< shared/<модуль>". Правится только
+scripts/shared/<модуль>, скрипт переписывает копии. С --check файлы не
+меняются: расхождение любой копии с исходником - код выхода 1, так проверку
+можно ставить перед деплоем.
+"""
+import argparse
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+SHARED_DIR = ROOT / 'scripts' / 'shared'
+BACKEND_DIR = ROOT / 'backend'
+
+# Модуль из scripts/shared -> функции, в index.py которых лежит его копия
+SHARED_MODULES = {
+    'framework.py': ('devices', 'ir-control', 'ir-learn', 'ir-send', 'settings'),
+    'history.py': ('ir-control', 'ir-send'),
+    'codec.py': ('devices', 'ir-learn'),
+}
+
+
+def find_block(text, module, path):
+    """(начало, конец) блока модуля в тексте, включая обе строки-маркера"""
+    start = text.find(f'# >>> shared/{module}')
+    end_marker = f'# <<< shared/{module}\n'
+    end = text.find(end_marker, start)
+    if start < 0 or end < 0 or (start and text[start - 1] != '\n'):
+        raise SystemExit(f'{path}: no shared/{module} block')
+    return start, end + len(end_marker)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--check', action='store_true', help='only report copies that differ from scripts/shared')
+    args = parser.parse_args()
+
+    stale = []
+    for module, functions in SHARED_MODULES.items():
+        source_path = SHARED_DIR / module
+        source = source_path.read_text(encoding='utf-8')
+        start, end = find_block(source, module, source_path)
+        canonical = source[start:end]
+        for function in functions:
+            path = BACKEND_DIR / function / 'index.py'
+            text = path.read_text(encoding='utf-8')
+            start, end = find_block(text, module, path)
+            if text[start:end] == canonical:
+                continue
+            stale.append(f'{path.relative_to(ROOT)}: shared/{module}')
+            if not args.check:
+                path.write_text(text[:start] + canonical + text[end:], encoding='utf-8')
+
+    for entry in stale:
+        print(('out of date ' if args.check else 'updated ') + entry)
+    if args.check and stale:
+        print('run python3 scripts/sync_shared.py to update the copies', file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -75,13 +75,17 @@ const AddDeviceDialog = ({ open, onOpenChange, onDeviceAdded }: AddDeviceDialogP
     setLoading(true);
     try {
       const irCodes = DEFAULT_IR_CODES[type as keyof typeof DEFAULT_IR_CODES] || DEFAULT_IR_CODES.tv;
+      const matches = await api.searchCodeSets(`${brand} ${model}`, type).catch(() => []);
+      const match = matches.find(
+        (item) => item.brand.toLowerCase() === brand.toLowerCase() && item.model.toLowerCase() === model.toLowerCase()
+      );
       
       await api.createDevice({
         name,
         brand,
         model,
         type,
-        ir_codes: irCodes,
+        ...(match ? { code_set_id: match.code_set_id } : { ir_codes: irCodes }),
         status: 'offline'
       });
 
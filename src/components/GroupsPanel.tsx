@@ -6,12 +6,18 @@ import Icon from '@/components/ui/icon';
 import { api, type DeviceGroup } from '@/lib/api';
 import { toast } from '@/components/ui/use-toast';
 
-const GroupsPanel = () => {
-  const [groups, setGroups] = useState<DeviceGroup[]>([]);
-  const [loading, setLoading] = useState(true);
+interface GroupsPanelProps {
+  initialGroups?: DeviceGroup[];
+}
+
+const GroupsPanel = ({ initialGroups }: GroupsPanelProps) => {
+  const [groups, setGroups] = useState<DeviceGroup[]>(initialGroups ?? []);
+  const [loading, setLoading] = useState(!initialGroups);
 
   useEffect(() => {
-    loadGroups();
+    if (!initialGroups) {
+      loadGroups();
+    }
   }, []);
 
   const loadGroups = async () => {
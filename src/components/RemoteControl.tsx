@@ -31,6 +31,12 @@ const RemoteControl = ({ device }: RemoteControlProps) => {
           description: `ИК-код: ${result.ir_code}`,
           duration: 2000
         });
+      } else if (result.queued) {
+        toast({
+          title: '✓ Команда в очереди',
+          description: `Номер команды: ${result.command_id}`,
+          duration: 2000
+        });
       }
     } catch (error) {
       toast({
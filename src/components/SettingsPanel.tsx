@@ -12,7 +12,12 @@ import AddDeviceDialog from '@/components/AddDeviceDialog';
 import LearnModeDialog from '@/components/LearnModeDialog';
 import { api, type Device } from '@/lib/api';
 
-const SettingsPanel = () => {
+interface SettingsPanelProps {
+  initialSettings?: Record<string, string>;
+  initialDevices?: Device[];
+}
+
+const SettingsPanel = ({ initialSettings, initialDevices }: SettingsPanelProps) => {
   const [irEnabled, setIrEnabled] = useState(true);
   const [autoRecognition, setAutoRecognition] = useState(true);
   const [vibration, setVibration] = useState(true);
@@ -21,20 +26,29 @@ const SettingsPanel = () => {
   const [showAddDevice, setShowAddDevice] = useState(false);
   const [showLearnMode, setShowLearnMode] = useState(false);
   const [selectedDevice, setSelectedDevice] = useState<Device | null>(null);
-  const [devices, setDevices] = useState<Device[]>([]);
+  const [devices, setDevices] = useState<Device[]>(initialDevices ?? []);
   const [loading, setLoading] = useState(false);
 
   useEffect(() => {
-    loadSettings();
-    loadDevices();
+    if (initialSettings) {
+      applySettings(initialSettings);
+    } else {
+      loadSettings();
+    }
+    if (!initialDevices) {
+      loadDevices();
+    }
   }, []);
 
+  const applySettings = (settings: Record<string, string>) => {
+    setIrEndpoint(settings.ir_endpoint || '');
+    setAutoRecognition(settings.auto_detect === 'true');
+    setIrEnabled(settings.ir_port !== 'disabled');
+  };
+
   const loadSettings = async () => {
     try {
-      const settings = await api.getSettings();
-      setIrEndpoint(settings.ir_endpoint || '');
-      setAutoRecognition(settings.auto_detect === 'true');
-      setIrEnabled(settings.ir_port !== 'disabled');
+      applySettings(await api.getSettings());
     } catch (error) {
       console.error('Failed to load settings:', error);
     }
@@ -12,9 +12,39 @@ export interface Device {
   brand?: string;
   status: string;
   ir_codes?: Record<string, string>;
+  room?: string | null;
+  bridge_id?: number | null;
+  fallback_bridge_id?: number | null;
+  code_set_id?: number | null;
+  ir_overrides?: Record<string, string>;
   created_at?: string;
 }
 
+export interface CodeSetMatch {
+  code_set_id: number;
+  brand: string;
+  model: string;
+  type: string | null;
+  ir_codes: Record<string, string>;
+}
+
+export interface IRBridge {
+  id: number;
+  name: string;
+  endpoint: string;
+  room: string | null;
+  priority: number;
+  enabled: boolean;
+  created_at?: string;
+  updated_at?: string;
+}
+
+export interface BulkImportResult {
+  imported: number;
+  failed: number;
+  errors: { line: number; error: string }[];
+}
+
 export interface CommandHistory {
   id: number;
   command: string;
@@ -24,6 +54,77 @@ export interface CommandHistory {
   device_type: string;
 }
 
+export interface QueuedCommand {
+  command_id: number;
+  device_id: number | null;
+  command: string;
+  status: 'queued' | 'sending' | 'sent' | 'dead';
+  attempts: number;
+  last_error: string | null;
+  created_at: string;
+  sent_at: string | null;
+}
+
+export interface CommandSchedule {
+  id: number;
+  name: string | null;
+  device_id: number | null;
+  group_id: number | null;
+  command: string;
+  run_at: string | null;
+  time_of_day: string | null;
+  weekdays: number;
+  timezone: string;
+  enabled: boolean;
+  next_run_at: string | null;
+  last_run_at: string | null;
+  last_error: string | null;
+}
+
+export interface ScheduleInput {
+  id?: number;
+  name?: string;
+  device_id?: number;
+  group_id?: number;
+  command: string;
+  run_at?: string;
+  in_seconds?: number;
+  time_of_day?: string;
+  weekdays?: number[] | number;
+  timezone?: string;
+  enabled?: boolean;
+}
+
+export interface BatchStep {
+  device_id: number;
+  command: string;
+  repeat?: number;
+  delay_ms?: number;
+}
+
+export interface BatchStepResult extends BatchStep {
+  sent: number;
+  success: boolean;
+  message: string;
+}
+
+export interface GroupSendResult {
+  device_id: number;
+  device: string;
+  success: boolean;
+  message: string;
+}
+
+export interface HistoryFilter {
+  device_id?: number;
+  command?: string;
+  since?: string;
+  until?: string;
+  success?: boolean;
+  limit?: number;
+  cursor?: string;
+}
+
 export interface DeviceGroup {
   id: number;
   name: string;
@@ -31,12 +132,105 @@ export interface DeviceGroup {
   devices: Device[];
 }
 
+export interface RemoteLayout {
+  id: number;
+  device_id: number;
+  layout_data: Record<string, unknown>;
+  updated_at: string;
+}
+
+export interface Favorite {
+  id: number;
+  device_id: number;
+  command: string;
+  label: string | null;
+  icon: string | null;
+}
+
+export interface BootstrapBundle {
+  version: string;
+  // Снимок базы, из которого собран пакет: с него продолжается лента изменений
+  cursor: string;
+  devices: Device[];
+  layouts: RemoteLayout[];
+  favorites: Favorite[];
+  groups: DeviceGroup[];
+  settings: Record<string, string>;
+}
+
+export interface ChangeEvent {
+  table: 'devices' | 'command_history' | 'app_settings';
+  op: 'INSERT' | 'UPDATE' | 'DELETE';
+  id?: number;
+  status?: string;
+  device_id?: number;
+  command?: string;
+  success?: boolean;
+  key?: string;
+  value?: string;
+}
+
+let bootstrapCache: { etag: string; bundle: BootstrapBundle } | null = null;
+let devicesCache: { etag: string; devices: Device[] } | null = null;
+
 export const api = {
+  subscribeChanges(since: string | null, onChange: (change: ChangeEvent) => void, onReset: () => void): () => void {
+    const query = since ? `&since=${encodeURIComponent(since)}` : '';
+    const source = new EventSource(`${HISTORY_API}?action=changes${query}`);
+    source.onmessage = (event) => onChange(JSON.parse(event.data));
+    source.addEventListener('reset', onReset);
+    return () => source.close();
+  },
+
+  // fresh - после сброса ленты: курсор сохранённого пакета она уже не продолжает
+  async getBootstrap(fresh = false): Promise<BootstrapBundle> {
+    const response = await fetch(`${HISTORY_API}?action=bootstrap`, {
+      headers: bootstrapCache && !fresh ? { 'If-None-Match': bootstrapCache.etag } : {}
+    });
+    if (response.status === 304 && bootstrapCache) {
+      return bootstrapCache.bundle;
+    }
+    const bundle: BootstrapBundle = await response.json();
+    const etag = response.headers.get('ETag');
+    bootstrapCache = etag ? { etag, bundle } : null;
+    return bundle;
+  },
+
   async getDevices(): Promise<Device[]> {
-    const response = await fetch(DEVICES_API);
+    const response = await fetch(DEVICES_API, {
+      headers: devicesCache ? { 'If-None-Match': devicesCache.etag } : {}
+    });
+    if (response.status === 304 && devicesCache) {
+      return devicesCache.devices;
+    }
+    const devices: Device[] = await response.json();
+    const etag = response.headers.get('ETag');
+    devicesCache = etag ? { etag, devices } : null;
+    return devices;
+  },
+
+  async importDevices(body: string, format: 'ndjson' | 'csv' = 'ndjson'): Promise<BulkImportResult> {
+    const response = await fetch(`${DEVICES_API}?action=import&format=${format}`, {
+      method: 'POST',
+      headers: { 'Content-Type': format === 'csv' ? 'text/csv' : 'application/x-ndjson' },
+      body
+    });
     return response.json();
   },
 
+  async searchCodeSets(query: string, type?: string): Promise<CodeSetMatch[]> {
+    const params = new URLSearchParams({ action: 'code_sets', q: query });
+    if (type) params.set('type', type);
+    const response = await fetch(`${DEVICES_API}?${params}`);
+    const data = await response.json();
+    return data.code_sets;
+  },
+
+  async exportDevices(format: 'ndjson' | 'csv' = 'ndjson'): Promise<Blob> {
+    const response = await fetch(`${DEVICES_API}?action=export&format=${format}`);
+    return response.blob();
+  },
+
   async createDevice(device: Omit<Device, 'id' | 'created_at' | 'updated_at'>): Promise<Device> {
     const response = await fetch(DEVICES_API, {
       method: 'POST',
@@ -62,15 +256,67 @@ export const api = {
     return response.json();
   },
 
-  async sendCommand(deviceId: number, command: string): Promise<{ success: boolean; ir_code: string; message: string }> {
+  async sendCommand(
+    deviceId: number,
+    command: string,
+    idempotencyKey?: string
+  ): Promise<{ success?: boolean; ir_code?: string; message?: string; coalesced?: boolean; repeat?: number; queued?: boolean; command_id?: number }> {
+    const headers: Record<string, string> = { 'Content-Type': 'application/json' };
+    if (idempotencyKey) {
+      headers['Idempotency-Key'] = idempotencyKey;
+    }
     const response = await fetch(IR_SEND_API, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers,
       body: JSON.stringify({ device_id: deviceId, command })
     });
     return response.json();
   },
 
+  async getCommandStatus(commandId: number): Promise<QueuedCommand> {
+    const response = await fetch(`${IR_SEND_API}?command_id=${commandId}`);
+    return response.json();
+  },
+
+  async sendCommandBatch(steps: BatchStep[]): Promise<{ success: boolean; steps: BatchStepResult[] }> {
+    const response = await fetch(IR_SEND_API, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ steps })
+    });
+    return response.json();
+  },
+
+  async sendGroupCommand(groupId: number, command: string): Promise<{ success: boolean; results: GroupSendResult[] }> {
+    const response = await fetch(IR_SEND_API, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ group_id: groupId, command })
+    });
+    return response.json();
+  },
+
+  async getSchedules(deviceId?: number): Promise<CommandSchedule[]> {
+    const params = deviceId ? `&device_id=${deviceId}` : '';
+    const response = await fetch(`${IR_SEND_API}?action=schedules${params}`);
+    const data = await response.json();
+    return data.schedules;
+  },
+
+  async saveSchedule(schedule: ScheduleInput): Promise<CommandSchedule> {
+    const response = await fetch(`${IR_SEND_API}?action=schedules`, {
+      method: 'PUT',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ timezone: Intl.DateTimeFormat().resolvedOptions().timeZone, ...schedule })
+    });
+    return response.json();
+  },
+
+  async deleteSchedule(scheduleId: number): Promise<{ message: string }> {
+    const response = await fetch(`${IR_SEND_API}?action=schedules&id=${scheduleId}`, { method: 'DELETE' });
+    return response.json();
+  },
+
   async getSettings(): Promise<Record<string, string>> {
     const response = await fetch(SETTINGS_API);
     return response.json();
@@ -85,12 +331,36 @@ export const api = {
     return response.json();
   },
 
+  async getBridges(): Promise<IRBridge[]> {
+    const response = await fetch(`${SETTINGS_API}?action=bridges`);
+    const data = await response.json();
+    return data.bridges;
+  },
+
+  async saveBridge(bridge: Omit<IRBridge, 'id' | 'created_at' | 'updated_at'>): Promise<IRBridge> {
+    const response = await fetch(`${SETTINGS_API}?action=bridges`, {
+      method: 'PUT',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify(bridge)
+    });
+    return response.json();
+  },
+
   async getHistory(): Promise<CommandHistory[]> {
     const response = await fetch(`${HISTORY_API}?action=history`);
     const data = await response.json();
     return data.history;
   },
 
+  async getHistoryPage(filter: HistoryFilter = {}): Promise<{ history: CommandHistory[]; next_cursor: string | null }> {
+    const params = new URLSearchParams({ action: 'history' });
+    Object.entries(filter).forEach(([key, value]) => {
+      if (value !== undefined) params.set(key, String(value));
+    });
+    const response = await fetch(`${HISTORY_API}?${params}`);
+    return response.json();
+  },
+
   async getGroups(): Promise<DeviceGroup[]> {
     const response = await fetch(`${HISTORY_API}?action=groups`);
     const data = await response.json();
@@ -106,6 +376,15 @@ export const api = {
     return response.json();
   },
 
+  async learnIRCodes(deviceId: number, codes: Record<string, string>): Promise<{ success: boolean; message: string; buttons: string[] }> {
+    const response = await fetch(IR_LEARN_API, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ device_id: deviceId, codes })
+    });
+    return response.json();
+  },
+
   async learnIRCode(deviceId: number, button: string, irCode: string): Promise<{ success: boolean; message: string }> {
     const response = await fetch(IR_LEARN_API, {
       method: 'POST',
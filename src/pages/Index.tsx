@@ -9,17 +9,73 @@ import DeviceList from '@/components/DeviceList';
 import GroupsPanel from '@/components/GroupsPanel';
 import HistoryPanel from '@/components/HistoryPanel';
 import SettingsPanel from '@/components/SettingsPanel';
-import { api, type Device } from '@/lib/api';
+import { api, type ChangeEvent, type Device, type DeviceGroup } from '@/lib/api';
 
 const Index = () => {
   const [activeTab, setActiveTab] = useState('remote');
   const [selectedDevice, setSelectedDevice] = useState<Device | null>(null);
   const [devices, setDevices] = useState<Device[]>([]);
+  const [groups, setGroups] = useState<DeviceGroup[]>();
+  const [settings, setSettings] = useState<Record<string, string>>();
+  // Панели берут данные из стартового пакета и идут в API сами, только если его не было
+  const bootstrapped = settings !== undefined;
 
   useEffect(() => {
-    loadDevices();
+    let active = true;
+    let unsubscribe = () => {};
+    const handleChange = (change: ChangeEvent) => {
+      if (change.table === 'app_settings') {
+        setSettings((prev) => {
+          if (!prev) return prev;
+          const next = { ...prev };
+          if (change.op === 'DELETE') {
+            delete next[change.key!];
+          } else {
+            next[change.key!] = change.value ?? '';
+          }
+          return next;
+        });
+        return;
+      }
+      if (change.table !== 'devices') return;
+      if (change.op === 'UPDATE' && change.status) {
+        setDevices((prev) => prev.map((device) => (device.id === change.id ? { ...device, status: change.status! } : device)));
+      } else {
+        loadDevices();
+      }
+    };
+    // Лента продолжается с курсора пакета; после сброса пакет читается заново и подписка начинается с него
+    const subscribe = async (fresh: boolean) => {
+      unsubscribe();
+      const cursor = await loadBootstrap(fresh);
+      if (active) {
+        unsubscribe = api.subscribeChanges(cursor, handleChange, () => subscribe(true));
+      }
+    };
+    subscribe(false);
+    return () => {
+      active = false;
+      unsubscribe();
+    };
   }, []);
 
+  const loadBootstrap = async (fresh = false): Promise<string | null> => {
+    try {
+      const bundle = await api.getBootstrap(fresh);
+      setDevices(bundle.devices);
+      setGroups(bundle.groups);
+      setSettings(bundle.settings);
+      if (bundle.devices.length > 0) {
+        setSelectedDevice((prev) => prev ?? bundle.devices[0]);
+      }
+      return bundle.cursor;
+    } catch (error) {
+      console.error('Failed to load bootstrap bundle:', error);
+      loadDevices();
+      return null;
+    }
+  };
+
   const loadDevices = async () => {
     try {
       const devicesData = await api.getDevices();
@@ -98,7 +154,7 @@ const Index = () => {
           </TabsContent>
 
           <TabsContent value="groups" className="mt-0">
-            <GroupsPanel />
+            <GroupsPanel initialGroups={groups} />
           </TabsContent>
 
           <TabsContent value="history" className="mt-0">
@@ -106,7 +162,7 @@ const Index = () => {
           </TabsContent>
 
           <TabsContent value="settings" className="mt-0">
-            <SettingsPanel />
+            <SettingsPanel initialSettings={settings} initialDevices={bootstrapped ? devices : undefined} />
           </TabsContent>
         </div>
 